@@ -0,0 +1,105 @@
+"""Run the benchmarks and write the results as JSON.
+
+    python -m benchmarks [--quick] [--only scan] [--output out.json]
+    python -m benchmarks --compare before.json after.json
+"""
+import dataclasses
+import json
+import logging
+import platform
+import subprocess
+from datetime import UTC, datetime
+
+import click
+
+from benchmarks import (
+    bench_codecs,
+    bench_pipeline,
+    bench_polls,
+    bench_scan,
+    bench_startup,
+)
+from benchmarks.common import Result
+
+SUITES = {
+    "codecs": bench_codecs,
+    "polls": bench_polls,
+    "scan": bench_scan,
+    "pipeline": bench_pipeline,
+    "startup": bench_startup,
+}
+# lower is better for everything but throughput
+HIGHER_IS_BETTER = {"steps/s"}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _keyed(path: str) -> dict[str, Result]:
+    with open(path) as f:
+        report = json.load(f)
+    results = [Result(**result) for result in report["results"]]
+    return {result.key: result for result in results}
+
+
+def compare(before_path: str, after_path: str) -> None:
+    before, after = _keyed(before_path), _keyed(after_path)
+    for key, new in after.items():
+        old = before.get(key)
+        if old is None:
+            continue
+        ratio = new.value / old.value if old.value else float("inf")
+        if new.unit in HIGHER_IS_BETTER:
+            ratio = 1 / ratio if ratio else float("inf")
+        # above 1 is a slowdown
+        click.echo(
+            f"{ratio:6.2f}x  {key}  "
+            f"{old.value:.3f} -> {new.value:.3f} {new.unit}"
+        )
+
+
+@click.command()
+@click.option("--quick", is_flag=True, help="Small sizes only.")
+@click.option("--only", multiple=True, type=click.Choice(list(SUITES)))
+@click.option("--output", type=click.Path(dir_okay=False))
+@click.option("--compare", "compare_paths", nargs=2, type=click.Path())
+def main(
+    quick: bool,
+    only: tuple[str, ...],
+    output: str | None,
+    compare_paths: tuple[str, str] | None,
+) -> None:
+    if compare_paths:
+        compare(*compare_paths)
+        return
+    logging.disable(logging.WARNING)
+    results = []
+    for name in only or SUITES:
+        click.echo(f"Running {name}", err=True)
+        results += SUITES[name].run(quick=quick)
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "created_at": datetime.now(tz=UTC).isoformat(),
+        "quick": quick,
+        "results": [dataclasses.asdict(result) for result in results],
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        click.echo(text)
+
+
+if __name__ == "__main__":
+    main()
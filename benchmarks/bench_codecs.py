@@ -0,0 +1,46 @@
+"""Per-document dump/load cost, marshmallow_recipe vs pinhead.codecs."""
+import marshmallow_recipe as mr
+
+from benchmarks.common import Result, per_op
+from pinhead.codecs import ACTION_CODEC, ACTION_JSON_CODEC
+from pinhead.data import ActionData, PipelineStep
+from tests.data import (
+    generate_action_data,
+    generate_poll_data,
+    generate_vote_data,
+)
+
+
+def make_action(votes: int) -> ActionData:
+    action = generate_action_data(step=PipelineStep.POLL)
+    action.poll = generate_poll_data()
+    action.poll.votes = [generate_vote_data(user_id=x) for x in range(votes)]
+    action.poll.counts = [votes, 0]
+    return action
+
+
+def run(quick: bool = False) -> list[Result]:
+    results = []
+    for votes in (0, 50) if quick else (0, 50, 500):
+        action = make_action(votes)
+        json_doc = mr.dump(action)
+        bson_doc = ACTION_CODEC.dump(action)
+        number = 200 if quick else 2_000
+        cases = {
+            ("mr", "dump"): lambda: mr.dump(action),
+            ("mr", "load"): lambda: mr.load(ActionData, json_doc),
+            ("bson", "dump"): lambda: ACTION_CODEC.dump(action),
+            ("bson", "load"): lambda: ACTION_CODEC.load(bson_doc),
+            ("json", "dump"): lambda: ACTION_JSON_CODEC.dump(action),
+            ("json", "load"): lambda: ACTION_JSON_CODEC.load(json_doc),
+        }
+        for (codec, op), func in cases.items():
+            results.append(
+                Result(
+                    name=f"codecs.{op}",
+                    params={"codec": codec, "votes": votes},
+                    value=per_op(func, number=max(number // (votes or 1), 20)),
+                    unit="us/op",
+                )
+            )
+    return results
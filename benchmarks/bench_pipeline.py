@@ -0,0 +1,67 @@
+"""Pipeline step throughput against a fake bot and the in-memory store.
+
+Every pass runs ``execute_scheduled_actions`` once, which moves each due
+action one step further: start -> poll -> consensus -> execute -> done.
+"""
+import asyncio
+import time
+
+from benchmarks.common import Result, make_context
+from pinhead import pipeline
+from pinhead.constants import (
+    DEFAULT_CONSENSUS,
+    DEFAULT_PIPELINE_CONCURRENCY,
+)
+from pinhead.data import PipelineStep
+from pinhead.store import MemoryActionStore
+from tests.data import generate_action_data, generate_vote_data
+
+CHATS = 100
+
+
+async def run_pipeline(size: int) -> list[Result]:
+    pipeline.set_concurrency(DEFAULT_PIPELINE_CONCURRENCY)
+    store = MemoryActionStore()
+    ctx = make_context(store)
+    for idx in range(size):
+        action = generate_action_data()
+        action.chat_id = idx % CHATS
+        await store.store_action(action)
+
+    results = []
+    for step in (
+        PipelineStep.START,
+        PipelineStep.POLL,
+        PipelineStep.CONSENSUS,
+        PipelineStep.EXECUTE,
+    ):
+        if step == PipelineStep.POLL:
+            votes = [
+                (action.action_id, generate_vote_data(user_id=user_id))
+                async for action in store.iter_ready_actions()
+                for user_id in range(DEFAULT_CONSENSUS)
+            ]
+            await store.store_votes(votes)
+        started = time.perf_counter()
+        await pipeline.execute_scheduled_actions(ctx)
+        elapsed = time.perf_counter() - started
+        results.append(
+            Result(
+                name="pipeline.step",
+                params={"step": step.value, "actions": size},
+                value=size / elapsed,
+                unit="steps/s",
+            )
+        )
+
+    assert not [x async for x in store.iter_ready_actions()]
+    await ctx.application.dispatcher.close()
+    pipeline._pending.clear()
+    return results
+
+
+def run(quick: bool = False) -> list[Result]:
+    results = []
+    for size in (100,) if quick else (100, 1_000, 10_000):
+        results += asyncio.run(run_pipeline(size))
+    return results
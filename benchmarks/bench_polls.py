@@ -0,0 +1,54 @@
+"""Poll tallying and the per-action log line, 10 to 10k votes."""
+import functools
+from collections.abc import Callable
+from typing import Any
+
+from benchmarks.common import Result, per_op
+from pinhead.data import ActionData, PipelineStep
+from pinhead.helpers import log_format_action
+from pinhead.pipeline import calculate_poll_results
+from pinhead.store.base import apply_vote, tally
+from tests.data import (
+    generate_action_data,
+    generate_poll_data,
+    generate_vote_data,
+)
+
+
+def make_poll_action(votes: int) -> ActionData:
+    action = generate_action_data(step=PipelineStep.POLL)
+    action.poll = generate_poll_data()
+    action.poll.votes = [
+        generate_vote_data(user_id=x) for x in range(1, votes + 1)
+    ]
+    action.poll.counts = tally(action.poll)
+    return action
+
+
+def run(quick: bool = False) -> list[Result]:
+    results = []
+    for votes in (10, 1_000) if quick else (10, 100, 1_000, 10_000):
+        action = make_poll_action(votes)
+        poll = action.poll
+        assert poll is not None
+        legacy = make_poll_action(votes)
+        assert legacy.poll is not None
+        legacy.poll.counts = []
+        vote = generate_vote_data(user_id=votes // 2)
+        number = max(10_000 // votes, 20)
+        cases: dict[str, Callable[[], Any]] = {
+            "poll.results": lambda: calculate_poll_results(action),
+            "poll.results_from_votes": lambda: calculate_poll_results(legacy),
+            "poll.apply_vote": functools.partial(apply_vote, poll, vote),
+            "log_format_action": lambda: log_format_action(action),
+        }
+        for name, func in cases.items():
+            results.append(
+                Result(
+                    name=name,
+                    params={"votes": votes},
+                    value=per_op(func, number=number),
+                    unit="us/op",
+                )
+            )
+    return results
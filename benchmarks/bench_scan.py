@@ -0,0 +1,90 @@
+"""Ready-action scans over 1k to 1M stored actions, 1% of them due.
+
+A scan goes the way of ``execute_scheduled_actions``: due actions are
+claimed in batches, each one is read again as its worker claims it, and
+the leases are released at the end.
+"""
+import asyncio
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks.common import Result
+from pinhead.clock import utcnow
+from pinhead.data import PipelineStep
+from pinhead.store import (
+    ActionStore,
+    MemoryActionStore,
+    SqliteActionStore,
+)
+from tests.data import generate_action_data
+
+READY_SHARE = 100  # one in a hundred actions is due
+OWNER = "bench"
+
+
+async def fill(store: ActionStore, size: int) -> None:
+    now = utcnow()
+    await store.ensure_indexes()
+    for idx in range(size):
+        if idx % READY_SHARE:
+            execute_at = now + timedelta(hours=1, seconds=idx)
+        else:
+            execute_at = now - timedelta(seconds=size - idx)
+        await store.store_action(
+            generate_action_data(execute_at=execute_at, step=PipelineStep.POLL)
+        )
+
+
+async def scan(store: ActionStore, repeat: int = 5) -> tuple[float, int]:
+    best, found = float("inf"), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        lease_until = utcnow() + timedelta(minutes=1)
+        claimed: list[str] = []
+        while batch := await store.claim_ready(OWNER, lease_until):
+            for ref in batch:
+                await store.claim(ref.action_id, OWNER, lease_until)
+            claimed += [x.action_id for x in batch]
+        await store.release_leases(OWNER, claimed)
+        best = min(best, time.perf_counter() - started)
+        found = len(claimed)
+    return best, found
+
+
+async def run_store(backend: str, size: int, tmp: Path) -> list[Result]:
+    if backend == "sqlite":
+        store: ActionStore = SqliteActionStore(str(tmp / f"scan-{size}.db"))
+    else:
+        store = MemoryActionStore()
+    started = time.perf_counter()
+    await fill(store, size)
+    fill_time = time.perf_counter() - started
+    scan_time, found = await scan(store)
+    await store.close()
+    params = {"backend": backend, "stored": size}
+    return [
+        Result(
+            name="scan.ready_actions",
+            params={**params, "ready": found},
+            value=scan_time * 1e3,
+            unit="ms",
+        ),
+        Result(
+            name="store.insert",
+            params=params,
+            value=fill_time / size * 1e6,
+            unit="us/op",
+        ),
+    ]
+
+
+def run(quick: bool = False) -> list[Result]:
+    sizes = (1_000, 10_000) if quick else (1_000, 10_000, 100_000, 1_000_000)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("memory", "sqlite"):
+            for size in sizes:
+                results += asyncio.run(run_store(backend, size, Path(tmp)))
+    return results
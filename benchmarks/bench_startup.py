@@ -0,0 +1,38 @@
+"""Time to the first handled update, from a fresh interpreter each run.
+
+Every sample is a ``benchmarks.startup_probe`` subprocess, so module
+imports are paid the way a cold start pays them. The median of each
+phase is reported, with and without fast start.
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import Result
+
+
+def sample(fast_start: bool) -> dict[str, float]:
+    args = [sys.executable, "-m", "benchmarks.startup_probe"]
+    if fast_start:
+        args.append("--fast-start")
+    output = subprocess.run(
+        args, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(quick: bool = False) -> list[Result]:
+    results = []
+    for fast_start in (False, True):
+        samples = [sample(fast_start) for _ in range(3 if quick else 10)]
+        for phase in samples[0]:
+            results.append(
+                Result(
+                    name=f"startup.{phase}",
+                    params={"fast_start": fast_start},
+                    value=statistics.median(x[phase] for x in samples) * 1000,
+                    unit="ms",
+                )
+            )
+    return results
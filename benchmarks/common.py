@@ -0,0 +1,91 @@
+import dataclasses
+import itertools
+import time
+from collections.abc import Callable
+from types import SimpleNamespace
+from typing import Any
+
+from pinhead.cache import LRUCache
+from pinhead.cleanup import CleanupQueue
+from pinhead.dispatcher import TelegramDispatcher
+from pinhead.scheduler import ActionScheduler
+from pinhead.store import ActionStore
+
+UNLIMITED = 1e9
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class Result:
+    name: str
+    params: dict[str, Any] = dataclasses.field(default_factory=dict)
+    value: float
+    unit: str
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.name}[{params}]" if params else self.name
+
+
+def per_op(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """Best of ``repeat`` runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return best / number * 1e6
+
+
+class FakeBot:
+    """Accepts any bot API call and answers instantly."""
+
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+        self.calls = 0
+
+    async def send_poll(self, chat_id: int, *args: Any, **kwargs: Any) -> Any:
+        self.calls += 1
+        message_id = next(self._ids)
+        return SimpleNamespace(
+            message_id=str(message_id),
+            poll=SimpleNamespace(id=f"p{message_id}"),
+        )
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        async def call(*args: Any, **kwargs: Any) -> bool:
+            self.calls += 1
+            return True
+
+        return call
+
+
+class FakeJob:
+    def schedule_removal(self) -> None:
+        pass
+
+
+class FakeJobQueue:
+    """Swallows jobs, the benchmarks drive the pipeline themselves."""
+
+    def run_once(self, *args: Any, **kwargs: Any) -> FakeJob:
+        return FakeJob()
+
+
+def make_context(store: ActionStore) -> Any:
+    """A CallbackContext look-alike with the attributes the pipeline uses."""
+    job_queue = FakeJobQueue()
+    application = SimpleNamespace(
+        store=store,
+        node_id="bench",
+        scheduler=ActionScheduler(job_queue, None),  # type: ignore
+        dispatcher=TelegramDispatcher(
+            UNLIMITED, UNLIMITED, UNLIMITED, UNLIMITED
+        ),
+        cleanup_queue=CleanupQueue(),
+        poll_cache=LRUCache(maxsize=int(UNLIMITED), ttl=UNLIMITED),
+    )
+    return SimpleNamespace(
+        bot=FakeBot(), job_queue=job_queue, application=application
+    )
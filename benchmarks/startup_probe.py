@@ -0,0 +1,152 @@
+"""One cold start of the webhook bot, in the interpreter it runs in.
+
+    python -m benchmarks.startup_probe [--fast-start]
+
+Starts the bot on a local port with the in-memory store and the bot API
+answered in process, posts a /ban once the port accepts, and prints the
+startup breakdown as JSON after that update is handled.
+"""
+from pinhead.startup import STARTUP, load_application  # isort: skip
+
+import asyncio
+import json
+import socket
+import sys
+from typing import Any
+
+from aiohttp import ClientError, ClientSession
+
+from pinhead.config import create_config
+from pinhead.ingest import (
+    SECRET_HEADER,
+    RecentIds,
+    UpdateQueue,
+    WebhookIngest,
+    serve,
+)
+
+SECRET = "secret"
+CHAT = {"id": -100, "type": "supergroup", "title": "bench"}
+SPAMMER = {"id": 7, "is_bot": False, "first_name": "spam"}
+ADMIN = {"id": 8, "is_bot": False, "first_name": "admin"}
+BAN = {
+    "update_id": 1,
+    "message": {
+        "message_id": 11,
+        "date": 0,
+        "chat": CHAT,
+        "from": ADMIN,
+        "text": "/ban",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 4}],
+        "reply_to_message": {
+            "message_id": 10,
+            "date": 0,
+            "chat": CHAT,
+            "from": SPAMMER,
+            "text": "buy now",
+        },
+    },
+}
+RESULTS: dict[str, Any] = {
+    "getMe": {
+        "id": 1,
+        "is_bot": True,
+        "first_name": "pinhead",
+        "username": "pinhead_bot",
+    },
+    "sendPoll": {
+        "message_id": 12,
+        "date": 0,
+        "chat": CHAT,
+        "poll": {
+            "id": "p1",
+            "question": "Ban?",
+            "options": [],
+            "total_voter_count": 0,
+            "is_closed": False,
+            "is_anonymous": False,
+            "type": "regular",
+            "allows_multiple_answers": False,
+        },
+    },
+}
+
+
+def _local_api() -> Any:
+    from telegram.request import BaseRequest
+
+    class LocalBotApi(BaseRequest):
+        """Answers every bot API call at once, without a network."""
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        async def do_request(
+            self, url: str, method: str, *args: Any, **kwargs: Any
+        ) -> tuple[int, bytes]:
+            result = RESULTS.get(url.rsplit("/", 1)[-1], True)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return LocalBotApi()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _post_first_update(url: str, stop: asyncio.Event) -> None:
+    async with ClientSession() as session:
+        while True:
+            try:
+                async with session.post(
+                    url, json=BAN, headers={SECRET_HEADER: SECRET}
+                ) as response:
+                    if response.status == 200:
+                        break
+            except ClientError:
+                pass
+            await asyncio.sleep(0.005)
+    await STARTUP.first_update.wait()
+    stop.set()
+
+
+async def probe(fast_start: bool) -> None:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/hook"
+    cfg = create_config(
+        {
+            "CYCLIC_URL": url,
+            "TG_API_TOKEN": "1:local",
+            "TG_SECRET_TOKEN": SECRET,
+            "STORAGE_BACKEND": "memory",
+        }
+    )
+    ingest = WebhookIngest(
+        secret_token=SECRET,
+        queue=UpdateQueue(maxsize=cfg.ingest_queue_size),
+        recent_ids=RecentIds(cfg.ingest_dedup_window),
+        workers=cfg.ingest_workers,
+    )
+    cfg.fast_start = fast_start
+    stop = asyncio.Event()
+    client = asyncio.create_task(_post_first_update(url, stop))
+    await serve(
+        lambda: load_application(cfg, polling=False, request=_local_api()),
+        ingest,
+        listen="127.0.0.1",
+        port=port,
+        webhook_url=url,
+        fast_start=fast_start,
+        stop=stop,
+    )
+    await client
+
+
+if __name__ == "__main__":
+    asyncio.run(probe(fast_start="--fast-start" in sys.argv))
+    print(json.dumps(STARTUP.phases))
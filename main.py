@@ -1,13 +1,12 @@
+# first, so the startup clock runs while everything else is imported
+from pinhead.startup import STARTUP, load_application  # isort: skip
+
 import logging
 import os
 
 import click
-from mongopersistence import MongoPersistence
-from motor.motor_asyncio import AsyncIOMotorClient
-from telegram.ext import Application, ApplicationBuilder
 
 from pinhead.config import create_config
-from pinhead.handlers import setup_handlers
 
 logger = logging.getLogger(__name__)
 
@@ -17,54 +16,53 @@ logging.basicConfig(
 )
 
 
-class DBApplication(Application):
-    def __init__(self, db: AsyncIOMotorClient, **kwargs):
-        super().__init__(**kwargs)
-        self.db = db
-
-
 @click.command()
 @click.option("--polling", is_flag=True)
-def start_bot(polling: bool = False):
+@click.option(
+    "--fast-start",
+    is_flag=True,
+    help="Accept updates first, load and warm up behind. Same as FAST_START.",
+)
+def start_bot(polling: bool = False, fast_start: bool = False):
     cfg = create_config(os.environ)
-
-    MongoPersistence(
-        mongo_url=cfg.mongo_uri,
-        db_name=cfg.mongo_db_name,
-        name_col_user_data="user_data",
-        name_col_chat_data="chat_data",
-        name_col_bot_data="bot_data",
-        create_col_if_not_exist=True,
-        ignore_general_data=["cache"],
-    )
-
-    application = (
-        ApplicationBuilder()
-        .application_class(
-            DBApplication,
-            kwargs={
-                "db": AsyncIOMotorClient(cfg.mongo_uri).get_database(
-                    cfg.mongo_db_name
-                ),
-            },
-        )
-        .token(cfg.tg_api_token)
-        # .persistence(persistence)
-        .build()
-    )
-
-    setup_handlers(application)
+    cfg.fast_start = cfg.fast_start or fast_start
 
     if polling:
+        with STARTUP.phase("imports"):
+            from pinhead.app import build_application
+        with STARTUP.phase("build"):
+            application = build_application(cfg, polling=True)
         application.run_polling()
-    else:
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=cfg.service_port,
-            webhook_url=cfg.service_url,
-            secret_token=cfg.secret_token,
+        return
+
+    # telegram and motor are imported by load_application, the ingest
+    # only needs aiohttp to start acknowledging updates
+    with STARTUP.phase("ingest_imports"):
+        from pinhead.ingest import (
+            RecentIds,
+            UpdateQueue,
+            WebhookIngest,
+            run_webhook,
         )
 
+    ingest = WebhookIngest(
+        secret_token=cfg.secret_token,
+        queue=UpdateQueue(
+            maxsize=cfg.ingest_queue_size,
+            overflow=cfg.ingest_overflow,
+        ),
+        recent_ids=RecentIds(cfg.ingest_dedup_window),
+        workers=cfg.ingest_workers,
+    )
+    run_webhook(
+        lambda: load_application(cfg, polling=False),
+        ingest,
+        listen="0.0.0.0",
+        port=cfg.service_port,
+        webhook_url=cfg.service_url,
+        fast_start=cfg.fast_start,
+    )
+
 
 if __name__ == "__main__":
     start_bot()
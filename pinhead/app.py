@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from telegram.ext import Application, ApplicationBuilder
+from telegram.request import BaseRequest
+
+from pinhead.archive import ArchivePolicy
+from pinhead.cache import LRUCache
+from pinhead.cleanup import CleanupQueue, flush_cleanup_queue
+from pinhead.config import Config
+from pinhead.constants import (
+    POLL_CACHE_TTL,
+    RECENT_AUTHORS_SIZE,
+    RECENT_AUTHORS_TTL,
+)
+from pinhead.data import PollRef, TargetData
+from pinhead.dispatcher import TelegramDispatcher
+from pinhead.handlers import setup_handlers
+from pinhead.helpers import ensured
+from pinhead.metrics import start_metrics_server
+from pinhead.outbox import reconcile_intents
+from pinhead.pipeline import (
+    execute_due_actions,
+    set_concurrency,
+    set_scan_batch_size,
+)
+from pinhead.scheduler import ActionScheduler
+from pinhead.startup import STARTUP
+from pinhead.store import ActionStore, create_store
+from pinhead.votes import VoteBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class DBApplication(Application):
+    def __init__(
+        self,
+        store: ActionStore,
+        vote_buffer: VoteBuffer,
+        metrics_port: int,
+        node_id: str,
+        archive_policy: ArchivePolicy,
+        fast_start: bool,
+        poll_cache_size: int,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.store = store
+        self.node_id = node_id
+        self.archive_policy = archive_policy
+        self.fast_start = fast_start
+        self.startup_task: asyncio.Task | None = None
+        self.metrics_port = metrics_port
+        self.metrics_runner: web.AppRunner | None = None
+        self.vote_buffer = vote_buffer
+        self.scheduler = ActionScheduler(
+            ensured(self.job_queue), execute_due_actions
+        )
+        self.dispatcher = TelegramDispatcher()
+        self.cleanup_queue = CleanupQueue()
+        self.poll_cache: LRUCache[str, PollRef] = LRUCache(
+            maxsize=poll_cache_size, ttl=POLL_CACHE_TTL
+        )
+        # (chat id, lowercase username) -> the author's last message seen
+        # by this process; other replicas keep their own
+        self.recent_authors: LRUCache[tuple[int, str], TargetData] = LRUCache(
+            maxsize=RECENT_AUTHORS_SIZE, ttl=RECENT_AUTHORS_TTL
+        )
+
+    async def initialize(self) -> None:
+        # getMe opens the bot API connection, pings open the database
+        # pool, neither has to wait for the other
+        with STARTUP.phase("warm_up"):
+            await asyncio.gather(super().initialize(), self.store.warm_up())
+
+
+async def ensure_indexes(application: Application) -> None:
+    store = application.store  # type: ignore
+    with STARTUP.phase("indexes"):
+        await store.ensure_indexes()
+    logger.info(f"Ensured indexes of {type(store).__name__}")
+
+
+async def restore_state(application: Application) -> None:
+    store = application.store  # type: ignore
+    with STARTUP.phase("intents"):
+        # calls cut short by a crash, their steps make them again
+        unknown = await reconcile_intents(store)
+    if unknown:
+        logger.warning(f"Dropped {unknown} intents with unknown outcome")
+    scheduler = application.scheduler  # type: ignore
+    with STARTUP.phase("schedule"):
+        scheduler.load(await store.fetch_scheduled_actions())
+
+
+async def serve_metrics(application: Application) -> None:
+    port = application.metrics_port  # type: ignore
+    if port:
+        runner = await start_metrics_server(port)
+        application.metrics_runner = runner  # type: ignore
+
+
+async def prepare(application: Application) -> None:
+    await ensure_indexes(application)
+    await serve_metrics(application)
+
+
+async def on_startup(application: Application) -> None:
+    if not application.fast_start:  # type: ignore
+        await ensure_indexes(application)
+        await restore_state(application)
+        await serve_metrics(application)
+        return
+    # open intents are dropped before any step runs, reconciling next to
+    # a running step would drop the intent of a call it is making
+    await restore_state(application)
+    # indexes and metrics are not needed for the first update
+    startup_task = asyncio.create_task(prepare(application))
+    startup_task.add_done_callback(_stop_if_failed)
+    application.startup_task = startup_task  # type: ignore
+
+
+def _stop_if_failed(task: asyncio.Task) -> None:
+    if task.cancelled() or task.exception() is None:
+        return
+    # the same failure stops a normal start in post_init; both the
+    # polling and the webhook runner shut down gracefully on SIGTERM
+    logger.critical(
+        "Startup preparation failed, stopping", exc_info=task.exception()
+    )
+    signal.raise_signal(signal.SIGTERM)
+
+
+async def on_shutdown(application: Application) -> None:
+    startup_task = application.startup_task  # type: ignore
+    if startup_task is not None and not startup_task.done():
+        startup_task.cancel()
+    elif startup_task is not None and not startup_task.cancelled():
+        if error := startup_task.exception():
+            logger.error(f"Stopped after a failed start: {error!r}")
+    vote_buffer = application.vote_buffer  # type: ignore
+    await vote_buffer.flush(application.store)  # type: ignore
+    await flush_cleanup_queue(
+        application.bot,
+        application.dispatcher,  # type: ignore
+        application.cleanup_queue,  # type: ignore
+    )
+    await application.dispatcher.close()  # type: ignore
+    await application.store.close()  # type: ignore
+    metrics_runner = application.metrics_runner  # type: ignore
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+def build_application(
+    cfg: Config, polling: bool, request: BaseRequest | None = None
+) -> Application:
+    """The bot with its handlers, ``request`` replaces the bot API client."""
+    perf = cfg.performance
+    set_concurrency(perf.pipeline_concurrency)
+    set_scan_batch_size(perf.scan_batch_size)
+    builder = (
+        ApplicationBuilder()
+        .application_class(
+            DBApplication,
+            kwargs={
+                "store": create_store(cfg),
+                # the webhook app serves /metrics itself
+                "metrics_port": cfg.metrics_port if polling else 0,
+                "node_id": cfg.node_id,
+                "archive_policy": ArchivePolicy(
+                    after=cfg.archive_after, ttl=cfg.archive_ttl
+                ),
+                "fast_start": cfg.fast_start,
+                "poll_cache_size": perf.poll_cache_size,
+                "vote_buffer": VoteBuffer(
+                    window=cfg.vote_buffer_window_ms / 1000,
+                    max_votes=cfg.vote_buffer_max_votes,
+                ),
+            },
+        )
+        .token(cfg.tg_api_token)
+        .post_init(on_startup)
+        .post_stop(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    else:
+        builder = (
+            builder.connection_pool_size(perf.tg_connection_pool_size)
+            .pool_timeout(perf.tg_pool_timeout)
+            .read_timeout(perf.tg_read_timeout)
+        )
+    application = builder.build()
+    setup_handlers(application, reconcile_period=perf.reconcile_period)
+    return application
@@ -0,0 +1,43 @@
+import dataclasses
+import logging
+from datetime import timedelta
+
+from pinhead.clock import utcnow
+from pinhead.constants import ARCHIVE_BATCH_SIZE
+from pinhead.metrics import ARCHIVED_ACTIONS
+from pinhead.store.base import ActionStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class ArchivePolicy:
+    # seconds a finished action stays with the live ones
+    after: int
+    # seconds an archived action is kept, 0 keeps it forever
+    ttl: int
+
+
+async def archive_finished(
+    store: ActionStore, policy: ArchivePolicy
+) -> tuple[int, int]:
+    """Archive old finished actions and purge expired archived ones.
+
+    Works in batches, so one run never holds a long write. Returns the
+    number of actions archived and purged.
+    """
+    now = utcnow()
+    archived = 0
+    while True:
+        moved = await store.archive_finished(
+            now - timedelta(seconds=policy.after), ARCHIVE_BATCH_SIZE
+        )
+        archived += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+    purged = 0
+    if policy.ttl:
+        purged = await store.purge_archive(now - timedelta(seconds=policy.ttl))
+    ARCHIVED_ACTIONS.inc("archived", amount=archived)
+    ARCHIVED_ACTIONS.inc("purged", amount=purged)
+    return archived, purged
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+import telegram
+from more_itertools import chunked
+
+from pinhead.dispatcher import Priority, TelegramDispatcher
+
+logger = logging.getLogger(__name__)
+
+# deleteMessages accepts up to 100 ids per call
+MAX_DELETE_BATCH = 100
+
+
+class CleanupQueue:
+    """Messages waiting to be deleted, grouped by chat."""
+
+    def __init__(self) -> None:
+        self._pending: defaultdict[int, list[str]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._pending.values())
+
+    def add(self, chat_id: int, *message_ids: str) -> bool:
+        """Queue message ids, returns True if the queue was empty."""
+        was_empty = not self._pending
+        self._pending[chat_id].extend(message_ids)
+        return was_empty
+
+    def drain(self) -> dict[int, list[str]]:
+        pending, self._pending = self._pending, defaultdict(list)
+        return dict(pending)
+
+
+async def delete_messages(
+    bot: telegram.Bot,
+    dispatcher: TelegramDispatcher,
+    chat_id: int,
+    message_ids: list[str],
+) -> None:
+    for chunk in chunked(dict.fromkeys(message_ids), MAX_DELETE_BATCH):
+        try:
+            await dispatcher.call(
+                Priority.CLEANUP, bot.delete_messages, chat_id, chunk
+            )
+            continue
+        except telegram.error.BadRequest:
+            # one by one, so a single undeletable message spares the rest
+            logger.info(f"Bulk delete failed in chat {chat_id}")
+        for message_id in chunk:
+            try:
+                await dispatcher.call(
+                    Priority.CLEANUP, bot.delete_message, chat_id, message_id
+                )
+            except telegram.error.BadRequest:
+                logger.info(f"Failed to delete message {message_id}")
+
+
+async def flush_cleanup_queue(
+    bot: telegram.Bot, dispatcher: TelegramDispatcher, queue: CleanupQueue
+) -> None:
+    pending = queue.drain()
+    results = await asyncio.gather(
+        *(
+            delete_messages(bot, dispatcher, chat_id, message_ids)
+            for chat_id, message_ids in pending.items()
+        ),
+        return_exceptions=True,
+    )
+    for chat_id, result in zip(pending, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Cleanup failed in chat {chat_id}", exc_info=result)
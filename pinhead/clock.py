@@ -0,0 +1,12 @@
+from datetime import UTC, datetime
+
+
+def utcnow() -> datetime:
+    return datetime.now(tz=UTC)
+
+
+def as_utc(value: datetime) -> datetime:
+    # naive values are treated as UTC, the way they were always produced
+    if value.tzinfo is None:
+        return value.replace(tzinfo=UTC)
+    return value.astimezone(UTC)
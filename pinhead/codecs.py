@@ -0,0 +1,119 @@
+import dataclasses
+import types
+import typing
+from collections.abc import Callable
+from datetime import datetime
+from enum import Enum
+from typing import Any, Generic, TypeVar
+
+from pinhead.clock import as_utc
+from pinhead.data import ActionData, IntentData, PollData, VoteData
+
+T = TypeVar("T")
+
+Converter = Callable[[Any], Any] | None
+
+_MISSING = dataclasses.MISSING
+
+
+def _load_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return as_utc(value)
+
+
+def _dump_isoformat(value: datetime) -> str:
+    return as_utc(value).isoformat()
+
+
+class Codec(Generic[T]):
+    """Dump and load a dataclass from ``pinhead.data`` without marshmallow.
+
+    The per-field converters are worked out once from the type hints, so
+    a dump or a load is a single pass over the fields. The output is the
+    same as ``mr.dump``: None fields are left out, enums are stored by
+    value. Datetimes are kept as native values with ``native_datetimes``
+    (BSON), otherwise dumped as ISO strings (JSON). Loading accepts both.
+
+    Nothing is validated on load, documents are expected to come from our
+    own storage.
+    """
+
+    def __init__(self, cls: type[T], *, native_datetimes: bool):
+        self.cls = cls
+        self.native_datetimes = native_datetimes
+        hints = typing.get_type_hints(cls)
+        self._fields: list[tuple[str, Converter, Converter, Any]] = [
+            (
+                field.name,
+                *self._converters(hints[field.name]),
+                self._missing(field, hints[field.name]),
+            )
+            for field in dataclasses.fields(cls)  # type: ignore[arg-type]
+        ]
+
+    @staticmethod
+    def _missing(field: dataclasses.Field, hint: Any) -> Any:
+        # a left out optional field without a default loads as None
+        has_default = (
+            field.default is not _MISSING
+            or field.default_factory is not _MISSING
+        )
+        if not has_default and types.NoneType in typing.get_args(hint):
+            return None
+        return _MISSING
+
+    def _converters(self, hint: Any) -> tuple[Converter, Converter]:
+        origin = typing.get_origin(hint)
+        if origin in (types.UnionType, typing.Union):
+            # only `X | None` is used, None is handled by dump and load
+            (hint,) = set(typing.get_args(hint)) - {types.NoneType}
+            return self._converters(hint)
+        if origin is list:
+            (item,) = typing.get_args(hint)
+            dump_item, load_item = self._converters(item)
+            if dump_item is None and load_item is None:
+                return list, list
+            return (
+                lambda v: [dump_item(x) for x in v],  # type: ignore[misc]
+                lambda v: [load_item(x) for x in v],  # type: ignore[misc]
+            )
+        if dataclasses.is_dataclass(hint):
+            codec = Codec(hint, native_datetimes=self.native_datetimes)
+            return codec.dump, codec.load
+        if isinstance(hint, type) and issubclass(hint, Enum):
+            return (lambda v: v.value), hint
+        if hint is datetime:
+            if self.native_datetimes:
+                return as_utc, _load_datetime
+            return _dump_isoformat, _load_datetime
+        return None, None
+
+    def dump(self, obj: T) -> dict[str, Any]:
+        doc = {}
+        for name, dump, _, _ in self._fields:
+            value = getattr(obj, name)
+            if value is None:
+                continue
+            doc[name] = value if dump is None else dump(value)
+        return doc
+
+    def load(self, doc: dict[str, Any]) -> T:
+        kwargs = {}
+        for name, _, load, missing in self._fields:
+            value = doc.get(name, missing)
+            if value is _MISSING:
+                continue
+            if value is not None and load is not None:
+                value = load(value)
+            kwargs[name] = value
+        return self.cls(**kwargs)
+
+
+# BSON documents, datetimes stay native dates
+VOTE_CODEC = Codec(VoteData, native_datetimes=True)
+POLL_CODEC = Codec(PollData, native_datetimes=True)
+INTENT_CODEC = Codec(IntentData, native_datetimes=True)
+ACTION_CODEC = Codec(ActionData, native_datetimes=True)
+# JSON documents, datetimes are ISO strings, same as mr.dump
+ACTION_JSON_CODEC = Codec(ActionData, native_datetimes=False)
@@ -1,5 +1,75 @@
+import dataclasses
+import os
+import socket
+import typing
 from collections.abc import Mapping
 from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any
+
+import tomllib
+
+from pinhead.constants import (
+    DEFAULT_ARCHIVE_AFTER,
+    DEFAULT_ARCHIVE_TTL,
+    DEFAULT_INGEST_DEDUP_WINDOW,
+    DEFAULT_INGEST_OVERFLOW,
+    DEFAULT_INGEST_QUEUE_SIZE,
+    DEFAULT_INGEST_WORKERS,
+    DEFAULT_METRICS_PORT,
+    DEFAULT_MONGO_CONNECT_TIMEOUT_MS,
+    DEFAULT_MONGO_MAX_POOL_SIZE,
+    DEFAULT_MONGO_MIN_POOL_SIZE,
+    DEFAULT_MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    DEFAULT_MONGO_SOCKET_TIMEOUT_MS,
+    DEFAULT_MONGO_WRITE_CONCERN,
+    DEFAULT_PIPELINE_CONCURRENCY,
+    DEFAULT_SCAN_BATCH_SIZE,
+    DEFAULT_TG_CONNECTION_POOL_SIZE,
+    DEFAULT_TG_POOL_TIMEOUT,
+    DEFAULT_TG_READ_TIMEOUT,
+    DEFAULT_VOTE_BUFFER_MAX_VOTES,
+    DEFAULT_VOTE_BUFFER_WINDOW_MS,
+    POLL_CACHE_SIZE,
+    RECONCILE_PERIOD,
+)
+
+
+class Overflow(StrEnum):
+    """What the webhook ingest drops when its queue is full."""
+
+    # drop a queued non-command update, or the new one if it is one too
+    SHED = "shed"
+    DROP_NEW = "drop_new"
+    DROP_OLDEST = "drop_oldest"
+
+
+@dataclass(slots=True, kw_only=True)
+class PerformanceProfile:
+    """Throughput knobs, read by ``create_performance_profile``."""
+
+    mongo_max_pool_size: int = DEFAULT_MONGO_MAX_POOL_SIZE
+    mongo_min_pool_size: int = DEFAULT_MONGO_MIN_POOL_SIZE
+    mongo_connect_timeout_ms: int = DEFAULT_MONGO_CONNECT_TIMEOUT_MS
+    mongo_server_selection_timeout_ms: int = (
+        DEFAULT_MONGO_SERVER_SELECTION_TIMEOUT_MS
+    )
+    mongo_socket_timeout_ms: int = DEFAULT_MONGO_SOCKET_TIMEOUT_MS
+    # "majority" or the number of nodes to acknowledge a write
+    mongo_write_concern: str = DEFAULT_MONGO_WRITE_CONCERN
+    tg_connection_pool_size: int = DEFAULT_TG_CONNECTION_POOL_SIZE
+    # seconds
+    tg_pool_timeout: float = DEFAULT_TG_POOL_TIMEOUT
+    tg_read_timeout: float = DEFAULT_TG_READ_TIMEOUT
+    # seconds between full reconcile scans
+    reconcile_period: float = RECONCILE_PERIOD
+    scan_batch_size: int = DEFAULT_SCAN_BATCH_SIZE
+    pipeline_concurrency: int = DEFAULT_PIPELINE_CONCURRENCY
+    poll_cache_size: int = POLL_CACHE_SIZE
+
+
+# may be 0, everything else has to be positive
+_ZERO_ALLOWED = {"mongo_min_pool_size", "mongo_socket_timeout_ms"}
 
 
 @dataclass(slots=True, kw_only=True)
@@ -10,14 +80,130 @@ class Config:
     secret_token: str
     mongo_uri: str
     mongo_db_name: str
+    storage_backend: str
+    sqlite_path: str
+    vote_buffer_window_ms: int
+    vote_buffer_max_votes: int
+    metrics_port: int
+    # lease owner name, has to differ between replicas
+    node_id: str
+    ingest_queue_size: int
+    ingest_overflow: Overflow
+    ingest_dedup_window: int
+    ingest_workers: int
+    # seconds, see pinhead.archive.ArchivePolicy
+    archive_after: int
+    archive_ttl: int
+    # accept updates first, load and warm up behind, see pinhead.startup
+    fast_start: bool
+    performance: PerformanceProfile
 
 
 def create_config(env: Mapping[str, str]) -> Config:
-    return Config(
+    overflow = env.get("INGEST_OVERFLOW", DEFAULT_INGEST_OVERFLOW)
+    if overflow not in set(Overflow):
+        raise ValueError(
+            f"INGEST_OVERFLOW must be one of {', '.join(Overflow)}: "
+            f"{overflow}"
+        )
+    config = Config(
         service_url=str(env.get("CYCLIC_URL")),
         service_port=int(env.get("PORT", "3000")),
         tg_api_token=str(env.get("TG_API_TOKEN")),
         secret_token=str(env.get("TG_SECRET_TOKEN")),
         mongo_uri=str(env.get("MONGO_URI")),
         mongo_db_name=str(env.get("MONGO_DB_NAME")),
+        storage_backend=env.get("STORAGE_BACKEND", "mongo"),
+        sqlite_path=env.get("SQLITE_PATH", "pinhead.sqlite3"),
+        vote_buffer_window_ms=int(
+            env.get(
+                "VOTE_BUFFER_WINDOW_MS", str(DEFAULT_VOTE_BUFFER_WINDOW_MS)
+            )
+        ),
+        vote_buffer_max_votes=int(
+            env.get(
+                "VOTE_BUFFER_MAX_VOTES", str(DEFAULT_VOTE_BUFFER_MAX_VOTES)
+            )
+        ),
+        metrics_port=int(env.get("METRICS_PORT", str(DEFAULT_METRICS_PORT))),
+        node_id=env.get("NODE_ID", f"{socket.gethostname()}-{os.getpid()}"),
+        ingest_queue_size=int(
+            env.get("INGEST_QUEUE_SIZE", str(DEFAULT_INGEST_QUEUE_SIZE))
+        ),
+        ingest_overflow=Overflow(overflow),
+        ingest_dedup_window=int(
+            env.get("INGEST_DEDUP_WINDOW", str(DEFAULT_INGEST_DEDUP_WINDOW))
+        ),
+        ingest_workers=int(
+            env.get("INGEST_WORKERS", str(DEFAULT_INGEST_WORKERS))
+        ),
+        archive_after=int(
+            env.get("ARCHIVE_AFTER", str(DEFAULT_ARCHIVE_AFTER))
+        ),
+        archive_ttl=int(env.get("ARCHIVE_TTL", str(DEFAULT_ARCHIVE_TTL))),
+        fast_start=env.get("FAST_START", "") in {"1", "true", "yes"},
+        performance=create_performance_profile(env),
     )
+    _validate_ingest(config)
+    return config
+
+
+def _validate_ingest(config: Config) -> None:
+    # a zero dedup window turns deduplication off
+    if config.ingest_dedup_window < 0:
+        raise ValueError(
+            f"INGEST_DEDUP_WINDOW can't be negative: "
+            f"{config.ingest_dedup_window}"
+        )
+    for name in ("ingest_queue_size", "ingest_workers"):
+        value = getattr(config, name)
+        if value < 1:
+            raise ValueError(f"{name.upper()} must be positive: {value}")
+
+
+def create_performance_profile(env: Mapping[str, str]) -> PerformanceProfile:
+    """Defaults, overridden by the PERF_PROFILE TOML file, then by env.
+
+    Keys in the file are the field names, environment variables are the
+    same names in upper case, e.g. ``MONGO_MAX_POOL_SIZE``.
+    """
+    values: dict[str, Any] = {}
+    if path := env.get("PERF_PROFILE"):
+        with open(path, "rb") as f:
+            values = tomllib.load(f)
+    hints = typing.get_type_hints(PerformanceProfile)
+    unknown = values.keys() - hints.keys()
+    if unknown:
+        raise ValueError(f"Unknown performance settings: {sorted(unknown)}")
+    for name in hints:
+        if name.upper() in env:
+            values[name] = env[name.upper()]
+
+    for name, value in values.items():
+        try:
+            values[name] = hints[name](value)
+        except ValueError:
+            raise ValueError(f"Invalid {name}: {value!r}") from None
+    profile = PerformanceProfile(**values)
+    _validate(profile)
+    return profile
+
+
+def _validate(profile: PerformanceProfile) -> None:
+    for field in dataclasses.fields(profile):
+        value = getattr(profile, field.name)
+        if isinstance(value, str):
+            continue
+        if value < 0 or (value == 0 and field.name not in _ZERO_ALLOWED):
+            raise ValueError(f"{field.name} must be positive: {value}")
+    if profile.mongo_min_pool_size > profile.mongo_max_pool_size:
+        raise ValueError(
+            "mongo_min_pool_size is above mongo_max_pool_size: "
+            f"{profile.mongo_min_pool_size} > {profile.mongo_max_pool_size}"
+        )
+    write_concern = profile.mongo_write_concern
+    if write_concern != "majority" and not write_concern.isdigit():
+        raise ValueError(
+            f"mongo_write_concern must be a number or majority: "
+            f"{write_concern}"
+        )
@@ -7,4 +7,60 @@ NO = "❌"
 YES_NO_OPTIONS = [YES, NO]
 YES_IDX = 0
 NO_IDX = 1
-WAKEUP_PERIOD = 60
+# users one grouped /ban or /purge can target
+MAX_ACTION_TARGETS = 50
+# authors seen per chat, to resolve @username mentions into user ids
+RECENT_AUTHORS_SIZE = 10_000
+RECENT_AUTHORS_TTL = 24 * _HOUR
+# periodic full scan, a safety net for the in-process scheduler
+RECONCILE_PERIOD = 10 * _MINUTE
+DEFAULT_PIPELINE_CONCURRENCY = 8
+DEFAULT_SCAN_BATCH_SIZE = 100
+# a poll without consensus is closed after this long, seconds
+POLL_TIMEOUT = 6 * _HOUR
+# an action that made no progress is due again after a growing delay
+IDLE_BACKOFF_BASE = 30
+IDLE_BACKOFF_MAX = 30 * _MINUTE
+POLL_CACHE_SIZE = 10_000
+POLL_CACHE_TTL = DEFAULT_ACTION_DURATION
+# 0 disables vote buffering
+DEFAULT_VOTE_BUFFER_WINDOW_MS = 0
+DEFAULT_VOTE_BUFFER_MAX_VOTES = 100
+# outbound Telegram budget, calls per second
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_GLOBAL_BURST = 30
+DEFAULT_CHAT_RATE = 1
+DEFAULT_CHAT_BURST = 20
+# cleanup deletions are collected across actions for this long, seconds
+CLEANUP_DELAY = 2
+# side port for /metrics, 0 disables it
+DEFAULT_METRICS_PORT = 9100
+# a node holds claimed actions for this long, renewing while it works
+LEASE_DURATION = 60
+LEASE_RENEW_PERIOD = 20
+# webhook ingest, see pinhead.ingest
+DEFAULT_INGEST_QUEUE_SIZE = 1000
+DEFAULT_INGEST_OVERFLOW = "shed"
+DEFAULT_INGEST_DEDUP_WINDOW = 10_000
+DEFAULT_INGEST_WORKERS = 4
+# fly.io kills the process 5 seconds after SIGTERM
+INGEST_DRAIN_TIMEOUT = 3
+# finished actions move to the archive after ARCHIVE_AFTER seconds and
+# are deleted from it after ARCHIVE_TTL, 0 keeps them forever
+ARCHIVE_PERIOD = _HOUR
+DEFAULT_ARCHIVE_AFTER = 7 * 24 * _HOUR
+DEFAULT_ARCHIVE_TTL = 0
+ARCHIVE_BATCH_SIZE = 500
+# connections opened ahead of the first query on start
+WARM_UP_CONNECTIONS = 4
+# performance profile defaults, the library defaults where there is one
+DEFAULT_MONGO_MAX_POOL_SIZE = 100
+DEFAULT_MONGO_MIN_POOL_SIZE = 0
+DEFAULT_MONGO_CONNECT_TIMEOUT_MS = 20_000
+DEFAULT_MONGO_SERVER_SELECTION_TIMEOUT_MS = 30_000
+# 0 waits for a reply forever
+DEFAULT_MONGO_SOCKET_TIMEOUT_MS = 0
+DEFAULT_MONGO_WRITE_CONCERN = "1"
+DEFAULT_TG_CONNECTION_POOL_SIZE = 256
+DEFAULT_TG_POOL_TIMEOUT = 1.0
+DEFAULT_TG_READ_TIMEOUT = 5.0
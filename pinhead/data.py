@@ -1,6 +1,7 @@
 import dataclasses
 from datetime import datetime
 from enum import StrEnum
+from typing import Any
 
 
 class PipelineStep(StrEnum):
@@ -13,6 +14,11 @@ class PipelineStep(StrEnum):
     ERROR = "error"
 
 
+TERMINAL_STEPS = frozenset({PipelineStep.DONE, PipelineStep.ERROR})
+# positive form of "not terminal", indexes serve $in far better than $nin
+ACTIVE_STEPS = tuple(x for x in PipelineStep if x not in TERMINAL_STEPS)
+
+
 class ActionType(StrEnum):
     PIN = "pin"
     DELETE = "delete"
@@ -35,8 +41,30 @@ class PollData:
     options: list[str]
     message_id: str
     consensus: int
-    votes: list[VoteData]
+    votes: list[VoteData] = dataclasses.field(default_factory=list)
+    # answers per option, kept in sync with votes by db.store_vote
+    counts: list[int] = dataclasses.field(default_factory=list)
     win_result: bool | None = None
+    # closed without consensus after that, None for older polls
+    close_at: datetime | None = None
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class TargetData:
+    user_id: str
+    # message that pointed at the user, None for a mention
+    message_id: str | None = None
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class IntentData:
+    """A bot API call of a step, stored before it is made."""
+
+    key: str
+    created_at: datetime
+    # None while the outcome of the call is unknown
+    completed_at: datetime | None = None
+    result: dict[str, Any] = dataclasses.field(default_factory=dict)
 
 
 @dataclasses.dataclass(slots=True, kw_only=True)
@@ -54,6 +82,37 @@ class ActionData:
     executed_at: datetime | None = None
     finished_at: datetime | None = None
     duration: int | None = None  # in seconds
+    # runs in a row that left the action as it was, for the backoff
+    idle_runs: int = 0
+    # node processing the action, until the lease runs out
+    owner: str | None = None
+    lease_until: datetime | None = None
+    # every user of a grouped action, empty for a single target
+    targets: list[TargetData] = dataclasses.field(default_factory=list)
+    # repeated commands that joined this action, cleaned up with trigger
+    duplicate_trigger_ids: list[str] = dataclasses.field(default_factory=list)
+    intents: list[IntentData] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class PollRef:
+    action_id: str
+    step: PipelineStep
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class ActionRef:
+    action_id: str
+    chat_id: int
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class LeaseRef:
+    action_id: str
+    chat_id: int
+    step: PipelineStep
+    owner: str | None = None
+    lease_until: datetime | None = None
 
 
 CHAT_ID = 123
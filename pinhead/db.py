@@ -1,25 +1,193 @@
 # method to store ActionData to mongo to separate collection
-from datetime import UTC, datetime
+import asyncio
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Any
 
-import marshmallow_recipe as mr
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from pymongo.results import InsertOneResult, UpdateResult
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    IndexModel,
+    ReturnDocument,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import (
+    BulkWriteResult,
+    InsertOneResult,
+    UpdateResult,
+)
 
+from pinhead.clock import as_utc, utcnow
+from pinhead.codecs import (
+    ACTION_CODEC,
+    INTENT_CODEC,
+    POLL_CODEC,
+    VOTE_CODEC,
+)
+from pinhead.constants import (
+    ARCHIVE_BATCH_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE,
+)
 from pinhead.data import (
+    ACTIVE_STEPS,
+    TERMINAL_STEPS,
     ActionData,
+    ActionRef,
     ActionType,
+    IntentData,
+    LeaseRef,
     PipelineStep,
     PollData,
+    PollRef,
     VoteData,
 )
+from pinhead.metrics import DB_OPERATION_SECONDS, timed
+
+ACTIVE = {"step": {"$in": [x.value for x in ACTIVE_STEPS]}}
+TERMINAL = {"step": {"$in": sorted(x.value for x in TERMINAL_STEPS)}}
+
+ACTION_INDEXES = [
+    IndexModel([("action_id", ASCENDING)], name="action_id", unique=True),
+    IndexModel([("poll.id", ASCENDING)], name="poll_id", sparse=True),
+    # serves the ready scan and the lease queries; only live work is in
+    # it, so its size does not grow with history ($in on a partial
+    # filter needs MongoDB 6.0)
+    IndexModel(
+        [("step", ASCENDING), ("execute_at", ASCENDING)],
+        name="active_step_execute_at",
+        partialFilterExpression=ACTIVE,
+    ),
+    # one live action per target; a finished one leaves the index, so
+    # the same command can run again later
+    IndexModel(
+        [
+            ("chat_id", ASCENDING),
+            ("target_message_id", ASCENDING),
+            ("action_type", ASCENDING),
+        ],
+        name="active_target",
+        unique=True,
+        partialFilterExpression=ACTIVE,
+    ),
+    # finished actions waiting to be archived
+    IndexModel(
+        [("finished_at", ASCENDING)],
+        name="terminal_finished_at",
+        partialFilterExpression=TERMINAL,
+    ),
+]
+# replaced by the partial index above, dropped by ensure_indexes
+LEGACY_ACTION_INDEXES = ("step_execute_at",)
+
+ARCHIVE_INDEXES = [
+    IndexModel([("action_id", ASCENDING)], name="action_id", unique=True),
+    # audits look at one chat, newest first
+    IndexModel(
+        [("chat_id", ASCENDING), ("start_at", DESCENDING)],
+        name="chat_id_start_at",
+    ),
+    IndexModel([("archived_at", ASCENDING)], name="archived_at"),
+]
+
+DUPLICATE_KEY = 11000
+
+ACTION_DATETIME_FIELDS = (
+    "start_at",
+    "execute_at",
+    "executed_at",
+    "finished_at",
+)
+
+
+def dump_vote(vote: VoteData) -> dict[str, Any]:
+    return VOTE_CODEC.dump(vote)
+
+
+def dump_poll(poll: PollData) -> dict[str, Any]:
+    return POLL_CODEC.dump(poll)
+
+
+def dump_action(action: ActionData) -> dict[str, Any]:
+    """Dump with datetimes kept as native BSON dates, not ISO strings."""
+    return ACTION_CODEC.dump(action)
+
+
+def load_action(item: dict[str, Any]) -> ActionData:
+    return ACTION_CODEC.load(item)
 
 
+@timed(DB_OPERATION_SECONDS)
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> list[str]:
+    existing = await db.actions.index_information()
+    for name in LEGACY_ACTION_INDEXES:
+        if name in existing:
+            await db.actions.drop_index(name)
+    names = await db.actions.create_indexes(
+        ACTION_INDEXES  # type: ignore[arg-type]
+    )
+    return names + await db.actions_archive.create_indexes(
+        ARCHIVE_INDEXES  # type: ignore[arg-type]
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
+async def warm_up(db: AsyncIOMotorDatabase, connections: int) -> None:
+    """Open ``connections`` pooled connections with concurrent pings.
+
+    Motor connects lazily, otherwise the first queries after a cold
+    start pay for the TCP and TLS handshakes one by one.
+    """
+    await asyncio.gather(
+        *(db.command("ping") for _ in range(connections))  # type: ignore
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
 async def store_action(
     db: AsyncIOMotorDatabase, action_data: ActionData
 ) -> InsertOneResult:
-    return await db.actions.insert_one(mr.dump(action_data))
+    return await db.actions.insert_one(dump_action(action_data))
 
 
+@timed(DB_OPERATION_SECONDS)
+async def store_or_attach(
+    db: AsyncIOMotorDatabase, action_data: ActionData
+) -> ActionData:
+    """Insert the action, or attach its trigger to the active duplicate.
+
+    The ``active_target`` index makes the insert fail for a duplicate,
+    so two commands racing on different nodes still end up in one
+    action. If the other action finishes before the trigger is attached,
+    the insert is tried again.
+    """
+    same_target = {
+        "chat_id": action_data.chat_id,
+        "target_message_id": action_data.target_message_id,
+        "action_type": action_data.action_type.value,
+        **ACTIVE,
+    }
+    while True:
+        try:
+            await db.actions.insert_one(dump_action(action_data))
+            return action_data
+        except DuplicateKeyError:
+            pass
+        item: dict | None = await db.actions.find_one_and_update(
+            same_target,
+            {
+                "$addToSet": {
+                    "duplicate_trigger_ids": action_data.trigger_message_id
+                }
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if item:
+            return load_action(item)
+
+
+@timed(DB_OPERATION_SECONDS)
 async def store_poll(
     db: AsyncIOMotorDatabase,
     action_data: ActionData,
@@ -27,10 +195,11 @@ async def store_poll(
 ) -> UpdateResult:
     return await db.actions.update_one(
         {"action_id": action_data.action_id},
-        {"$set": {"poll": mr.dump(poll_data)}},
+        {"$set": {"poll": dump_poll(poll_data)}},
     )
 
 
+@timed(DB_OPERATION_SECONDS)
 async def change_step(
     db: AsyncIOMotorDatabase,
     action_id: str,
@@ -42,68 +211,489 @@ async def change_step(
     )
 
 
-async def postpone_action(
+def _encode_field(value: Any) -> Any:
+    match value:
+        case PollData():
+            return dump_poll(value)
+        case VoteData():
+            return dump_vote(value)
+        case datetime():
+            return as_utc(value)
+    return value
+
+
+@timed(DB_OPERATION_SECONDS)
+async def transition(
     db: AsyncIOMotorDatabase,
     action_id: str,
-    next_execution: datetime,
-):
+    from_step: PipelineStep,
+    to_step: PipelineStep,
+    extra_fields: dict[str, Any] | None = None,
+) -> ActionData | None:
+    """Move the action to ``to_step`` only if it is still in ``from_step``.
+
+    Returns the updated action, or None when another run has already
+    moved it on, so the same transition is never applied twice.
+    """
+    fields = {k: _encode_field(v) for k, v in (extra_fields or {}).items()}
+    item: dict | None = await db.actions.find_one_and_update(
+        {"action_id": action_id, "step": from_step},
+        {"$set": {**fields, "step": to_step}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if item:
+        return load_action(item)
+    return None
+
+
+def _lease_free(now: datetime) -> dict[str, Any]:
+    return {"$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]}
+
+
+@timed(DB_OPERATION_SECONDS)
+async def claim(
+    db: AsyncIOMotorDatabase,
+    action_id: str,
+    owner: str,
+    lease_until: datetime,
+) -> ActionData | None:
+    """Take the lease on an active action, or extend one we already hold.
+
+    Returns None when the action is finished or another node holds it.
+    """
+    now = utcnow()
+    item: dict | None = await db.actions.find_one_and_update(
+        {
+            "action_id": action_id,
+            **ACTIVE,
+            "$or": [
+                {"owner": owner},
+                {"lease_until": None},
+                {"lease_until": {"$lte": now}},
+            ],
+        },
+        {"$set": {"owner": owner, "lease_until": as_utc(lease_until)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if item:
+        return load_action(item)
+    return None
+
+
+@timed(DB_OPERATION_SECONDS)
+async def claim_ready(
+    db: AsyncIOMotorDatabase,
+    owner: str,
+    lease_until: datetime,
+    limit: int = DEFAULT_SCAN_BATCH_SIZE,
+) -> list[ActionRef]:
+    """Lease up to ``limit`` due actions nobody holds, earliest first.
+
+    Candidates are picked first and then taken with a single update_many
+    that re-checks the lease, so two nodes never get the same action.
+    Only the ids and chats of the taken ones are read back.
+    """
+    now = utcnow()
+    filter_ = {
+        **ACTIVE,
+        "execute_at": {"$lte": now},
+        **_lease_free(now),
+    }
+    candidates = db.actions.find(
+        filter_,
+        {"_id": 0, "action_id": 1},
+        sort=[("execute_at", ASCENDING)],
+        limit=limit,
+    )
+    ids = [item["action_id"] async for item in candidates]  # type: ignore
+    if not ids:
+        return []
+    await db.actions.update_many(
+        {**filter_, "action_id": {"$in": ids}},
+        {"$set": {"owner": owner, "lease_until": as_utc(lease_until)}},
+    )
+    claimed = db.actions.find(
+        {"action_id": {"$in": ids}, "owner": owner},
+        {"_id": 0, "action_id": 1, "chat_id": 1},
+        sort=[("execute_at", ASCENDING)],
+    )
+    items: list[dict] = [item async for item in claimed]  # type: ignore
+    return [
+        ActionRef(action_id=x["action_id"], chat_id=x["chat_id"])
+        for x in items
+    ]
+
+
+@timed(DB_OPERATION_SECONDS)
+async def renew_leases(
+    db: AsyncIOMotorDatabase,
+    owner: str,
+    action_ids: list[str],
+    lease_until: datetime,
+) -> UpdateResult:
+    return await db.actions.update_many(
+        {"action_id": {"$in": action_ids}, "owner": owner},
+        {"$set": {"lease_until": as_utc(lease_until)}},
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
+async def release_leases(
+    db: AsyncIOMotorDatabase, owner: str, action_ids: list[str]
+) -> UpdateResult:
+    return await db.actions.update_many(
+        {"action_id": {"$in": action_ids}, "owner": owner},
+        {"$unset": {"owner": "", "lease_until": ""}},
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
+async def add_intent(
+    db: AsyncIOMotorDatabase, action_id: str, intent: IntentData
+) -> UpdateResult:
     return await db.actions.update_one(
         {"action_id": action_id},
-        {"$set": {"execute_at": next_execution}},
+        {"$push": {"intents": INTENT_CODEC.dump(intent)}},
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
+async def complete_intent(
+    db: AsyncIOMotorDatabase, action_id: str, key: str, result: dict[str, Any]
+) -> UpdateResult:
+    return await db.actions.update_one(
+        {"action_id": action_id, "intents.key": key},
+        {
+            "$set": {
+                "intents.$.completed_at": utcnow(),
+                "intents.$.result": result,
+            }
+        },
+    )
+
+
+@timed(DB_OPERATION_SECONDS)
+async def drop_intent(
+    db: AsyncIOMotorDatabase, action_id: str, key: str
+) -> UpdateResult:
+    return await db.actions.update_one(
+        {"action_id": action_id}, {"$pull": {"intents": {"key": key}}}
     )
 
 
+@timed(DB_OPERATION_SECONDS)
+async def fetch_open_intents(
+    db: AsyncIOMotorDatabase,
+) -> list[tuple[str, IntentData]]:
+    """Uncompleted intents of active actions no node holds a lease on."""
+    query = db.actions.find(
+        {
+            **ACTIVE,
+            "intents": {"$elemMatch": {"completed_at": None}},
+            **_lease_free(utcnow()),
+        },
+        {"_id": 0, "action_id": 1, "intents": 1},
+    )
+    items: list[dict] = [item async for item in query]  # type: ignore
+    return [
+        (item["action_id"], INTENT_CODEC.load(intent))
+        for item in items
+        for intent in item["intents"]
+        if intent.get("completed_at") is None
+    ]
+
+
+def _tally(votes: Any, options_count: Any) -> dict[str, Any]:
+    # per-option counts out of a list of votes, for polls stored before
+    # the counters were introduced
+    answers = {
+        "$reduce": {
+            "input": votes,
+            "initialValue": [],
+            "in": {"$concatArrays": ["$$value", "$$this.answer"]},
+        }
+    }
+    return {
+        "$map": {
+            "input": {"$range": [0, options_count]},
+            "as": "idx",
+            "in": {
+                "$size": {
+                    "$filter": {
+                        "input": answers,
+                        "cond": {"$eq": ["$$this", "$$idx"]},
+                    }
+                }
+            },
+        }
+    }
+
+
+def vote_update(vote_data: VoteData) -> list[dict[str, Any]]:
+    """Replace the user's previous vote and apply the delta to the counts.
+
+    Runs as a single update pipeline, so the vote list and the per-option
+    counters can't drift apart.
+    """
+    votes = {"$ifNull": ["$poll.votes", []]}
+    options_count = {"$size": {"$ifNull": ["$poll.options", []]}}
+    user_votes = {
+        "$filter": {
+            "input": votes,
+            "cond": {"$eq": ["$$this.user_id", vote_data.user_id]},
+        }
+    }
+    other_votes = {
+        "$filter": {
+            "input": votes,
+            "cond": {"$ne": ["$$this.user_id", vote_data.user_id]},
+        }
+    }
+    new_votes: Any = other_votes
+    if vote_data.answer:  # an empty answer is a retracted vote
+        new_votes = {
+            "$concatArrays": [
+                other_votes,
+                [{"$literal": dump_vote(vote_data)}],
+            ]
+        }
+    is_answered = {"$in": ["$$idx", {"$literal": vote_data.answer}]}
+    delta = {
+        "$subtract": [
+            {"$cond": [is_answered, 1, 0]},
+            {"$arrayElemAt": ["$poll.user_counts", "$$idx"]},
+        ]
+    }
+    counts = {
+        "$map": {
+            "input": {"$range": [0, options_count]},
+            "as": "idx",
+            "in": {
+                "$add": [
+                    {"$arrayElemAt": ["$poll.prev_counts", "$$idx"]},
+                    delta,
+                ]
+            },
+        }
+    }
+    stored_counts = {"$ifNull": ["$poll.counts", []]}
+    has_counts = {"$eq": [{"$size": stored_counts}, options_count]}
+    return [
+        {
+            "$set": {
+                "poll.prev_counts": {
+                    "$cond": [
+                        has_counts,
+                        stored_counts,
+                        _tally(votes, options_count),
+                    ]
+                },
+                "poll.user_counts": _tally(user_votes, options_count),
+            }
+        },
+        {"$set": {"poll.votes": new_votes, "poll.counts": counts}},
+        {"$unset": ["poll.prev_counts", "poll.user_counts"]},
+    ]
+
+
+def _vote_filter(action_id: str) -> dict[str, Any]:
+    return {"action_id": action_id, "poll": {"$type": "object"}}
+
+
+@timed(DB_OPERATION_SECONDS)
 async def store_vote(
     db: AsyncIOMotorDatabase,
     action_id: str,
     vote_data: VoteData,
 ) -> UpdateResult:
     return await db.actions.update_one(
-        {"action_id": action_id},
-        {"$addToSet": {"poll.votes": mr.dump(vote_data)}},
+        _vote_filter(action_id), vote_update(vote_data)
     )
 
 
-async def store_poll_result(
+@timed(DB_OPERATION_SECONDS)
+async def store_votes(
     db: AsyncIOMotorDatabase,
-    action: ActionData,
-    result: bool,
-):
-    return await db.actions.update_one(
-        {"action_id": action.action_id}, {"$set": {"poll.win_result": result}}
+    votes: list[tuple[str, VoteData]],
+) -> BulkWriteResult:
+    return await db.actions.bulk_write(
+        [
+            UpdateOne(_vote_filter(action_id), vote_update(vote_data))
+            for action_id, vote_data in votes
+        ]
     )
 
 
+@timed(DB_OPERATION_SECONDS)
 async def fetch_action_by_id(
     db: AsyncIOMotorDatabase, action_id: str
 ) -> ActionData | None:
     item = await db.actions.find_one({"action_id": action_id})  # type: ignore
     if item:
-        return mr.load(ActionData, item)
+        return load_action(item)
     return None
 
 
+@timed(DB_OPERATION_SECONDS)
 async def fetch_action_by_poll_id(
     db: AsyncIOMotorDatabase, poll_id: str
 ) -> ActionData | None:
     item = await db.actions.find_one({"poll.id": poll_id})  # type: ignore
     if item:
-        return mr.load(ActionData, item)
+        return load_action(item)
     return None
 
 
-async def fetch_ready_actions(
-    db: AsyncIOMotorDatabase, type: ActionType | None = None
-) -> list[ActionData]:
-    now = datetime.now(tz=UTC)
+async def iter_ready_actions(
+    db: AsyncIOMotorDatabase,
+    type: ActionType | None = None,
+    *,
+    batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+    limit: int | None = None,
+    with_votes: bool = True,
+) -> AsyncIterator[ActionData]:
+    """Stream due actions, earliest first.
 
+    Documents are loaded one cursor batch at a time, so the caller can
+    start on the first action while the rest are still in flight.
+    ``with_votes=False`` leaves ``poll.votes`` on the server.
+    """
     filter_ = {
-        "step": {"$nin": [PipelineStep.ERROR, PipelineStep.DONE]},
-        "execute_at": {"$lte": now.isoformat()},
+        **ACTIVE,
+        "execute_at": {"$lte": utcnow()},
     }
     if type is not None:
         filter_["action_type"] = type
 
-    query = db.actions.find(filter_)
-    items = [mr.load(ActionData, item) async for item in query]  # type: ignore
-    return items
+    query = db.actions.find(
+        filter_,
+        None if with_votes else {"poll.votes": 0},
+        sort=[("execute_at", ASCENDING)],
+        batch_size=batch_size,
+        limit=limit or 0,
+    )
+    async for item in query:  # type: ignore
+        yield load_action(item)
+
+
+@timed(DB_OPERATION_SECONDS)
+async def fetch_poll_ref(
+    db: AsyncIOMotorDatabase, poll_id: str
+) -> PollRef | None:
+    item = await db.actions.find_one(
+        {"poll.id": poll_id}, {"_id": 0, "action_id": 1, "step": 1}
+    )  # type: ignore
+    if item:
+        return PollRef(
+            action_id=item["action_id"], step=PipelineStep(item["step"])
+        )
+    return None
+
+
+@timed(DB_OPERATION_SECONDS)
+async def fetch_lease_ref(
+    db: AsyncIOMotorDatabase, action_id: str
+) -> LeaseRef | None:
+    item = await db.actions.find_one(
+        {"action_id": action_id},
+        {
+            "_id": 0,
+            "action_id": 1,
+            "chat_id": 1,
+            "step": 1,
+            "owner": 1,
+            "lease_until": 1,
+        },
+    )  # type: ignore
+    if item:
+        lease_until = item.get("lease_until")
+        return LeaseRef(
+            action_id=item["action_id"],
+            chat_id=item["chat_id"],
+            step=PipelineStep(item["step"]),
+            owner=item.get("owner"),
+            lease_until=as_utc(lease_until) if lease_until else None,
+        )
+    return None
+
+
+@timed(DB_OPERATION_SECONDS)
+async def fetch_ready_actions(
+    db: AsyncIOMotorDatabase, type: ActionType | None = None
+) -> list[ActionData]:
+    return [action async for action in iter_ready_actions(db, type)]
+
+
+@timed(DB_OPERATION_SECONDS)
+async def fetch_scheduled_actions(
+    db: AsyncIOMotorDatabase,
+) -> list[tuple[str, datetime]]:
+    query = db.actions.find(
+        ACTIVE,
+        {"_id": 0, "action_id": 1, "execute_at": 1},
+    )
+    items: list[dict] = [item async for item in query]  # type: ignore
+    return [(item["action_id"], as_utc(item["execute_at"])) for item in items]
+
+
+@timed(DB_OPERATION_SECONDS)
+async def archive_finished(
+    db: AsyncIOMotorDatabase,
+    finished_before: datetime,
+    limit: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """Move up to ``limit`` actions finished before the cutoff to the archive.
+
+    Copies are inserted first and the originals deleted after, so a crash
+    in between leaves an action in both places rather than in neither;
+    the next run skips the copies already archived. Returns the number of
+    actions moved.
+    """
+    query = db.actions.find(
+        {**TERMINAL, "finished_at": {"$lte": as_utc(finished_before)}},
+        sort=[("finished_at", ASCENDING)],
+        limit=limit,
+    )
+    items: list[dict] = [item async for item in query]  # type: ignore
+    if not items:
+        return 0
+    now = utcnow()
+    for item in items:
+        item["archived_at"] = now
+    try:
+        await db.actions_archive.insert_many(items, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+    result = await db.actions.delete_many(
+        {**TERMINAL, "_id": {"$in": [item["_id"] for item in items]}}
+    )
+    return result.deleted_count
+
+
+@timed(DB_OPERATION_SECONDS)
+async def purge_archive(
+    db: AsyncIOMotorDatabase, archived_before: datetime
+) -> int:
+    result = await db.actions_archive.delete_many(
+        {"archived_at": {"$lte": as_utc(archived_before)}}
+    )
+    return result.deleted_count
+
+
+@timed(DB_OPERATION_SECONDS)
+async def fetch_archived_actions(
+    db: AsyncIOMotorDatabase,
+    chat_id: int,
+    since: datetime | None = None,
+    limit: int = DEFAULT_SCAN_BATCH_SIZE,
+) -> list[ActionData]:
+    """Archived actions of a chat, newest first, for audits."""
+    filter_: dict[str, Any] = {"chat_id": chat_id}
+    if since is not None:
+        filter_["start_at"] = {"$gte": as_utc(since)}
+    query = db.actions_archive.find(
+        filter_, sort=[("start_at", DESCENDING)], limit=limit
+    )
+    return [load_action(item) async for item in query]  # type: ignore
@@ -0,0 +1,223 @@
+import asyncio
+import bisect
+import dataclasses
+import itertools
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from enum import IntEnum
+from typing import Any
+
+import telegram
+
+from pinhead.constants import (
+    DEFAULT_CHAT_BURST,
+    DEFAULT_CHAT_RATE,
+    DEFAULT_GLOBAL_BURST,
+    DEFAULT_GLOBAL_RATE,
+)
+from pinhead.metrics import (
+    TELEGRAM_CALL_ERRORS,
+    TELEGRAM_CALL_SECONDS,
+    TELEGRAM_QUEUE_DEPTH,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Class of a bot API call, not the pipeline step making it."""
+
+    MODERATION = 0  # ban, mute
+    DELETE = 1
+    PIN = 2  # pin, unpin
+    POLL = 3
+    REPLY = 4  # error replies to the chat
+    CLEANUP = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._updated, 0)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        # drain the bucket so the next token shows up after `seconds`
+        self._refill(now)
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+@dataclasses.dataclass(order=True, slots=True, kw_only=True)
+class _Call:
+    priority: Priority
+    seq: int
+    chat_id: int = dataclasses.field(compare=False)
+    func: Callable[..., Awaitable[Any]] = dataclasses.field(compare=False)
+    args: tuple = dataclasses.field(compare=False)
+    kwargs: dict[str, Any] = dataclasses.field(compare=False)
+    future: asyncio.Future = dataclasses.field(compare=False)
+
+
+class TelegramDispatcher:
+    """Outbound queue for bot API calls.
+
+    Calls are released in priority order, as long as both the global and
+    the per-chat token buckets allow it; a chat that ran out of budget
+    doesn't hold back the others. On a 429 the call is put back and the
+    chat is paused for the time Telegram asked for.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        global_burst: float = DEFAULT_GLOBAL_BURST,
+        chat_rate: float = DEFAULT_CHAT_RATE,
+        chat_burst: float = DEFAULT_CHAT_BURST,
+    ):
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: defaultdict[int, TokenBucket] = defaultdict(
+            lambda: TokenBucket(chat_rate, chat_burst)
+        )
+        self._queue: list[_Call] = []
+        self._depth: defaultdict[int, int] = defaultdict(int)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    async def call(
+        self,
+        priority: Priority,
+        func: Callable[..., Awaitable[Any]],
+        chat_id: int,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Queue ``func(chat_id, *args, **kwargs)`` and wait for its result."""
+        call = _Call(
+            priority=priority,
+            seq=next(self._seq),
+            chat_id=chat_id,
+            func=func,
+            args=(chat_id, *args),
+            kwargs=kwargs,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._push(call)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await call.future
+
+    def queue_depth(self, chat_id: int) -> int:
+        return self._depth.get(chat_id, 0)
+
+    def queue_depths(self) -> dict[int, int]:
+        return {chat_id: n for chat_id, n in self._depth.items() if n}
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for call in self._queue:
+            call.future.cancel()
+        self._queue.clear()
+        for chat_id in self.queue_depths():
+            TELEGRAM_QUEUE_DEPTH.remove(str(chat_id))
+        self._depth.clear()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _push(self, call: _Call) -> None:
+        bisect.insort(self._queue, call)
+        self._depth[call.chat_id] += 1
+        self._report_depth(call.chat_id)
+        self._wakeup.set()
+
+    def _report_depth(self, chat_id: int) -> None:
+        depth = self._depth[chat_id]
+        if depth:
+            TELEGRAM_QUEUE_DEPTH.set(depth, str(chat_id))
+        else:
+            # chats come and go, a drained one leaves no series behind
+            del self._depth[chat_id]
+            TELEGRAM_QUEUE_DEPTH.remove(str(chat_id))
+
+    def _pick(self, now: float) -> tuple[_Call | None, float]:
+        global_delay = self._global.delay(now)
+        if global_delay:
+            return None, global_delay
+        wait = float("inf")
+        for idx, call in enumerate(self._queue):
+            delay = self._chats[call.chat_id].delay(now)
+            if not delay:
+                del self._queue[idx]
+                self._depth[call.chat_id] -= 1
+                self._report_depth(call.chat_id)
+                return call, 0
+            wait = min(wait, delay)
+        return None, wait
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._queue:
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            call, wait = self._pick(now)
+            if call is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except TimeoutError:
+                    pass
+                continue
+            self._global.take(now)
+            self._chats[call.chat_id].take(now)
+            task = asyncio.create_task(self._execute(call))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, call: _Call) -> None:
+        if call.future.cancelled():
+            return
+        method = getattr(call.func, "__name__", "unknown")
+        try:
+            with TELEGRAM_CALL_SECONDS.time(method):
+                result = await call.func(*call.args, **call.kwargs)
+        except telegram.error.RetryAfter as e:
+            TELEGRAM_CALL_ERRORS.inc(method, type(e).__name__)
+            logger.warning(
+                f"Flood limit in chat {call.chat_id}, "
+                f"retry in {e.retry_after}s"
+            )
+            self._chats[call.chat_id].pause(
+                time.monotonic(), float(e.retry_after)
+            )
+            self._push(call)
+        except Exception as e:
+            TELEGRAM_CALL_ERRORS.inc(method, type(e).__name__)
+            if not call.future.cancelled():
+                call.future.set_exception(e)
+        else:
+            if not call.future.cancelled():
+                call.future.set_result(result)
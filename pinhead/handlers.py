@@ -1,58 +1,113 @@
 import logging
-from datetime import UTC, datetime
+from typing import cast
 
-from telegram import Message, Update, User
+from telegram import Message, MessageEntity, Update, User
 from telegram.ext import (
     Application,
     CommandHandler,
     ContextTypes,
+    JobQueue,
+    MessageHandler,
     PollAnswerHandler,
+    filters,
 )
 
-from pinhead.db import fetch_action_by_poll_id, store_action, store_vote
+from pinhead.cache import LRUCache
+from pinhead.clock import utcnow
 
-from .constants import DEFAULT_ACTION_DURATION, WAKEUP_PERIOD
-from .data import ActionData, ActionType, PipelineStep, VoteData
+from .constants import (
+    ARCHIVE_PERIOD,
+    DEFAULT_ACTION_DURATION,
+    LEASE_RENEW_PERIOD,
+    MAX_ACTION_TARGETS,
+    RECONCILE_PERIOD,
+)
+from .data import (
+    ActionData,
+    ActionType,
+    PipelineStep,
+    TargetData,
+    VoteData,
+)
 from .helpers import (
     ensured,
     generate_random_str,
-    get_db,
-    log_format_action,
+    get_poll_cache,
+    get_recent_authors,
+    get_store,
+    get_vote_buffer,
+)
+from .metrics import ATTACHED_COMMANDS
+from .pipeline import (
+    archive_finished_actions,
+    execute_scheduled_actions,
+    renew_leases,
+    run_pipeline_for,
+    schedule_cleanup,
 )
-from .pipeline import execute_scheduled_actions, run_pipeline_now
 
 logger = logging.getLogger(__name__)
+# a trigger joining an action in these steps is removed at consensus
+POLL_STEPS = frozenset({PipelineStep.START, PipelineStep.POLL})
+
+# actions that take a list of mentioned users under a single poll
+GROUP_ACTIONS = frozenset({ActionType.BAN, ActionType.PURGE})
 
 
 def pipeline_start_fabric(action_type: ActionType):
     async def start_pipeline(
         update: Update, context: ContextTypes.DEFAULT_TYPE
     ) -> None:
-        now = datetime.utcnow()
-        target_msg, target_user = _extract_targets(update.message)
+        now = utcnow()
+        message = update.message
+        target_msg, target_user = _extract_targets(message)
+        targets: list[TargetData] = []
+        if message and action_type in GROUP_ACTIONS:
+            targets = _collect_targets(
+                target_msg,
+                _extract_mentions(message, get_recent_authors(context)),
+            )
+        if targets:
+            target_user_id: str | None = targets[0].user_id
+        else:
+            target_user_id = str(target_user.id) if target_user else None
         chat_id = update.effective_chat.id if update.effective_chat else None
-        if not any([target_msg, target_user]):
+        if not any([target_msg, target_user, targets]):
             logger.warning("Can't extract any target, ignore")
             return
         if not chat_id:
             logger.error("Chat id not found, ignore")
             return
+        trigger_message_id = str(ensured(message).id)
         action = ActionData(
             action_id=generate_random_str(),
             chat_id=chat_id,
-            target_message_id=str(ensured(target_msg).id),
-            trigger_message_id=str(ensured(update.message).id),
-            target_user_id=str(target_user.id) if target_user else None,
+            # a mentions only action has its poll under the command
+            target_message_id=(
+                str(target_msg.id) if target_msg else trigger_message_id
+            ),
+            trigger_message_id=trigger_message_id,
+            target_user_id=target_user_id,
             action_type=action_type,
             step=PipelineStep.START,
             start_at=now,
             execute_at=now,
             # TODO: parse command args, get duration first
             duration=_get_action_duration(action_type),
+            targets=targets,
         )
-        await store_action(get_db(context), action)
+        stored = await get_store(context).store_or_attach(action)
+        if stored.action_id != action.action_id:
+            ATTACHED_COMMANDS.inc(action_type.value)
+            logger.info(
+                f"Same action is running, attached to {stored.action_id}"
+            )
+            if stored.step not in POLL_STEPS:
+                # consensus has cleaned up the triggers already
+                schedule_cleanup(context, chat_id, trigger_message_id)
+            return
         logger.info("Action stored, run pipeline")
-        run_pipeline_now(context)
+        run_pipeline_for(context, action.action_id, action.chat_id)
 
     return start_pipeline
 
@@ -74,6 +129,79 @@ def _extract_targets(
     return target_msg, target_user
 
 
+def _extract_mentions(
+    message: Message, recent_authors: LRUCache[tuple[int, str], TargetData]
+) -> list[TargetData]:
+    """Users the command mentions, for a vote on a whole raid.
+
+    Telegram resolves only mentions of users without a username. An
+    @username is looked up in the recent authors this process has seen.
+    The cache is per process: with several replicas behind the webhook, a
+    mention resolves only if the author's last message reached the same
+    replica. Otherwise the user is skipped, and a reply to one of their
+    messages still targets them.
+    """
+    targets = []
+    entities = message.parse_entities(
+        [MessageEntity.MENTION, MessageEntity.TEXT_MENTION]
+    )
+    for entity, text in entities.items():
+        if entity.user is not None:
+            # users without a username come with the user attached
+            targets.append(TargetData(user_id=str(entity.user.id)))
+            continue
+        author = recent_authors.get((message.chat_id, _username_key(text)))
+        if author is None:
+            logger.warning(f"No recent messages of {text}, skip")
+            continue
+        targets.append(author)
+    return targets
+
+
+def _collect_targets(
+    target_msg: Message | None, mentions: list[TargetData]
+) -> list[TargetData]:
+    """Mentioned users after the replied one, each user once.
+
+    Empty without mentions, a plain reply stays a single target action.
+    """
+    if not mentions:
+        return []
+    targets: dict[str, TargetData] = {}
+    for target in mentions:
+        targets.setdefault(target.user_id, target)
+    if target_msg is not None and target_msg.from_user is not None:
+        user_id = str(target_msg.from_user.id)
+        targets.pop(user_id, None)
+        reply = TargetData(user_id=user_id, message_id=str(target_msg.id))
+        targets = {user_id: reply, **targets}
+    if len(targets) > MAX_ACTION_TARGETS:
+        logger.warning(
+            f"Too many targets: {len(targets)}, "
+            f"keep the first {MAX_ACTION_TARGETS}"
+        )
+    return list(targets.values())[:MAX_ACTION_TARGETS]
+
+
+def _username_key(username: str) -> str:
+    return username.removeprefix("@").lower()
+
+
+async def remember_author(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    # in process memory only, see _extract_mentions for what that means
+    # with several replicas
+    message = update.effective_message
+    user = message.from_user if message else None
+    if message is None or user is None or not user.username:
+        return
+    get_recent_authors(context).set(
+        (message.chat_id, _username_key(user.username)),
+        TargetData(user_id=str(user.id), message_id=str(message.id)),
+    )
+
+
 async def register_poll_answer(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -82,29 +210,69 @@ async def register_poll_answer(
     if not answer:
         logger.error("Poll answer not found")
         return
-    logger.info(f"got answer: {answer}")
-    action = await fetch_action_by_poll_id(
-        get_db(context), poll_id=answer.poll_id
-    )
-    if action is None:
-        logger.error(f"Action data not found: {answer.poll_id}")
+    if answer.user is None:
+        # anonymous admins vote on behalf of the chat, nobody to count
+        logger.info(f"Skip a vote of chat {answer.voter_chat}")
         return
+    logger.info(f"got answer: {answer}")
+    poll_cache = get_poll_cache(context)
+    poll_ref = poll_cache.get(answer.poll_id)
+    if poll_ref is None:
+        poll_ref = await get_store(context).fetch_poll_ref(answer.poll_id)
+        if poll_ref is None:
+            logger.error(f"Action data not found: {answer.poll_id}")
+            return
+        if poll_ref.step == PipelineStep.POLL:
+            poll_cache.set(answer.poll_id, poll_ref)
 
     vote_data = VoteData(
         user_id=answer.user.id,
         user_name=answer.user.name,
         answer=list(answer.option_ids),
-        voted_at=datetime.now(tz=UTC),
+        voted_at=utcnow(),
+    )
+    vote_buffer = get_vote_buffer(context)
+    if vote_buffer.enabled:
+        is_full = vote_buffer.add(poll_ref.action_id, vote_data)
+        logger.info(f"Buffered vote <{poll_ref.action_id}> - {vote_data}")
+        if is_full:
+            await flush_votes(context)
+        else:
+            _schedule_flush(context)
+        return
+
+    await get_store(context).store_vote(
+        poll_ref.action_id, vote_data=vote_data
     )
-    await store_vote(get_db(context), action.action_id, vote_data=vote_data)
-    logger.info(f"Stored vote {log_format_action(action)} - {vote_data}")
+    logger.info(f"Stored vote <{poll_ref.action_id}> - {vote_data}")
 
-    run_pipeline_now(context)
+    run_pipeline_for(context, poll_ref.action_id)
+
+
+def _schedule_flush(context: ContextTypes.DEFAULT_TYPE) -> None:
+    vote_buffer = get_vote_buffer(context)
+    if vote_buffer.schedule():
+        job_queue = cast(JobQueue, context.job_queue)
+        job_queue.run_once(flush_votes, when=vote_buffer.window)
+
+
+async def flush_votes(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        action_ids = await get_vote_buffer(context).flush(get_store(context))
+    except Exception:
+        # the votes are back in the buffer, nothing else would flush them
+        # before it fills up
+        logger.exception("Failed to flush votes, will retry")
+        _schedule_flush(context)
+        return
+    # consensus is checked only after the votes hit the database
+    for action_id in action_ids:
+        run_pipeline_for(context, action_id)
 
 
 async def bot_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info(f"receive help command: {update}")
-    votes_count = await get_db(context).actions.count_documents({})
+    votes_count = await get_store(context).count_actions()
     logger.info(f"Count: {votes_count}")
     await ensured(update.message).reply_text(
         "Available commands:\n"
@@ -113,10 +281,13 @@ async def bot_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/delete - delete message\n"
         "/ban - ban user\n"
         "/purge - ban user and delete all messages (hello crypto-boys!)\n"
+        "/ban and /purge take @mentions to vote on a whole raid at once\n"
     )
 
 
-def setup_handlers(app: Application) -> Application:
+def setup_handlers(
+    app: Application, reconcile_period: float = RECONCILE_PERIOD
+) -> Application:
     app.add_handler(
         CommandHandler("pin", pipeline_start_fabric(ActionType.PIN))
     )
@@ -133,10 +304,18 @@ def setup_handlers(app: Application) -> Application:
         CommandHandler("purge", pipeline_start_fabric(ActionType.PURGE))
     )
     app.add_handler(CommandHandler("help", bot_help))
+    # runs before the commands, so a raid can be mentioned right away
+    app.add_handler(
+        MessageHandler(filters.ChatType.GROUPS, remember_author), group=-1
+    )
     app.add_handler(PollAnswerHandler(register_poll_answer))
     if not app.job_queue:
         raise RuntimeError("Job queue is required to run this bot")
     app.job_queue.run_repeating(
-        execute_scheduled_actions, interval=WAKEUP_PERIOD, first=0
+        execute_scheduled_actions, interval=reconcile_period, first=0
+    )
+    app.job_queue.run_repeating(renew_leases, interval=LEASE_RENEW_PERIOD)
+    app.job_queue.run_repeating(
+        archive_finished_actions, interval=ARCHIVE_PERIOD
     )
     return app
@@ -3,10 +3,16 @@ import random
 import string
 from typing import TypeVar, cast
 
-from motor.motor_asyncio import AsyncIOMotorDatabase
 from telegram.ext import CallbackContext
 
-from pinhead.data import ActionData
+from pinhead.archive import ArchivePolicy
+from pinhead.cache import LRUCache
+from pinhead.cleanup import CleanupQueue
+from pinhead.data import ActionData, PollRef, TargetData
+from pinhead.dispatcher import TelegramDispatcher
+from pinhead.scheduler import ActionScheduler
+from pinhead.store.base import ActionStore
+from pinhead.votes import VoteBuffer
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +21,42 @@ POLL_PREFIX = "poll"
 _SEP = ":"
 
 
-def get_db(ctx: CallbackContext) -> AsyncIOMotorDatabase:
-    return cast(AsyncIOMotorDatabase, ctx.application.db)  # type: ignore
+def get_store(ctx: CallbackContext) -> ActionStore:
+    return cast(ActionStore, ctx.application.store)  # type: ignore
+
+
+def get_node_id(ctx: CallbackContext) -> str:
+    return cast(str, ctx.application.node_id)  # type: ignore
+
+
+def get_scheduler(ctx: CallbackContext) -> ActionScheduler:
+    return cast(ActionScheduler, ctx.application.scheduler)  # type: ignore
+
+
+def get_poll_cache(ctx: CallbackContext) -> LRUCache[str, PollRef]:
+    return cast(LRUCache, ctx.application.poll_cache)  # type: ignore
+
+
+def get_recent_authors(
+    ctx: CallbackContext,
+) -> LRUCache[tuple[int, str], TargetData]:
+    return cast(LRUCache, ctx.application.recent_authors)  # type: ignore
+
+
+def get_vote_buffer(ctx: CallbackContext) -> VoteBuffer:
+    return cast(VoteBuffer, ctx.application.vote_buffer)  # type: ignore
+
+
+def get_dispatcher(ctx: CallbackContext) -> TelegramDispatcher:
+    return cast(TelegramDispatcher, ctx.application.dispatcher)  # type: ignore
+
+
+def get_archive_policy(ctx: CallbackContext) -> ArchivePolicy:
+    return cast(ArchivePolicy, ctx.application.archive_policy)  # type: ignore
+
+
+def get_cleanup_queue(ctx: CallbackContext) -> CleanupQueue:
+    return cast(CleanupQueue, ctx.application.cleanup_queue)  # type: ignore
 
 
 def generate_random_str(length: int = 10) -> str:
@@ -36,9 +76,7 @@ def ensured(x: T | None) -> T:
 def log_format_action(action: ActionData) -> str:
     poll_state = ""
     if action.poll:
-        poll_state = (
-            f"Poll [{len(action.poll.votes)} | {action.poll.consensus}]"
-        )
+        poll_state = f"Poll [{action.poll.counts} | {action.poll.consensus}]"
     return (
         f"<{action.action_id}|{action.action_type.value}> {action.step.value} "
         f"{poll_state} "
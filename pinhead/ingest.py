@@ -0,0 +1,294 @@
+import asyncio
+import hmac
+import logging
+import signal
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+from pinhead.config import Overflow
+from pinhead.constants import INGEST_DRAIN_TIMEOUT
+from pinhead.metrics import (
+    INGEST_QUEUE_DEPTH,
+    INGEST_UPDATES,
+    handle_metrics,
+)
+from pinhead.startup import STARTUP
+
+if TYPE_CHECKING:
+    # imported lazily, updates are acknowledged before telegram is loaded
+    from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def is_sheddable(data: dict[str, Any]) -> bool:
+    """Updates the bot doesn't act on, the first to go under load.
+
+    Commands and poll answers are kept, everything else only reaches
+    handlers that ignore it.
+    """
+    if "poll_answer" in data:
+        return False
+    message = data.get("message") or data.get("edited_message") or {}
+    return not any(
+        entity.get("type") == "bot_command"
+        for entity in message.get("entities", ())
+    )
+
+
+class RecentIds:
+    """Bounded window of recently seen update ids."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._order: deque[int] = deque()
+        self._ids: set[int] = set()
+
+    def add(self, update_id: int) -> bool:
+        """Remember the id, returns False if it was seen already."""
+        if update_id in self._ids:
+            return False
+        self._ids.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+        return True
+
+
+class UpdateQueue:
+    """Bounded FIFO of raw updates with a configurable overflow policy."""
+
+    def __init__(self, maxsize: int, overflow: Overflow = Overflow.SHED):
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._items: deque[tuple[dict[str, Any], bool]] = deque()
+        self._sheddable = 0
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _append(self, data: dict[str, Any], sheddable: bool) -> None:
+        self._items.append((data, sheddable))
+        self._sheddable += sheddable
+        self._ready.set()
+
+    def _drop_oldest_sheddable(self) -> bool:
+        if not self._sheddable:
+            return False
+        for idx, (_, sheddable) in enumerate(self._items):
+            if sheddable:
+                del self._items[idx]
+                self._sheddable -= 1
+                return True
+        return False
+
+    def put(self, data: dict[str, Any], sheddable: bool) -> bool:
+        """Queue the update, returns False if it or an older one was shed."""
+        if len(self._items) < self.maxsize:
+            self._append(data, sheddable)
+            return True
+        match self.overflow:
+            case Overflow.DROP_OLDEST:
+                _, dropped = self._items.popleft()
+                self._sheddable -= dropped
+            case Overflow.SHED if not sheddable:
+                if not self._drop_oldest_sheddable():
+                    return False
+            case _:
+                return False
+        self._append(data, sheddable)
+        return False
+
+    async def get(self) -> dict[str, Any]:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        data, sheddable = self._items.popleft()
+        self._sheddable -= sheddable
+        return data
+
+
+class WebhookIngest:
+    """Acknowledges webhook calls at once and processes updates behind.
+
+    Requests are checked against the secret token and deduplicated by
+    update_id, so a redelivery after a slow response is not processed
+    twice. Workers feed the queued updates to the application; calls are
+    accepted and queued before it is started.
+    """
+
+    def __init__(
+        self,
+        secret_token: str,
+        queue: UpdateQueue,
+        recent_ids: RecentIds,
+        workers: int,
+    ):
+        self.secret_token = secret_token
+        self.queue = queue
+        self.recent_ids = recent_ids
+        self.workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._busy = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            INGEST_UPDATES.inc("forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update_id = int(data["update_id"])
+        except (ValueError, KeyError, TypeError):
+            INGEST_UPDATES.inc("invalid")
+            return web.Response(status=400)
+        if not self.recent_ids.add(update_id):
+            INGEST_UPDATES.inc("duplicate")
+        elif self.queue.put(data, is_sheddable(data)):
+            INGEST_UPDATES.inc("queued")
+        else:
+            INGEST_UPDATES.inc("shed")
+        INGEST_QUEUE_DEPTH.set(len(self.queue))
+        # shed updates are acknowledged too, a retry would only add load
+        return web.Response()
+
+    async def _work(self, application: "Application") -> None:
+        from telegram import Update
+
+        while True:
+            data = await self.queue.get()
+            INGEST_QUEUE_DEPTH.set(len(self.queue))
+            self._busy += 1
+            try:
+                update = Update.de_json(data, application.bot)
+                await application.process_update(update)
+                STARTUP.update_handled()
+            except Exception:
+                logger.exception(f"Failed to process update: {data}")
+            finally:
+                self._busy -= 1
+
+    def start(self, application: "Application") -> None:
+        self._tasks = [
+            asyncio.create_task(self._work(application))
+            for _ in range(self.workers)
+        ]
+
+    async def close(self, timeout: float = INGEST_DRAIN_TIMEOUT) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (len(self.queue) or self._busy) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if len(self.queue):
+            logger.warning(f"Dropping {len(self.queue)} queued updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def create_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        app.router.add_get("/metrics", handle_metrics)
+        return app
+
+
+ApplicationLoader = Callable[[], Awaitable["Application"]]
+
+
+async def _listen(
+    ingest: WebhookIngest, listen: str, port: int, webhook_url: str
+) -> web.AppRunner:
+    path = urlparse(webhook_url).path or "/"
+    runner = web.AppRunner(ingest.create_app(path), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    STARTUP.mark("listening")
+    logger.info(f"Listening for updates on {listen}:{port}{path}")
+    return runner
+
+
+async def serve(
+    load_application: ApplicationLoader,
+    ingest: WebhookIngest,
+    listen: str,
+    port: int,
+    webhook_url: str,
+    fast_start: bool = False,
+    stop: asyncio.Event | None = None,
+) -> None:
+    """Run the bot behind our own ingest until ``stop`` or a signal.
+
+    By default the webhook is served only once the application is fully
+    started. ``fast_start`` listens before anything else is loaded and
+    sets the webhook in the background: Telegram gets its answer within
+    the cold start, at the price of losing the updates acknowledged
+    before a failed start.
+    """
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner: web.AppRunner | None = None
+    application: "Application | None" = None
+    set_webhook: asyncio.Task | None = None
+    try:
+        if fast_start:
+            runner = await _listen(ingest, listen, port, webhook_url)
+        application = await load_application()
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        webhook = application.bot.set_webhook(
+            url=webhook_url, secret_token=ingest.secret_token
+        )
+        if fast_start:
+            set_webhook = asyncio.create_task(webhook)
+        else:
+            await webhook
+        await application.start()
+        ingest.start(application)
+        STARTUP.mark("ready")
+        if runner is None:
+            runner = await _listen(ingest, listen, port, webhook_url)
+        await stop.wait()
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await ingest.close()
+        if set_webhook is not None and not set_webhook.done():
+            set_webhook.cancel()
+        if application is not None:
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+
+
+def run_webhook(
+    load_application: ApplicationLoader,
+    ingest: WebhookIngest,
+    listen: str,
+    port: int,
+    webhook_url: str,
+    fast_start: bool = False,
+) -> None:
+    """Replacement for ``Application.run_webhook`` with our own ingest."""
+    asyncio.run(
+        serve(
+            load_application,
+            ingest,
+            listen,
+            port,
+            webhook_url,
+            fast_start=fast_start,
+        )
+    )
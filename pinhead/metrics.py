@@ -0,0 +1,343 @@
+import bisect
+import functools
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterator, Sequence
+from typing import Any, ParamSpec, TypeVar
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+# a vote can tip the poll long after it was cast if the pipeline lags
+CONSENSUS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _key(self, label_values: Sequence[str]) -> tuple[str, ...]:
+        if len(label_values) != len(self.labels):
+            raise ValueError(
+                f"{self.name} expects labels {self.labels}, "
+                f"got {label_values}"
+            )
+        return tuple(str(x) for x in label_values)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        key = self._key(label_values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(self._key(label_values), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[self._key(label_values)] = value
+
+    def remove(self, *label_values: str) -> None:
+        self._values.pop(self._key(label_values), None)
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(self._key(label_values), 0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class _Series:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], _Series] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        key = self._key(label_values)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series(len(self.buckets))
+        # per-bucket counts, made cumulative on render
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            series.buckets[idx] += 1
+        series.sum += value
+        series.count += 1
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(self._key(label_values))
+        return series.count if series else 0
+
+    def time(self, *label_values: str) -> "_Timer":
+        return _Timer(self, label_values)
+
+    def samples(self) -> Iterator[str]:
+        names = (*self.labels, "le")
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.buckets):
+                cumulative += count
+                labels = _format_labels(names, (*key, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(names, (*key, "+Inf"))
+            yield f"{self.name}_bucket{labels} {series.count}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(series.sum)}"
+            yield f"{self.name}_count{labels} {series.count}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram: Histogram, label_values: Sequence[str]):
+        self.histogram = histogram
+        self.label_values = label_values
+        self.started = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, *self.label_values)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def counter(
+        self, name: str, help: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, help, labels)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, help, labels)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(x.render() for x in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+PIPELINE_STEP_SECONDS = REGISTRY.histogram(
+    "pinhead_pipeline_step_seconds",
+    "Time to process one pipeline step, including the transition.",
+    ["step"],
+)
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "pinhead_lock_wait_seconds",
+    "Time spent waiting for the per-chat lock or the pipeline semaphore.",
+    ["lock"],
+)
+SCAN_READY_ACTIONS = REGISTRY.histogram(
+    "pinhead_scan_ready_actions",
+    "Ready actions found by one reconcile scan.",
+    buckets=COUNT_BUCKETS,
+)
+DB_OPERATION_SECONDS = REGISTRY.histogram(
+    "pinhead_db_operation_seconds",
+    "Latency of the Mongo functions in pinhead.db.",
+    ["operation"],
+)
+TELEGRAM_CALL_SECONDS = REGISTRY.histogram(
+    "pinhead_telegram_call_seconds",
+    "Latency of bot API calls, queueing excluded.",
+    ["method"],
+)
+TELEGRAM_QUEUE_DEPTH = REGISTRY.gauge(
+    "pinhead_telegram_queue_depth",
+    "Bot API calls waiting in the dispatcher, by chat; idle chats are left "
+    "out.",
+    ["chat_id"],
+)
+TELEGRAM_CALL_ERRORS = REGISTRY.counter(
+    "pinhead_telegram_call_errors_total",
+    "Failed bot API calls.",
+    ["method", "error"],
+)
+INGEST_UPDATES = REGISTRY.counter(
+    "pinhead_ingest_updates_total",
+    "Webhook calls by outcome: queued, duplicate, shed, invalid, forbidden.",
+    ["result"],
+)
+INGEST_QUEUE_DEPTH = REGISTRY.gauge(
+    "pinhead_ingest_queue_depth",
+    "Updates acknowledged but not processed yet.",
+)
+ARCHIVED_ACTIONS = REGISTRY.counter(
+    "pinhead_archived_actions_total",
+    "Finished actions moved to the archive, and archived ones purged.",
+    ["result"],
+)
+EXPIRED_POLLS = REGISTRY.counter(
+    "pinhead_expired_polls_total",
+    "Polls closed at their deadline without consensus.",
+)
+OUTBOX_INTENTS = REGISTRY.counter(
+    "pinhead_outbox_intents_total",
+    "Bot API calls skipped as done already, or found open on start with "
+    "an unknown outcome.",
+    ["result"],
+)
+ATTACHED_COMMANDS = REGISTRY.counter(
+    "pinhead_attached_commands_total",
+    "Commands that joined an active action on the same target.",
+    ["action_type"],
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "pinhead_startup_seconds",
+    "Cold start phases; listening, ready and first_update are marks "
+    "since the process start.",
+    ["phase"],
+)
+VOTE_TO_CONSENSUS_SECONDS = REGISTRY.histogram(
+    "pinhead_vote_to_consensus_seconds",
+    "Time from the last vote of a poll to the consensus being recorded.",
+    buckets=CONSENSUS_BUCKETS,
+)
+
+
+def timed(
+    histogram: Histogram,
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """Observe the latency of a coroutine function, labelled by its name."""
+
+    def decorator(
+        func: Callable[P, Awaitable[R]]
+    ) -> Callable[P, Awaitable[R]]:
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with histogram.time(func.__name__):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=REGISTRY.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"Serving metrics on :{port}/metrics")
+    return runner
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any
+
+import click
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from pinhead.clock import as_utc, utcnow
+from pinhead.config import create_config
+from pinhead.data import PipelineStep
+from pinhead.db import ACTION_DATETIME_FIELDS, ACTIVE, TERMINAL
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 500
+
+
+def _parse_date(value: Any) -> Any:
+    if isinstance(value, str):
+        return as_utc(datetime.fromisoformat(value))
+    return value
+
+
+def _datetime_updates(item: dict[str, Any]) -> dict[str, Any]:
+    updates = {
+        field: _parse_date(item[field])
+        for field in ACTION_DATETIME_FIELDS
+        if isinstance(item.get(field), str)
+    }
+    votes = (item.get("poll") or {}).get("votes") or []
+    if any(isinstance(vote.get("voted_at"), str) for vote in votes):
+        updates["poll.votes"] = [
+            {**vote, "voted_at": _parse_date(vote.get("voted_at"))}
+            for vote in votes
+        ]
+    return updates
+
+
+async def migrate_datetimes(db: AsyncIOMotorDatabase) -> int:
+    """Convert ISO string dates left by older versions to BSON dates."""
+    has_string_dates = [
+        {field: {"$type": "string"}}
+        for field in (*ACTION_DATETIME_FIELDS, "poll.votes.voted_at")
+    ]
+    query = db.actions.find({"$or": has_string_dates})
+    migrated = 0
+    batch: list[UpdateOne] = []
+    async for item in query:  # type: ignore
+        batch.append(
+            UpdateOne({"_id": item["_id"]}, {"$set": _datetime_updates(item)})
+        )
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            migrated += (await db.actions.bulk_write(batch)).modified_count
+            batch = []
+    if batch:
+        migrated += (await db.actions.bulk_write(batch)).modified_count
+    return migrated
+
+
+async def migrate_finished_at(db: AsyncIOMotorDatabase) -> int:
+    """Set finished_at on actions finished before it was recorded.
+
+    Without it they are never archived. ``execute_at`` is the closest
+    thing left: the last time the pipeline was due to touch the action.
+    """
+    result = await db.actions.update_many(
+        {**TERMINAL, "finished_at": None},
+        [{"$set": {"finished_at": "$execute_at"}}],
+    )
+    return result.modified_count
+
+
+async def close_duplicate_actions(db: AsyncIOMotorDatabase) -> int:
+    """Close all but the oldest active action of each target.
+
+    The unique ``active_target`` index can't be built while duplicates
+    started by older versions are still running.
+    """
+    # motor's cursor is typed as a coroutine
+    groups: Any = db.actions.aggregate(
+        [
+            {"$match": ACTIVE},
+            {"$sort": {"start_at": 1}},
+            {
+                "$group": {
+                    "_id": {
+                        "chat_id": "$chat_id",
+                        "target_message_id": "$target_message_id",
+                        "action_type": "$action_type",
+                    },
+                    "ids": {"$push": "$_id"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
+    )
+    duplicates = [_id async for group in groups for _id in group["ids"][1:]]
+    if not duplicates:
+        return 0
+    result = await db.actions.update_many(
+        {**ACTIVE, "_id": {"$in": duplicates}},
+        {"$set": {"step": PipelineStep.ERROR.value, "finished_at": utcnow()}},
+    )
+    return result.modified_count
+
+
+async def _migrate(db: AsyncIOMotorDatabase) -> None:
+    migrated = await migrate_datetimes(db)
+    logger.info(f"Migrated {migrated} actions to BSON dates")
+    finished = await migrate_finished_at(db)
+    logger.info(f"Set finished_at on {finished} finished actions")
+    closed = await close_duplicate_actions(db)
+    logger.info(f"Closed {closed} duplicate active actions")
+
+
+@click.command()
+def migrate():
+    logging.basicConfig(level=logging.INFO)
+    cfg = create_config(os.environ)
+    db = AsyncIOMotorClient(cfg.mongo_uri, tz_aware=True).get_database(
+        cfg.mongo_db_name
+    )
+    asyncio.run(_migrate(db))
+
+
+if __name__ == "__main__":
+    migrate()
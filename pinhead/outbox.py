@@ -0,0 +1,70 @@
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+import telegram
+
+from pinhead.clock import utcnow
+from pinhead.data import ActionData, IntentData
+from pinhead.metrics import OUTBOX_INTENTS
+from pinhead.store.base import ActionStore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def intent_key(action: ActionData, name: str) -> str:
+    # a step runs each of its calls once, the step is part of the key
+    return f"{action.action_id}:{action.step.value}:{name}"
+
+
+async def run_once(
+    store: ActionStore,
+    action: ActionData,
+    name: str,
+    call: Callable[[], Awaitable[T]],
+    record: Callable[[T], dict[str, Any]] | None = None,
+) -> dict[str, Any]:
+    """Make a bot API call of the action's step at most once.
+
+    The intent is stored before the call and completed with
+    ``record(result)`` after it. A step run again after a crash finds
+    the completed intent and gets the recorded result back, without
+    calling Telegram again. ``action`` has to be read under the lease,
+    so no other run adds intents in the meantime.
+    """
+    key = intent_key(action, name)
+    intent = next((x for x in action.intents if x.key == key), None)
+    if intent is not None and intent.completed_at is not None:
+        logger.info(f"Call {key} is done already, skip it")
+        OUTBOX_INTENTS.inc("skipped")
+        return intent.result
+    if intent is None:
+        intent = IntentData(key=key, created_at=utcnow())
+        await store.add_intent(action.action_id, intent)
+    try:
+        value = await call()
+    except telegram.error.BadRequest:
+        # refused, nothing happened and the step decides what's next
+        await store.drop_intent(action.action_id, key)
+        raise
+    result = record(value) if record is not None else {}
+    await store.complete_intent(action.action_id, key, result)
+    return result
+
+
+async def reconcile_intents(store: ActionStore) -> int:
+    """Forget intents left open by a node that died mid call.
+
+    Whether such a call went through is unknown. Its step runs again and
+    makes the call again, the only case a call can repeat. Completed
+    intents are kept, their steps pick the recorded results up on the
+    next run. Returns the number of intents dropped.
+    """
+    open_intents = await store.fetch_open_intents()
+    for action_id, intent in open_intents:
+        logger.warning(f"Outcome of {intent.key} is unknown, will retry")
+        OUTBOX_INTENTS.inc("unknown")
+        await store.drop_intent(action_id, intent.key)
+    return len(open_intents)
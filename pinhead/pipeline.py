@@ -1,76 +1,279 @@
 import asyncio
+import contextlib
+import contextvars
+import dataclasses
 import logging
-from collections import defaultdict
-from datetime import UTC, datetime, timedelta
-from typing import cast
+import time
+from collections import Counter, defaultdict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import Any, cast
 
 import telegram
 from telegram import ChatPermissions
 from telegram.ext import CallbackContext, JobQueue
 
-from pinhead.db import (
-    change_step,
-    fetch_ready_actions,
-    postpone_action,
-    store_poll,
-    store_poll_result,
-)
+from pinhead.clock import as_utc, utcnow
 
+from .archive import archive_finished
+from .cleanup import flush_cleanup_queue
 from .constants import (
+    CLEANUP_DELAY,
     DEFAULT_CONSENSUS,
+    DEFAULT_PIPELINE_CONCURRENCY,
+    DEFAULT_SCAN_BATCH_SIZE,
+    IDLE_BACKOFF_BASE,
+    IDLE_BACKOFF_MAX,
+    LEASE_DURATION,
     NO_IDX,
+    POLL_TIMEOUT,
     YES_IDX,
     YES_NO_OPTIONS,
 )
-from .data import ActionData, ActionType, PipelineStep, PollData
-from .helpers import get_db, log_format_action
+from .data import (
+    TERMINAL_STEPS,
+    ActionData,
+    ActionType,
+    PipelineStep,
+    PollData,
+    PollRef,
+)
+from .dispatcher import Priority
+from .helpers import (
+    ensured,
+    get_archive_policy,
+    get_cleanup_queue,
+    get_dispatcher,
+    get_node_id,
+    get_poll_cache,
+    get_scheduler,
+    get_store,
+    log_format_action,
+)
+from .metrics import (
+    EXPIRED_POLLS,
+    LOCK_WAIT_SECONDS,
+    PIPELINE_STEP_SECONDS,
+    SCAN_READY_ACTIONS,
+    VOTE_TO_CONSENSUS_SECONDS,
+)
+from .outbox import run_once
 
 logger = logging.getLogger(__name__)
-lock = asyncio.Lock()
+# actions of one chat are processed sequentially, chats run concurrently
+_chat_locks: dict[int, asyncio.Lock] = {}
+# runs holding or waiting for each lock, an idle chat's lock is dropped
+_chat_lock_users: Counter[int] = Counter()
+_semaphore = asyncio.Semaphore(DEFAULT_PIPELINE_CONCURRENCY)
+# actions claimed per round trip by the reconcile scan
+_scan_batch_size = DEFAULT_SCAN_BATCH_SIZE
+# actions with a targeted run queued but not started yet
+_pending: set[str] = set()
+# actions this node holds a lease on, renewed by renew_leases
+_leases: set[str] = set()
+
+
+class _PipelineSlot:
+    """The slot of ``_semaphore`` taken by one pipeline step.
+
+    The step gives it back while it waits in the dispatcher, so a chat
+    throttled by Telegram doesn't keep the steps of other chats waiting.
+    Concurrent calls of one step give it back once and take it again
+    when the last of them is done.
+    """
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self._semaphore = semaphore
+        self._lock = asyncio.Lock()
+        self._held = False
+        self._waiting = 0
+
+    async def acquire(self) -> None:
+        await self._semaphore.acquire()
+        self._held = True
+
+    def release(self) -> None:
+        if self._held:
+            self._held = False
+            self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def given_back(self) -> AsyncIterator[None]:
+        async with self._lock:
+            self._waiting += 1
+            self.release()
+        try:
+            yield
+        finally:
+            async with self._lock:
+                self._waiting -= 1
+                if not self._waiting:
+                    await self.acquire()
+
+
+# the slot of the step running in the current task, if any
+_slot: contextvars.ContextVar[_PipelineSlot | None] = contextvars.ContextVar(
+    "pipeline_slot", default=None
+)
 
 
-async def start_poll(ctx: CallbackContext, action: ActionData) -> PipelineStep:
-    message = await ctx.bot.send_poll(
-        action.chat_id,
-        f"{action.action_type.lower().capitalize()}?",
+@dataclasses.dataclass(slots=True, kw_only=True)
+class StepResult:
+    step: PipelineStep
+    # fields written together with the step change
+    updates: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+async def call_once(
+    ctx: CallbackContext,
+    action: ActionData,
+    priority: Priority,
+    func: Callable[..., Awaitable[Any]],
+    *args: Any,
+    name: str | None = None,
+    record: Callable[[Any], dict[str, Any]] | None = None,
+    **kwargs: Any,
+) -> dict[str, Any]:
+    """``dispatcher.call`` made at most once per step, see ``run_once``."""
+    return await run_once(
+        get_store(ctx),
+        action,
+        name or func.__name__,
+        lambda: dispatch(ctx, priority, func, action.chat_id, *args, **kwargs),
+        record,
+    )
+
+
+async def dispatch(
+    ctx: CallbackContext,
+    priority: Priority,
+    func: Callable[..., Awaitable[Any]],
+    chat_id: int,
+    *args: Any,
+    **kwargs: Any,
+) -> Any:
+    """``dispatcher.call``, without the pipeline slot while it waits."""
+    dispatcher, slot = get_dispatcher(ctx), _slot.get()
+    if slot is None:
+        return await dispatcher.call(priority, func, chat_id, *args, **kwargs)
+    async with slot.given_back():
+        return await dispatcher.call(priority, func, chat_id, *args, **kwargs)
+
+
+async def start_poll(ctx: CallbackContext, action: ActionData) -> StepResult:
+    sent = await call_once(
+        ctx,
+        action,
+        Priority.POLL,
+        ctx.bot.send_poll,
+        _poll_question(action),
         YES_NO_OPTIONS,
         is_anonymous=False,
         allows_multiple_answers=False,
         reply_to_message_id=action.target_message_id,
+        record=lambda message: {
+            "poll_id": message.poll.id,
+            "message_id": message.message_id,
+        },
     )
     poll_data = PollData(
-        id=message.poll.id,
+        id=sent["poll_id"],
         options=YES_NO_OPTIONS,
-        message_id=message.message_id,
+        message_id=sent["message_id"],
         consensus=DEFAULT_CONSENSUS,
         win_result=None,
         votes=[],
+        counts=[0] * len(YES_NO_OPTIONS),
+        close_at=utcnow() + timedelta(seconds=POLL_TIMEOUT),
+    )
+    get_poll_cache(ctx).set(
+        poll_data.id,
+        PollRef(action_id=action.action_id, step=PipelineStep.POLL),
     )
-    await store_poll(get_db(ctx), action_data=action, poll_data=poll_data)
-    return PipelineStep.POLL
+    return StepResult(step=PipelineStep.POLL, updates={"poll": poll_data})
+
+
+def _poll_question(action: ActionData) -> str:
+    name = action.action_type.lower().capitalize()
+    if len(action.targets) > 1:
+        return f"{name} {len(action.targets)} users?"
+    return f"{name}?"
 
 
 async def check_poll_state(
     ctx: CallbackContext, action: ActionData
-) -> PipelineStep:
+) -> StepResult:
     if action.poll is None:
         logger.error(f"Poll data not found: {action}")
-        return PipelineStep.ERROR
+        return StepResult(step=PipelineStep.ERROR)
     current_vote_results = calculate_poll_results(action)
     max_vote_count = max([0, *current_vote_results.values()])
     if max_vote_count >= action.poll.consensus:
-        await ctx.bot.stop_poll(
-            chat_id=action.chat_id, message_id=action.poll.message_id
+        await call_once(
+            ctx,
+            action,
+            Priority.POLL,
+            ctx.bot.stop_poll,
+            message_id=action.poll.message_id,
         )
         logger.info("Poll is done, consensus reached")
-        return PipelineStep.CONSENSUS
+        if action.poll.votes:
+            last_vote = max(as_utc(x.voted_at) for x in action.poll.votes)
+            VOTE_TO_CONSENSUS_SECONDS.observe(
+                (utcnow() - last_vote).total_seconds()
+            )
+        return StepResult(step=PipelineStep.CONSENSUS)
+    if utcnow() >= poll_deadline(action):
+        return await close_expired_poll(ctx, action)
     logger.info("Poll is still running, keep current step")
-    return action.step
+    return StepResult(step=action.step)
+
+
+def poll_deadline(action: ActionData) -> datetime:
+    if action.poll is not None and action.poll.close_at is not None:
+        return as_utc(action.poll.close_at)
+    # polls started before deadlines were stored
+    return as_utc(action.start_at) + timedelta(seconds=POLL_TIMEOUT)
+
+
+async def close_expired_poll(
+    ctx: CallbackContext, action: ActionData
+) -> StepResult:
+    poll = ensured(action.poll)
+    try:
+        await call_once(
+            ctx,
+            action,
+            Priority.POLL,
+            ctx.bot.stop_poll,
+            message_id=poll.message_id,
+        )
+    except telegram.error.BadRequest as e:
+        # deleted by hand or closed already, cleanup is all that's left
+        logger.info(f"Failed to stop expired poll: {e.message}")
+    logger.info(f"Poll expired without consensus: {action.action_id}")
+    EXPIRED_POLLS.inc()
+    schedule_cleanup(ctx, action.chat_id, *_poll_messages(action))
+    return StepResult(
+        step=PipelineStep.DONE, updates={"poll.win_result": False}
+    )
+
+
+def _poll_messages(action: ActionData) -> list[str]:
+    # the poll and every command that asked for it
+    return [
+        ensured(action.poll).message_id,
+        action.trigger_message_id,
+        *action.duplicate_trigger_ids,
+    ]
 
 
 def calculate_poll_results(action: ActionData) -> dict[int, int]:
     current_vote_results: dict[int, int] = defaultdict(int)
-    if action.poll:
+    if action.poll and action.poll.counts:
+        current_vote_results.update(enumerate(action.poll.counts))
+    elif action.poll:
+        # poll stored before counters, nobody has voted on it since
         for vote in action.poll.votes:
             for answer in vote.answer:
                 current_vote_results[answer] += 1
@@ -79,103 +282,149 @@ def calculate_poll_results(action: ActionData) -> dict[int, int]:
 
 async def handle_consensus(
     ctx: CallbackContext, action: ActionData
-) -> PipelineStep:
+) -> StepResult:
     if action.poll is None:
         logger.error(f"Poll data not found: {action.action_id}")
-        return PipelineStep.ERROR
+        return StepResult(step=PipelineStep.ERROR)
     results = calculate_poll_results(action)
     should_execute = results[YES_IDX] >= results[NO_IDX]
     logger.info(f"Poll results are ready: {results}")
     logger.info(f"Should execute: {should_execute}")
-    await store_poll_result(get_db(ctx), action=action, result=should_execute)
 
     # cleanup poll and trigger
-    await ctx.bot.delete_message(
-        action.chat_id,
-        action.poll.message_id,
-    )
-    await ctx.bot.delete_message(
-        action.chat_id,
-        action.trigger_message_id,
+    schedule_cleanup(ctx, action.chat_id, *_poll_messages(action))
+    return StepResult(
+        step=PipelineStep.EXECUTE if should_execute else PipelineStep.DONE,
+        updates={"poll.win_result": should_execute},
     )
-    if should_execute:
-        return PipelineStep.EXECUTE
-    return PipelineStep.DONE
 
 
 async def execute_action(
     ctx: CallbackContext, action: ActionData
-) -> PipelineStep:
+) -> StepResult:
     match action.action_type:
         case ActionType.PIN:
-            await ctx.bot.pin_chat_message(
-                action.chat_id,
+            await call_once(
+                ctx,
+                action,
+                Priority.PIN,
+                ctx.bot.pin_chat_message,
                 action.target_message_id,
                 disable_notification=True,
             )
         case ActionType.DELETE:
             try:
-                await ctx.bot.delete_message(
-                    action.chat_id,
+                await call_once(
+                    ctx,
+                    action,
+                    Priority.DELETE,
+                    ctx.bot.delete_message,
                     action.target_message_id,
                 )
             except telegram.error.BadRequest:
                 logger.info("Failed to delete message")
-                return PipelineStep.ERROR
+                return StepResult(step=PipelineStep.ERROR)
 
         case ActionType.BAN:
-            await ctx.bot.delete_message(
-                action.chat_id,
-                action.target_message_id,
-            )
+            schedule_cleanup(ctx, action.chat_id, *_target_messages(action))
             duration = float(action.duration) if action.duration else 0
-            await ctx.bot.ban_chat_member(
-                action.chat_id,
-                action.target_user_id,
-                until_date=datetime.utcnow() + timedelta(seconds=duration),
+            await ban_targets(
+                ctx, action, until_date=utcnow() + timedelta(seconds=duration)
             )
         case ActionType.PURGE:
-            await ctx.bot.ban_chat_member(
-                action.chat_id,
-                action.target_user_id,
-                until_date=0,
-                revoke_messages=True,
-            )
+            await ban_targets(ctx, action, until_date=0, revoke_messages=True)
         case ActionType.MUTE:
             permissions = ChatPermissions(
                 can_send_messages=False,
-                can_send_media_messages=False,
+                can_send_audios=False,
+                can_send_documents=False,
+                can_send_photos=False,
+                can_send_videos=False,
+                can_send_video_notes=False,
+                can_send_voice_notes=False,
                 can_send_other_messages=False,
                 can_add_web_page_previews=False,
             )
             duration = float(action.duration) if action.duration else 0
-            await ctx.bot.restrict_chat_member(
-                action.chat_id,
+            await call_once(
+                ctx,
+                action,
+                Priority.MODERATION,
+                ctx.bot.restrict_chat_member,
                 action.target_user_id,
-                until_date=datetime.utcnow() + timedelta(seconds=duration),
+                until_date=utcnow() + timedelta(seconds=duration),
                 permissions=permissions,
             )
         case _:
             logger.warning("Not implemented yet")
 
     if action.duration:
-        next_execution = datetime.utcnow() + timedelta(seconds=action.duration)
-        await postpone_action(
-            get_db(ctx),
-            action_id=action.action_id,
-            next_execution=next_execution,
+        next_execution = utcnow() + timedelta(seconds=action.duration)
+        return StepResult(
+            step=PipelineStep.REVERT,
+            updates={"execute_at": next_execution},
         )
+    return StepResult(step=PipelineStep.DONE)
 
-        return PipelineStep.REVERT
-    return PipelineStep.DONE
 
-
-async def execute_revert(ctx, action) -> PipelineStep:
+async def ban_targets(
+    ctx: CallbackContext, action: ActionData, **kwargs: Any
+) -> None:
+    """Ban every user of the action at once.
+
+    The calls go out as fast as the dispatcher's chat budget allows. A
+    user that can't be banned is skipped, unless nobody could be; any
+    other error fails the step, banning again on retry is harmless.
+    """
+    user_ids = [x.user_id for x in action.targets]
+    if not user_ids:
+        if action.target_user_id is None:
+            logger.error(f"No user to ban: {log_format_action(action)}")
+            return
+        user_ids = [action.target_user_id]
+    results = await asyncio.gather(
+        *(
+            call_once(
+                ctx,
+                action,
+                Priority.MODERATION,
+                ctx.bot.ban_chat_member,
+                user_id,
+                name=f"ban_chat_member:{user_id}",
+                **kwargs,
+            )
+            for user_id in user_ids
+        ),
+        return_exceptions=True,
+    )
+    errors = [
+        (user_id, result)
+        for user_id, result in zip(user_ids, results)
+        if isinstance(result, BaseException)
+    ]
+    for user_id, error in errors:
+        if not isinstance(error, telegram.error.BadRequest):
+            raise error
+        logger.warning(f"Failed to ban {user_id}: {error.message}")
+    if errors and len(errors) == len(user_ids):
+        raise errors[0][1]
+
+
+def _target_messages(action: ActionData) -> list[str]:
+    if not action.targets:
+        return [action.target_message_id]
+    return [x.message_id for x in action.targets if x.message_id]
+
+
+async def execute_revert(ctx, action) -> StepResult:
     match action.action_type:
         case ActionType.PIN:
             try:
-                await ctx.bot.unpin_chat_message(
-                    action.chat_id,
+                await call_once(
+                    ctx,
+                    action,
+                    Priority.PIN,
+                    ctx.bot.unpin_chat_message,
                     action.target_message_id,
                 )
             except telegram.error.BadRequest as e:
@@ -196,85 +445,373 @@ async def execute_revert(ctx, action) -> PipelineStep:
         case _:
             logger.warning("Not implemented yet")
 
-    return PipelineStep.DONE
+    return StepResult(step=PipelineStep.DONE)
 
 
 async def process_pipeline_step(
     ctx: CallbackContext, action: ActionData
 ) -> None:
-    now = datetime.now(tz=UTC)
-    if action.execute_at > now:
+    now = utcnow()
+    # votes run the poll check on the spot, the backoff only spaces out
+    # the checks nobody asked for
+    if action.execute_at > now and action.step != PipelineStep.POLL:
         logger.info(f"Not ready to execute\n {log_format_action(action)}")
         return
+    with PIPELINE_STEP_SECONDS.time(action.step.value):
+        await _process_step(ctx, action)
+
 
-    current_step = action.step
-    next_step = None
+async def _process_step(ctx: CallbackContext, action: ActionData) -> None:
+    result = None
     match action.step:
         case PipelineStep.START:
-            next_step = await start_poll(ctx, action)
+            result = await start_poll(ctx, action)
         case PipelineStep.POLL:
             logger.debug("Start the poll")
-            next_step = await check_poll_state(ctx, action)
+            result = await check_poll_state(ctx, action)
         case PipelineStep.CONSENSUS:
             logger.debug(
                 "Need to decide if we should execute base on consensus"
             )
-            next_step = await handle_consensus(ctx, action)
+            result = await handle_consensus(ctx, action)
         case PipelineStep.EXECUTE:
             try:
-                next_step = await execute_action(ctx, action)
+                result = await execute_action(ctx, action)
             except telegram.error.BadRequest as e:
                 logger.exception("Failed to execute action")
                 await report_error(ctx, action, e)
-                next_step = PipelineStep.ERROR
+                result = StepResult(step=PipelineStep.ERROR)
             logger.debug("Execute action")
         case PipelineStep.REVERT:
-            next_step = await execute_revert(ctx, action)
+            result = await execute_revert(ctx, action)
         case PipelineStep.DONE:
             logger.info(
                 "Pipeline executed successfully", extra={"action": action}
             )
 
-    if next_step:
-        await change_step(
-            get_db(ctx), action_id=action.action_id, step=next_step
+    if result is None:
+        logger.info("We are done with this action")
+    elif result.step == action.step and not result.updates:
+        # nothing changed, look again later and later
+        await apply_step_result(ctx, action, backoff(action))
+    else:
+        await apply_step_result(ctx, action, result)
+
+
+def backoff(action: ActionData) -> StepResult:
+    """Keep the step, push ``execute_at`` out exponentially.
+
+    Keeps actions waiting on something out of the ready scans. A poll is
+    never pushed past its deadline, so it still closes in time.
+    """
+    delay = min(
+        IDLE_BACKOFF_BASE * 2 ** min(action.idle_runs, 16), IDLE_BACKOFF_MAX
+    )
+    execute_at = utcnow() + timedelta(seconds=delay)
+    if action.step == PipelineStep.POLL:
+        execute_at = min(execute_at, poll_deadline(action))
+    return StepResult(
+        step=action.step,
+        updates={"execute_at": execute_at, "idle_runs": action.idle_runs + 1},
+    )
+
+
+async def apply_step_result(
+    ctx: CallbackContext, action: ActionData, result: StepResult
+) -> None:
+    updates = result.updates
+    if result.step in TERMINAL_STEPS:
+        # archive_finished_actions moves it out once this is old enough
+        updates = {**updates, "finished_at": utcnow()}
+    if result.step != action.step and action.idle_runs:
+        updates = {**updates, "idle_runs": 0}
+    updated = await get_store(ctx).transition(
+        action_id=action.action_id,
+        from_step=action.step,
+        to_step=result.step,
+        extra_fields=updates,
+    )
+    if updated is None:
+        logger.warning(
+            f"Action moved on concurrently, drop {result.step} transition"
+            f"\n {log_format_action(action)}"
         )
-        if current_step != next_step:
-            run_pipeline_now(ctx)
+        return
+
+    if updated.poll is not None and updated.step != PipelineStep.POLL:
+        get_poll_cache(ctx).pop(updated.poll.id)
+
+    scheduler = get_scheduler(ctx)
+    if updated.step in TERMINAL_STEPS:
+        scheduler.discard(updated.action_id)
+    elif updated.execute_at > utcnow():
+        scheduler.schedule(updated.action_id, updated.execute_at)
+    elif updated.step != action.step:
+        run_pipeline_for(ctx, updated.action_id, updated.chat_id)
     else:
-        logger.info("We are done with this action")
+        scheduler.discard(updated.action_id)
 
 
 async def report_error(
     ctx: CallbackContext, action: ActionData, err: telegram.error.BadRequest
 ) -> None:
-    await ctx.bot.send_message(
-        chat_id=action.chat_id,
+    await dispatch(
+        ctx,
+        Priority.REPLY,
+        ctx.bot.send_message,
+        action.chat_id,
         text=f"Я попробовал, но чот не получается, сорян:\n\t{err.message}",
     )
 
 
+async def _process_action(ctx: CallbackContext, action: ActionData) -> None:
+    try:
+        await process_pipeline_step(ctx, action)
+    except telegram.error.BadRequest:
+        logger.exception("Failed to process action")
+        await apply_step_result(
+            ctx, action, StepResult(step=PipelineStep.ERROR)
+        )
+
+
+def schedule_cleanup(
+    ctx: CallbackContext, chat_id: int, *message_ids: str
+) -> None:
+    if get_cleanup_queue(ctx).add(chat_id, *message_ids):
+        q = cast(JobQueue, ctx.job_queue)
+        q.run_once(execute_cleanup, when=CLEANUP_DELAY)
+
+
+async def execute_cleanup(ctx: CallbackContext) -> None:
+    await flush_cleanup_queue(
+        ctx.bot, get_dispatcher(ctx), get_cleanup_queue(ctx)
+    )
+
+
+def set_concurrency(limit: int) -> None:
+    global _semaphore
+    if limit < 1:
+        raise ValueError(f"Pipeline concurrency must be positive: {limit}")
+    _semaphore = asyncio.Semaphore(limit)
+
+
+def set_scan_batch_size(size: int) -> None:
+    global _scan_batch_size
+    if size < 1:
+        raise ValueError(f"Scan batch size must be positive: {size}")
+    _scan_batch_size = size
+
+
+def _lease_until() -> datetime:
+    return utcnow() + timedelta(seconds=LEASE_DURATION)
+
+
+@contextlib.asynccontextmanager
+async def _chat_lock(chat_id: int) -> AsyncIterator[None]:
+    lock = _chat_locks.setdefault(chat_id, asyncio.Lock())
+    _chat_lock_users[chat_id] += 1
+    try:
+        async with lock:
+            yield
+    finally:
+        _chat_lock_users[chat_id] -= 1
+        if not _chat_lock_users[chat_id]:
+            del _chat_lock_users[chat_id], _chat_locks[chat_id]
+
+
+async def _advance(
+    ctx: CallbackContext, chat_id: int, action_id: str, release: bool = True
+) -> None:
+    started = time.perf_counter()
+    async with _chat_lock(chat_id):
+        locked = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(locked - started, "chat")
+        slot = _PipelineSlot(_semaphore)
+        await slot.acquire()
+        token = _slot.set(slot)
+        try:
+            LOCK_WAIT_SECONDS.observe(
+                time.perf_counter() - locked, "semaphore"
+            )
+            store, owner = get_store(ctx), get_node_id(ctx)
+            # re-read under the lease, another run could have advanced it
+            action = await store.claim(action_id, owner, _lease_until())
+            if action is None:
+                if release:
+                    await _retry_after_lease(ctx, action_id)
+                return
+            _leases.add(action_id)
+            try:
+                await _process_action(ctx, action)
+            finally:
+                if release:
+                    _leases.discard(action_id)
+                    await store.release_leases(owner, [action_id])
+        finally:
+            _slot.reset(token)
+            slot.release()
+
+
+async def _retry_after_lease(ctx: CallbackContext, action_id: str) -> None:
+    # a targeted run is not dropped when another node holds the action,
+    # the lease may expire without that node getting to it
+    action = await get_store(ctx).fetch_lease_ref(action_id)
+    if action is None or action.step in TERMINAL_STEPS:
+        logger.info(f"Action {action_id} is finished")
+        return
+    retry_at = max(as_utc(action.lease_until or utcnow()), utcnow())
+    logger.info(
+        f"Action {action_id} is held by {action.owner}, retry at {retry_at}"
+    )
+    get_scheduler(ctx).schedule(action_id, retry_at)
+
+
+class _ScanSlots:
+    """Claimed actions of a scan not processed yet, bounded by ``size``."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.used = 0
+        self._freed = asyncio.Event()
+
+    def take(self) -> None:
+        self.used += 1
+
+    def free(self, count: int = 1) -> None:
+        self.used -= count
+        self._freed.set()
+
+    async def wait(self) -> int:
+        """Wait for a free slot, return how many there are."""
+        while self.used >= self.size:
+            self._freed.clear()
+            await self._freed.wait()
+        return self.size - self.used
+
+
+async def _process_chat(
+    ctx: CallbackContext,
+    chat_id: int,
+    action_ids: deque[str],
+    slots: _ScanSlots,
+) -> None:
+    try:
+        while action_ids:
+            action_id = action_ids.popleft()
+            try:
+                # the scan holds the leases until every chat is done
+                await _advance(ctx, chat_id, action_id, release=False)
+            finally:
+                slots.free()
+    finally:
+        # a failed chat gives the slots of its queue back
+        slots.free(len(action_ids))
+        action_ids.clear()
+
+
 async def execute_scheduled_actions(ctx: CallbackContext) -> None:
     logger.debug("Execute scheduled actions")
-    async with lock:
-        logger.info("Got lock")
-        for action in await fetch_ready_actions(get_db(ctx)):
-            logger.info(f"Got scheduled action: {log_format_action(action)}")
-            try:
-                await process_pipeline_step(ctx, action)
-            except telegram.error.BadRequest:
-                logger.exception("Failed to process action")
-                await change_step(
-                    get_db(ctx),
-                    action_id=action.action_id,
-                    step=PipelineStep.ERROR,
-                )
-        logger.info("Processed tasks")
-    logger.debug("Lock released")
+    queues: dict[int, deque[str]] = {}
+    workers: dict[int, asyncio.Task] = {}
+    tasks: list[tuple[int, asyncio.Task]] = []
+    store, owner = get_store(ctx), get_node_id(ctx)
+    claimed: list[str] = []
+    seen: set[str] = set()
+    # the next batch is claimed only once the workers are through part of
+    # the previous one, due actions beyond that are left to other nodes
+    slots = _ScanSlots(_scan_batch_size)
+    try:
+        # claimed actions stay leased until the end of the scan, so the
+        # loop runs out of unleased ones; actions released by a targeted
+        # run in the meantime can come back and are skipped
+        while batch := await store.claim_ready(
+            owner, _lease_until(), await slots.wait()
+        ):
+            for ref in batch:
+                claimed.append(ref.action_id)
+                _leases.add(ref.action_id)
+                if ref.action_id in seen:
+                    continue
+                seen.add(ref.action_id)
+                logger.info(f"Got scheduled action {ref.action_id}")
+                chat_id = ref.chat_id
+                worker = workers.get(chat_id)
+                if worker is None or worker.done():
+                    queues[chat_id] = deque()
+                    worker = asyncio.create_task(
+                        _process_chat(ctx, chat_id, queues[chat_id], slots)
+                    )
+                    workers[chat_id] = worker
+                    tasks.append((chat_id, worker))
+                slots.take()
+                queues[chat_id].append(ref.action_id)
+        SCAN_READY_ACTIONS.observe(len(seen))
+
+        results = await asyncio.gather(
+            *(task for _, task in tasks), return_exceptions=True
+        )
+    finally:
+        _leases.difference_update(claimed)
+        if claimed:
+            await store.release_leases(owner, claimed)
+    for (chat_id, _), result in zip(tasks, results):
+        if isinstance(result, BaseException):
+            logger.error(
+                f"Failed to process actions of chat {chat_id}",
+                exc_info=result,
+            )
+    logger.info(f"Processed tasks of {len(workers)} chats")
+
+
+async def execute_single_action(ctx: CallbackContext) -> None:
+    action_id, chat_id = cast(tuple[str, int | None], ensured(ctx.job).data)
+    _pending.discard(action_id)
+    if chat_id is None:
+        # the chat lock comes before the claim, which reads the action
+        ref = await get_store(ctx).fetch_lease_ref(action_id)
+        if ref is None:
+            logger.info(f"Action {action_id} not found")
+            return
+        chat_id = ref.chat_id
+    await _advance(ctx, chat_id, action_id)
+
+
+async def execute_due_actions(ctx: CallbackContext) -> None:
+    due = get_scheduler(ctx).pop_due()
+    if due:
+        logger.info(f"Scheduler woke up for {len(due)} actions")
+    for action_id in due:
+        run_pipeline_for(ctx, action_id)
+
+
+async def renew_leases(ctx: CallbackContext) -> None:
+    if _leases:
+        await get_store(ctx).renew_leases(
+            get_node_id(ctx), list(_leases), _lease_until()
+        )
 
 
-def run_pipeline_now(ctx: CallbackContext) -> None:
+async def archive_finished_actions(ctx: CallbackContext) -> None:
+    archived, purged = await archive_finished(
+        get_store(ctx), get_archive_policy(ctx)
+    )
+    if archived or purged:
+        logger.info(f"Archived {archived} actions, purged {purged}")
+
+
+def run_pipeline_for(
+    ctx: CallbackContext, action_id: str, chat_id: int | None = None
+) -> None:
+    """Advance the action in a job of its own.
+
+    Callers that have the action at hand pass its chat, the run then
+    reads it only once, when it claims it.
+    """
+    if action_id in _pending:
+        logger.debug(f"Run for {action_id} is already pending, skip")
+        return
     if not ctx.job_queue:
         raise RuntimeError("Job queue is required to run this bot")
     q = cast(JobQueue, ctx.job_queue)
-    q.run_once(execute_scheduled_actions, when=0)
+    _pending.add(action_id)
+    q.run_once(execute_single_action, when=0, data=(action_id, chat_id))
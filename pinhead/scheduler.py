@@ -0,0 +1,94 @@
+import heapq
+import logging
+from collections.abc import Callable, Coroutine, Iterable
+from datetime import datetime
+from typing import Any
+
+from telegram.ext import CallbackContext, Job, JobQueue
+
+from pinhead.clock import as_utc, utcnow
+
+logger = logging.getLogger(__name__)
+
+WakeCallback = Callable[[CallbackContext], Coroutine[Any, Any, None]]
+
+
+class ActionScheduler:
+    """Min-heap of pending actions keyed on ``execute_at``.
+
+    A single job is kept in the job queue, armed for the earliest entry.
+    Rescheduled and discarded actions leave stale heap entries behind,
+    they are dropped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, job_queue: JobQueue, callback: WakeCallback):
+        self._job_queue = job_queue
+        self._callback = callback
+        self._heap: list[tuple[datetime, str]] = []
+        self._due_at: dict[str, datetime] = {}
+        self._job: Job | None = None
+        self._job_at: datetime | None = None
+
+    def __len__(self) -> int:
+        return len(self._due_at)
+
+    def __contains__(self, action_id: str) -> bool:
+        return action_id in self._due_at
+
+    def load(self, entries: Iterable[tuple[str, datetime]]) -> None:
+        for action_id, execute_at in entries:
+            self._push(action_id, execute_at)
+        logger.info(f"Loaded {len(self)} scheduled actions")
+        self._rearm()
+
+    def schedule(self, action_id: str, execute_at: datetime) -> None:
+        self._push(action_id, execute_at)
+        self._rearm()
+
+    def discard(self, action_id: str) -> None:
+        # the armed job is left as is, at worst it wakes up for nothing
+        self._due_at.pop(action_id, None)
+
+    def next_due(self) -> datetime | None:
+        while self._heap:
+            execute_at, action_id = self._heap[0]
+            if self._due_at.get(action_id) == execute_at:
+                return execute_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime | None = None) -> list[str]:
+        now = now or utcnow()
+        due = []
+        while (next_due := self.next_due()) is not None and next_due <= now:
+            _, action_id = heapq.heappop(self._heap)
+            del self._due_at[action_id]
+            due.append(action_id)
+        return due
+
+    def _push(self, action_id: str, execute_at: datetime) -> None:
+        execute_at = as_utc(execute_at)
+        self._due_at[action_id] = execute_at
+        heapq.heappush(self._heap, (execute_at, action_id))
+
+    def _rearm(self) -> None:
+        next_due = self.next_due()
+        if next_due is None:
+            return
+        if self._job is not None and self._job_at is not None:
+            if self._job_at <= next_due:
+                return
+            self._job.schedule_removal()
+        delay = (next_due - utcnow()).total_seconds()
+        self._job = self._job_queue.run_once(
+            self._wake, when=max(delay, 0), name="scheduler_wake"
+        )
+        self._job_at = next_due
+
+    async def _wake(self, ctx: CallbackContext) -> None:
+        self._job = None
+        self._job_at = None
+        try:
+            await self._callback(ctx)
+        finally:
+            self._rearm()
@@ -0,0 +1,70 @@
+"""Cold start bookkeeping, kept free of heavy imports.
+
+``main`` imports this first, so the clock starts before telegram, motor
+and the rest are loaded.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Durations of the startup phases, and marks since the process start."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.first_update = asyncio.Event()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - started)
+
+    def mark(self, name: str) -> None:
+        """Record the time from the process start, once."""
+        if name not in self.phases:
+            self._record(name, time.perf_counter() - self.started)
+
+    def update_handled(self) -> None:
+        if not self.first_update.is_set():
+            self.mark("first_update")
+            self.first_update.set()
+            logger.info(f"Startup breakdown: {self.report()}")
+
+    def _record(self, name: str, seconds: float) -> None:
+        from pinhead.metrics import STARTUP_SECONDS
+
+        self.phases[name] = seconds
+        STARTUP_SECONDS.set(seconds, name)
+
+    def report(self) -> str:
+        return ", ".join(
+            f"{name} {seconds * 1000:.0f}ms"
+            for name, seconds in self.phases.items()
+        )
+
+
+STARTUP = StartupTimer()
+
+
+async def load_application(*args: Any, **kwargs: Any) -> Any:
+    """Import ``pinhead.app`` off the event loop, then build the bot.
+
+    The import is the bulk of a cold start; in a thread it leaves the
+    loop free to acknowledge the webhook calls that woke us up.
+    Arguments go to ``pinhead.app.build_application``.
+    """
+    with STARTUP.phase("imports"):
+        app = await asyncio.to_thread(importlib.import_module, "pinhead.app")
+    with STARTUP.phase("build"):
+        return app.build_application(*args, **kwargs)
@@ -0,0 +1,42 @@
+from pinhead.config import Config
+from pinhead.store.base import ActionStore
+from pinhead.store.memory import MemoryActionStore
+from pinhead.store.mongo import MongoActionStore
+from pinhead.store.sqlite import SqliteActionStore
+
+__all__ = [
+    "ActionStore",
+    "MemoryActionStore",
+    "MongoActionStore",
+    "SqliteActionStore",
+    "create_store",
+]
+
+
+def create_store(cfg: Config) -> ActionStore:
+    match cfg.storage_backend:
+        case "mongo":
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            perf = cfg.performance
+            write_concern = perf.mongo_write_concern
+            client = AsyncIOMotorClient(
+                cfg.mongo_uri,
+                tz_aware=True,
+                maxPoolSize=perf.mongo_max_pool_size,
+                minPoolSize=perf.mongo_min_pool_size,
+                connectTimeoutMS=perf.mongo_connect_timeout_ms,
+                serverSelectionTimeoutMS=(
+                    perf.mongo_server_selection_timeout_ms
+                ),
+                socketTimeoutMS=perf.mongo_socket_timeout_ms or None,
+                w=int(write_concern)
+                if write_concern.isdigit()
+                else write_concern,
+            )
+            return MongoActionStore(client.get_database(cfg.mongo_db_name))
+        case "sqlite":
+            return SqliteActionStore(cfg.sqlite_path)
+        case "memory":
+            return MemoryActionStore()
+    raise ValueError(f"Unknown storage backend: {cfg.storage_backend}")
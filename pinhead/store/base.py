@@ -0,0 +1,244 @@
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Any, Protocol
+
+from pinhead.clock import as_utc, utcnow
+from pinhead.constants import (
+    ARCHIVE_BATCH_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE,
+)
+from pinhead.data import (
+    TERMINAL_STEPS,
+    ActionData,
+    ActionRef,
+    ActionType,
+    IntentData,
+    LeaseRef,
+    PipelineStep,
+    PollData,
+    PollRef,
+    VoteData,
+)
+
+
+class ActionStore(Protocol):
+    """Storage of actions as the pipeline and the handlers see it."""
+
+    async def ensure_indexes(self) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+    async def warm_up(self) -> None:
+        ...
+
+    async def store_action(self, action: ActionData) -> None:
+        ...
+
+    async def store_or_attach(self, action: ActionData) -> ActionData:
+        """Store the action, unless an active one has the same target.
+
+        Active actions are unique per chat, target message and action
+        type. A duplicate is not stored, its trigger joins the running
+        action instead, which is returned. Callers compare action ids.
+        """
+        ...
+
+    async def store_poll(self, action: ActionData, poll: PollData) -> None:
+        ...
+
+    async def change_step(self, action_id: str, step: PipelineStep) -> None:
+        ...
+
+    async def transition(
+        self,
+        action_id: str,
+        from_step: PipelineStep,
+        to_step: PipelineStep,
+        extra_fields: dict[str, Any] | None = None,
+    ) -> ActionData | None:
+        ...
+
+    async def claim(
+        self, action_id: str, owner: str, lease_until: datetime
+    ) -> ActionData | None:
+        ...
+
+    async def claim_ready(
+        self,
+        owner: str,
+        lease_until: datetime,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionRef]:
+        """Lease up to ``limit`` due actions nobody holds, earliest first.
+
+        Only references are returned, the worker reads the action itself
+        when it claims it again to process it.
+        """
+        ...
+
+    async def renew_leases(
+        self, owner: str, action_ids: list[str], lease_until: datetime
+    ) -> None:
+        ...
+
+    async def release_leases(self, owner: str, action_ids: list[str]) -> None:
+        ...
+
+    async def add_intent(self, action_id: str, intent: IntentData) -> None:
+        ...
+
+    async def complete_intent(
+        self, action_id: str, key: str, result: dict[str, Any]
+    ) -> None:
+        ...
+
+    async def drop_intent(self, action_id: str, key: str) -> None:
+        ...
+
+    async def fetch_open_intents(self) -> list[tuple[str, IntentData]]:
+        """Uncompleted intents of active actions no node holds a lease on."""
+        ...
+
+    async def store_vote(self, action_id: str, vote_data: VoteData) -> None:
+        ...
+
+    async def store_votes(self, votes: list[tuple[str, VoteData]]) -> None:
+        ...
+
+    async def fetch_action_by_id(self, action_id: str) -> ActionData | None:
+        ...
+
+    async def fetch_action_by_poll_id(self, poll_id: str) -> ActionData | None:
+        ...
+
+    async def fetch_poll_ref(self, poll_id: str) -> PollRef | None:
+        ...
+
+    async def fetch_lease_ref(self, action_id: str) -> LeaseRef | None:
+        """The chat, step and lease of an action, without the document."""
+        ...
+
+    def iter_ready_actions(
+        self,
+        type: ActionType | None = None,
+        *,
+        batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+        limit: int | None = None,
+        with_votes: bool = True,
+    ) -> AsyncIterator[ActionData]:
+        ...
+
+    async def fetch_ready_actions(
+        self, type: ActionType | None = None
+    ) -> list[ActionData]:
+        ...
+
+    async def fetch_scheduled_actions(self) -> list[tuple[str, datetime]]:
+        ...
+
+    async def count_actions(self) -> int:
+        ...
+
+    async def archive_finished(
+        self, finished_before: datetime, limit: int = ARCHIVE_BATCH_SIZE
+    ) -> int:
+        ...
+
+    async def purge_archive(self, archived_before: datetime) -> int:
+        ...
+
+    async def fetch_archived_actions(
+        self,
+        chat_id: int,
+        since: datetime | None = None,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionData]:
+        ...
+
+
+def is_active(action: ActionData) -> bool:
+    return action.step not in TERMINAL_STEPS
+
+
+def target_key(action: ActionData) -> tuple[int, str, ActionType]:
+    return action.chat_id, action.target_message_id, action.action_type
+
+
+def is_archivable(action: ActionData, finished_before: datetime) -> bool:
+    return (
+        not is_active(action)
+        and action.finished_at is not None
+        and as_utc(action.finished_at) <= finished_before
+    )
+
+
+def is_ready(action: ActionData, now: datetime) -> bool:
+    return is_active(action) and as_utc(action.execute_at) <= now
+
+
+def is_lease_free(action: ActionData, now: datetime) -> bool:
+    return action.lease_until is None or as_utc(action.lease_until) <= now
+
+
+def can_claim(action: ActionData, owner: str, now: datetime) -> bool:
+    return is_active(action) and (
+        action.owner == owner or is_lease_free(action, now)
+    )
+
+
+def open_intents(action: ActionData) -> list[IntentData]:
+    return [x for x in action.intents if x.completed_at is None]
+
+
+def complete_intent(
+    action: ActionData, key: str, result: dict[str, Any]
+) -> None:
+    for intent in action.intents:
+        if intent.key == key:
+            intent.completed_at = utcnow()
+            intent.result = result
+
+
+def drop_intent(action: ActionData, key: str) -> None:
+    action.intents = [x for x in action.intents if x.key != key]
+
+
+def apply_fields(action: ActionData, fields: dict[str, Any]) -> None:
+    """Set dotted ``poll.win_result`` style paths, the way $set does."""
+    for path, value in fields.items():
+        *parents, name = path.split(".")
+        target: Any = action
+        for parent in parents:
+            target = getattr(target, parent)
+        if isinstance(value, datetime):
+            value = as_utc(value)
+        setattr(target, name, value)
+
+
+def tally(poll: PollData) -> list[int]:
+    counts = [0] * len(poll.options)
+    for vote in poll.votes:
+        for answer in vote.answer:
+            counts[answer] += 1
+    return counts
+
+
+def apply_vote(poll: PollData, vote_data: VoteData) -> None:
+    """Replace the user's previous vote and apply the delta to the counts.
+
+    Same semantics as the update pipeline in ``pinhead.db.vote_update``.
+    """
+    if len(poll.counts) != len(poll.options):
+        poll.counts = tally(poll)
+    others = []
+    for vote in poll.votes:
+        if vote.user_id != vote_data.user_id:
+            others.append(vote)
+            continue
+        for answer in vote.answer:
+            poll.counts[answer] -= 1
+    for answer in vote_data.answer:
+        poll.counts[answer] += 1
+    poll.votes = others + [vote_data] if vote_data.answer else others
@@ -0,0 +1,320 @@
+import bisect
+import copy
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Any
+
+from pinhead.clock import as_utc, utcnow
+from pinhead.constants import (
+    ARCHIVE_BATCH_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE,
+)
+from pinhead.data import (
+    ActionData,
+    ActionRef,
+    ActionType,
+    IntentData,
+    LeaseRef,
+    PipelineStep,
+    PollData,
+    PollRef,
+    VoteData,
+)
+from pinhead.store.base import (
+    apply_fields,
+    apply_vote,
+    can_claim,
+    complete_intent,
+    drop_intent,
+    is_active,
+    is_archivable,
+    is_lease_free,
+    open_intents,
+    target_key,
+)
+
+
+def _due_key(action: ActionData) -> tuple[datetime, str]:
+    return as_utc(action.execute_at), action.action_id
+
+
+class MemoryActionStore:
+    """In-process ActionStore, for tests, benchmarks and throwaway runs.
+
+    Active actions are kept in a list sorted by ``execute_at``, so the
+    ready scan is a bisect, and polls are indexed by id. Stored and
+    returned actions are copies, the way a real database behaves.
+    """
+
+    def __init__(self) -> None:
+        self._actions: dict[str, ActionData] = {}
+        self._by_poll_id: dict[str, str] = {}
+        self._due: list[tuple[datetime, str]] = []
+        # the active action of each target, what a unique index would do
+        self._active_targets: dict[tuple, str] = {}
+        # archived_at and the action, by action id
+        self._archive: dict[str, tuple[datetime, ActionData]] = {}
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def warm_up(self) -> None:
+        pass
+
+    def _index(self, action: ActionData) -> None:
+        if is_active(action):
+            bisect.insort(self._due, _due_key(action))
+            self._active_targets[target_key(action)] = action.action_id
+        if action.poll is not None:
+            self._by_poll_id[action.poll.id] = action.action_id
+
+    def _unindex(self, action: ActionData) -> None:
+        if is_active(action):
+            key = _due_key(action)
+            idx = bisect.bisect_left(self._due, key)
+            if idx < len(self._due) and self._due[idx] == key:
+                del self._due[idx]
+            self._active_targets.pop(target_key(action), None)
+
+    def _update(self, action_id: str, update: Any) -> ActionData | None:
+        action = self._actions.get(action_id)
+        if action is None:
+            return None
+        self._unindex(action)
+        update(action)
+        self._index(action)
+        return action
+
+    async def store_action(self, action: ActionData) -> None:
+        if action.action_id in self._actions:
+            raise ValueError(f"Duplicate action id: {action.action_id}")
+        if is_active(action) and target_key(action) in self._active_targets:
+            raise ValueError(f"Duplicate active action: {action.action_id}")
+        action = copy.deepcopy(action)
+        self._actions[action.action_id] = action
+        self._index(action)
+
+    async def store_or_attach(self, action: ActionData) -> ActionData:
+        action_id = self._active_targets.get(target_key(action))
+        if action_id is None:
+            await self.store_action(action)
+            return copy.deepcopy(action)
+        existing = self._actions[action_id]
+        if action.trigger_message_id not in existing.duplicate_trigger_ids:
+            existing.duplicate_trigger_ids.append(action.trigger_message_id)
+        return copy.deepcopy(existing)
+
+    async def store_poll(self, action: ActionData, poll: PollData) -> None:
+        self._update(
+            action.action_id,
+            lambda x: apply_fields(x, {"poll": copy.deepcopy(poll)}),
+        )
+
+    async def change_step(self, action_id: str, step: PipelineStep) -> None:
+        self._update(action_id, lambda x: apply_fields(x, {"step": step}))
+
+    async def transition(
+        self,
+        action_id: str,
+        from_step: PipelineStep,
+        to_step: PipelineStep,
+        extra_fields: dict[str, Any] | None = None,
+    ) -> ActionData | None:
+        action = self._actions.get(action_id)
+        if action is None or action.step != from_step:
+            return None
+        fields = {**copy.deepcopy(extra_fields or {}), "step": to_step}
+        self._update(action_id, lambda x: apply_fields(x, fields))
+        return copy.deepcopy(action)
+
+    def _lease(
+        self, action: ActionData, owner: str, lease_until: datetime
+    ) -> None:
+        action.owner = owner
+        action.lease_until = as_utc(lease_until)
+
+    async def claim(
+        self, action_id: str, owner: str, lease_until: datetime
+    ) -> ActionData | None:
+        action = self._actions.get(action_id)
+        if action is None or not can_claim(action, owner, utcnow()):
+            return None
+        self._lease(action, owner, lease_until)
+        return copy.deepcopy(action)
+
+    async def claim_ready(
+        self,
+        owner: str,
+        lease_until: datetime,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionRef]:
+        now = utcnow()
+        end = bisect.bisect_right(self._due, now, key=lambda x: x[0])
+        claimed: list[ActionRef] = []
+        for _, action_id in self._due[:end]:
+            if len(claimed) >= limit:
+                break
+            action = self._actions[action_id]
+            if not is_lease_free(action, now):
+                continue
+            self._lease(action, owner, lease_until)
+            claimed.append(
+                ActionRef(action_id=action_id, chat_id=action.chat_id)
+            )
+        return claimed
+
+    async def renew_leases(
+        self, owner: str, action_ids: list[str], lease_until: datetime
+    ) -> None:
+        for action_id in action_ids:
+            action = self._actions.get(action_id)
+            if action is not None and action.owner == owner:
+                action.lease_until = as_utc(lease_until)
+
+    async def release_leases(self, owner: str, action_ids: list[str]) -> None:
+        for action_id in action_ids:
+            action = self._actions.get(action_id)
+            if action is not None and action.owner == owner:
+                action.owner = action.lease_until = None
+
+    async def add_intent(self, action_id: str, intent: IntentData) -> None:
+        action = self._actions.get(action_id)
+        if action is not None:
+            action.intents.append(copy.deepcopy(intent))
+
+    async def complete_intent(
+        self, action_id: str, key: str, result: dict[str, Any]
+    ) -> None:
+        action = self._actions.get(action_id)
+        if action is not None:
+            complete_intent(action, key, copy.deepcopy(result))
+
+    async def drop_intent(self, action_id: str, key: str) -> None:
+        action = self._actions.get(action_id)
+        if action is not None:
+            drop_intent(action, key)
+
+    async def fetch_open_intents(self) -> list[tuple[str, IntentData]]:
+        now = utcnow()
+        return [
+            (action_id, copy.deepcopy(intent))
+            for _, action_id in self._due
+            if is_lease_free(self._actions[action_id], now)
+            for intent in open_intents(self._actions[action_id])
+        ]
+
+    async def store_vote(self, action_id: str, vote_data: VoteData) -> None:
+        action = self._actions.get(action_id)
+        if action is not None and action.poll is not None:
+            apply_vote(action.poll, copy.deepcopy(vote_data))
+
+    async def store_votes(self, votes: list[tuple[str, VoteData]]) -> None:
+        for action_id, vote_data in votes:
+            await self.store_vote(action_id, vote_data)
+
+    async def fetch_action_by_id(self, action_id: str) -> ActionData | None:
+        return copy.deepcopy(self._actions.get(action_id))
+
+    async def fetch_action_by_poll_id(self, poll_id: str) -> ActionData | None:
+        action_id = self._by_poll_id.get(poll_id)
+        if action_id is None:
+            return None
+        return await self.fetch_action_by_id(action_id)
+
+    async def fetch_poll_ref(self, poll_id: str) -> PollRef | None:
+        action = self._actions.get(self._by_poll_id.get(poll_id, ""))
+        if action is None:
+            return None
+        return PollRef(action_id=action.action_id, step=action.step)
+
+    async def fetch_lease_ref(self, action_id: str) -> LeaseRef | None:
+        action = self._actions.get(action_id)
+        if action is None:
+            return None
+        return LeaseRef(
+            action_id=action_id,
+            chat_id=action.chat_id,
+            step=action.step,
+            owner=action.owner,
+            lease_until=action.lease_until,
+        )
+
+    async def iter_ready_actions(
+        self,
+        type: ActionType | None = None,
+        *,
+        batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+        limit: int | None = None,
+        with_votes: bool = True,
+    ) -> AsyncIterator[ActionData]:
+        end = bisect.bisect_right(self._due, utcnow(), key=lambda x: x[0])
+        returned = 0
+        for _, action_id in self._due[:end]:
+            if limit and returned >= limit:
+                break
+            action = self._actions[action_id]
+            if type is not None and action.action_type != type:
+                continue
+            action = copy.deepcopy(action)
+            if not with_votes and action.poll is not None:
+                action.poll.votes = []
+            returned += 1
+            yield action
+
+    async def fetch_ready_actions(
+        self, type: ActionType | None = None
+    ) -> list[ActionData]:
+        return [action async for action in self.iter_ready_actions(type)]
+
+    async def fetch_scheduled_actions(self) -> list[tuple[str, datetime]]:
+        return [(action_id, execute_at) for execute_at, action_id in self._due]
+
+    async def count_actions(self) -> int:
+        return len(self._actions)
+
+    async def archive_finished(
+        self, finished_before: datetime, limit: int = ARCHIVE_BATCH_SIZE
+    ) -> int:
+        finished = sorted(
+            (
+                x
+                for x in self._actions.values()
+                if is_archivable(x, finished_before)
+            ),
+            key=lambda x: as_utc(x.finished_at),  # type: ignore[arg-type]
+        )[:limit]
+        now = utcnow()
+        for action in finished:
+            del self._actions[action.action_id]
+            if action.poll is not None:
+                self._by_poll_id.pop(action.poll.id, None)
+            self._archive[action.action_id] = now, action
+        return len(finished)
+
+    async def purge_archive(self, archived_before: datetime) -> int:
+        expired = [
+            action_id
+            for action_id, (archived_at, _) in self._archive.items()
+            if archived_at <= archived_before
+        ]
+        for action_id in expired:
+            del self._archive[action_id]
+        return len(expired)
+
+    async def fetch_archived_actions(
+        self,
+        chat_id: int,
+        since: datetime | None = None,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionData]:
+        found = [
+            action
+            for _, action in self._archive.values()
+            if action.chat_id == chat_id
+            and (since is None or as_utc(action.start_at) >= since)
+        ]
+        found.sort(key=lambda x: as_utc(x.start_at), reverse=True)
+        return copy.deepcopy(found[:limit])
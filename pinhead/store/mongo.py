@@ -0,0 +1,162 @@
+from collections.abc import AsyncIterator
+from datetime import datetime
+from typing import Any
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from pinhead import db
+from pinhead.constants import (
+    ARCHIVE_BATCH_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE,
+    WARM_UP_CONNECTIONS,
+)
+from pinhead.data import (
+    ActionData,
+    ActionRef,
+    ActionType,
+    IntentData,
+    LeaseRef,
+    PipelineStep,
+    PollData,
+    PollRef,
+    VoteData,
+)
+
+
+class MongoActionStore:
+    """ActionStore on top of the functions in ``pinhead.db``."""
+
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.db = database
+
+    async def ensure_indexes(self) -> None:
+        await db.ensure_indexes(self.db)
+
+    async def close(self) -> None:
+        self.db.client.close()  # type: ignore[operator]
+
+    async def warm_up(self) -> None:
+        await db.warm_up(self.db, WARM_UP_CONNECTIONS)
+
+    async def store_action(self, action: ActionData) -> None:
+        await db.store_action(self.db, action)
+
+    async def store_or_attach(self, action: ActionData) -> ActionData:
+        return await db.store_or_attach(self.db, action)
+
+    async def store_poll(self, action: ActionData, poll: PollData) -> None:
+        await db.store_poll(self.db, action_data=action, poll_data=poll)
+
+    async def change_step(self, action_id: str, step: PipelineStep) -> None:
+        await db.change_step(self.db, action_id=action_id, step=step)
+
+    async def transition(
+        self,
+        action_id: str,
+        from_step: PipelineStep,
+        to_step: PipelineStep,
+        extra_fields: dict[str, Any] | None = None,
+    ) -> ActionData | None:
+        return await db.transition(
+            self.db,
+            action_id=action_id,
+            from_step=from_step,
+            to_step=to_step,
+            extra_fields=extra_fields,
+        )
+
+    async def claim(
+        self, action_id: str, owner: str, lease_until: datetime
+    ) -> ActionData | None:
+        return await db.claim(self.db, action_id, owner, lease_until)
+
+    async def claim_ready(
+        self,
+        owner: str,
+        lease_until: datetime,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionRef]:
+        return await db.claim_ready(self.db, owner, lease_until, limit)
+
+    async def renew_leases(
+        self, owner: str, action_ids: list[str], lease_until: datetime
+    ) -> None:
+        await db.renew_leases(self.db, owner, action_ids, lease_until)
+
+    async def release_leases(self, owner: str, action_ids: list[str]) -> None:
+        await db.release_leases(self.db, owner, action_ids)
+
+    async def add_intent(self, action_id: str, intent: IntentData) -> None:
+        await db.add_intent(self.db, action_id, intent)
+
+    async def complete_intent(
+        self, action_id: str, key: str, result: dict[str, Any]
+    ) -> None:
+        await db.complete_intent(self.db, action_id, key, result)
+
+    async def drop_intent(self, action_id: str, key: str) -> None:
+        await db.drop_intent(self.db, action_id, key)
+
+    async def fetch_open_intents(self) -> list[tuple[str, IntentData]]:
+        return await db.fetch_open_intents(self.db)
+
+    async def store_vote(self, action_id: str, vote_data: VoteData) -> None:
+        await db.store_vote(self.db, action_id, vote_data=vote_data)
+
+    async def store_votes(self, votes: list[tuple[str, VoteData]]) -> None:
+        await db.store_votes(self.db, votes)
+
+    async def fetch_action_by_id(self, action_id: str) -> ActionData | None:
+        return await db.fetch_action_by_id(self.db, action_id)
+
+    async def fetch_action_by_poll_id(self, poll_id: str) -> ActionData | None:
+        return await db.fetch_action_by_poll_id(self.db, poll_id)
+
+    async def fetch_poll_ref(self, poll_id: str) -> PollRef | None:
+        return await db.fetch_poll_ref(self.db, poll_id)
+
+    async def fetch_lease_ref(self, action_id: str) -> LeaseRef | None:
+        return await db.fetch_lease_ref(self.db, action_id)
+
+    def iter_ready_actions(
+        self,
+        type: ActionType | None = None,
+        *,
+        batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+        limit: int | None = None,
+        with_votes: bool = True,
+    ) -> AsyncIterator[ActionData]:
+        return db.iter_ready_actions(
+            self.db,
+            type,
+            batch_size=batch_size,
+            limit=limit,
+            with_votes=with_votes,
+        )
+
+    async def fetch_ready_actions(
+        self, type: ActionType | None = None
+    ) -> list[ActionData]:
+        return await db.fetch_ready_actions(self.db, type)
+
+    async def fetch_scheduled_actions(self) -> list[tuple[str, datetime]]:
+        return await db.fetch_scheduled_actions(self.db)
+
+    async def count_actions(self) -> int:
+        return await self.db.actions.count_documents({})
+
+    async def archive_finished(
+        self, finished_before: datetime, limit: int = ARCHIVE_BATCH_SIZE
+    ) -> int:
+        return await db.archive_finished(self.db, finished_before, limit)
+
+    async def purge_archive(self, archived_before: datetime) -> int:
+        return await db.purge_archive(self.db, archived_before)
+
+    async def fetch_archived_actions(
+        self,
+        chat_id: int,
+        since: datetime | None = None,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionData]:
+        return await db.fetch_archived_actions(self.db, chat_id, since, limit)
@@ -0,0 +1,572 @@
+import json
+import sqlite3
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from typing import Any
+
+from pinhead.clock import as_utc, utcnow
+from pinhead.codecs import ACTION_JSON_CODEC
+from pinhead.constants import (
+    ARCHIVE_BATCH_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE,
+)
+from pinhead.data import (
+    ACTIVE_STEPS,
+    TERMINAL_STEPS,
+    ActionData,
+    ActionRef,
+    ActionType,
+    IntentData,
+    LeaseRef,
+    PipelineStep,
+    PollData,
+    PollRef,
+    VoteData,
+)
+from pinhead.store.base import (
+    apply_fields,
+    apply_vote,
+    can_claim,
+    complete_intent,
+    drop_intent,
+    open_intents,
+)
+
+# step literals, not parameters: SQLite uses a partial index only when
+# the query repeats the index's WHERE term
+ACTIVE_SQL = "step IN ({})".format(
+    ", ".join(f"'{x.value}'" for x in ACTIVE_STEPS)
+)
+TERMINAL_SQL = "step IN ({})".format(
+    ", ".join(f"'{x.value}'" for x in sorted(TERMINAL_STEPS))
+)
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS actions (
+    action_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    action_type TEXT NOT NULL,
+    step TEXT NOT NULL,
+    execute_at REAL NOT NULL,
+    poll_id TEXT,
+    doc TEXT NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    finished_at REAL,
+    target_message_id TEXT
+);
+CREATE TABLE IF NOT EXISTS actions_archive (
+    action_id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    start_at REAL NOT NULL,
+    archived_at REAL NOT NULL,
+    doc TEXT NOT NULL
+);
+"""
+
+INDEXES = f"""
+CREATE INDEX IF NOT EXISTS actions_poll_id
+    ON actions (poll_id) WHERE poll_id IS NOT NULL;
+DROP INDEX IF EXISTS actions_step_execute_at;
+CREATE INDEX IF NOT EXISTS actions_active_execute_at
+    ON actions (execute_at, action_id) WHERE {ACTIVE_SQL};
+CREATE UNIQUE INDEX IF NOT EXISTS actions_active_target
+    ON actions (chat_id, target_message_id, action_type) WHERE {ACTIVE_SQL};
+CREATE INDEX IF NOT EXISTS actions_finished_at
+    ON actions (finished_at) WHERE finished_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS actions_archive_chat_id_start_at
+    ON actions_archive (chat_id, start_at);
+CREATE INDEX IF NOT EXISTS actions_archive_archived_at
+    ON actions_archive (archived_at);
+"""
+
+# added after the first release, ALTERed into older databases
+LATER_COLUMNS = {
+    "owner": "TEXT",
+    "lease_until": "REAL",
+    "finished_at": "REAL",
+    "target_message_id": "TEXT",
+}
+
+# the oldest of the active actions sharing a target keeps running, the
+# rest are closed as errors so the unique index can be built
+CLOSE_DUPLICATES = f"""
+UPDATE actions SET
+    step = 'error',
+    finished_at = :now,
+    doc = json_set(doc, '$.step', 'error', '$.finished_at', :now_iso)
+WHERE {ACTIVE_SQL} AND rowid NOT IN (
+    SELECT min(rowid) FROM actions WHERE {ACTIVE_SQL}
+    GROUP BY chat_id, target_message_id, action_type
+)
+"""
+
+# leases change the columns and their copies in doc together, in one
+# statement and without loading the actions; RETURNING needs SQLite 3.35
+CLAIM_READY = f"""
+UPDATE actions SET
+    owner = :owner,
+    lease_until = :lease_until,
+    doc = json_set(doc, '$.owner', :owner, '$.lease_until', :lease_iso)
+WHERE action_id IN (
+    SELECT action_id FROM actions
+    WHERE {ACTIVE_SQL} AND execute_at <= :now
+        AND (lease_until IS NULL OR lease_until <= :now)
+    ORDER BY execute_at, action_id LIMIT :limit
+)
+RETURNING execute_at, action_id, chat_id
+"""
+RENEW_LEASES = """
+UPDATE actions SET
+    lease_until = ?,
+    doc = json_set(doc, '$.lease_until', ?)
+WHERE owner = ? AND action_id IN ({})
+"""
+RELEASE_LEASES = """
+UPDATE actions SET
+    owner = NULL,
+    lease_until = NULL,
+    doc = json_set(doc, '$.owner', NULL, '$.lease_until', NULL)
+WHERE owner = ? AND action_id IN ({})
+"""
+
+_COLUMNS = (
+    "action_id",
+    "chat_id",
+    "action_type",
+    "step",
+    "execute_at",
+    "poll_id",
+    "doc",
+    "owner",
+    "lease_until",
+    "finished_at",
+    "target_message_id",
+)
+
+
+def _timestamp(value: datetime | None) -> float | None:
+    return as_utc(value).timestamp() if value else None
+
+
+def _row(action: ActionData) -> dict[str, Any]:
+    return {
+        "action_id": action.action_id,
+        "chat_id": action.chat_id,
+        "action_type": action.action_type.value,
+        "step": action.step.value,
+        "execute_at": as_utc(action.execute_at).timestamp(),
+        "poll_id": action.poll.id if action.poll else None,
+        "doc": json.dumps(ACTION_JSON_CODEC.dump(action)),
+        "owner": action.owner,
+        "lease_until": _timestamp(action.lease_until),
+        "finished_at": _timestamp(action.finished_at),
+        "target_message_id": action.target_message_id,
+    }
+
+
+def _load(doc: str) -> ActionData:
+    return ACTION_JSON_CODEC.load(json.loads(doc))
+
+
+class SqliteActionStore:
+    """ActionStore in a local SQLite database in WAL mode.
+
+    Meant for single-node installs. Queries are short and local, they run
+    on the event loop thread; every write is a single transaction, which
+    also makes read-modify-write updates atomic.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    async def ensure_indexes(self) -> None:
+        with self._conn:
+            self._conn.executescript(TABLES)
+            existing = {
+                row[1]
+                for row in self._conn.execute("PRAGMA table_info(actions)")
+            }
+            for name, type_ in LATER_COLUMNS.items():
+                if name not in existing:
+                    self._conn.execute(
+                        f"ALTER TABLE actions ADD COLUMN {name} {type_}"
+                    )
+            if "finished_at" not in existing:
+                # best guess for actions finished before it was recorded
+                self._conn.execute(
+                    "UPDATE actions SET finished_at = execute_at "
+                    f"WHERE {TERMINAL_SQL}"
+                )
+            if "target_message_id" not in existing:
+                self._conn.execute(
+                    "UPDATE actions SET target_message_id = "
+                    "json_extract(doc, '$.target_message_id')"
+                )
+                now = utcnow()
+                self._conn.execute(
+                    CLOSE_DUPLICATES,
+                    {"now": now.timestamp(), "now_iso": now.isoformat()},
+                )
+            self._conn.executescript(INDEXES)
+
+    async def close(self) -> None:
+        self._conn.close()
+
+    async def warm_up(self) -> None:
+        # the connection is opened eagerly, this pulls the pages in
+        self._conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+    def _fetch(self, sql: str, *params: Any) -> ActionData | None:
+        row = self._conn.execute(sql, params).fetchone()
+        return _load(row[0]) if row else None
+
+    def _save(self, action: ActionData) -> None:
+        assignments = ", ".join(f"{x} = :{x}" for x in _COLUMNS[1:])
+        self._conn.execute(
+            f"UPDATE actions SET {assignments} WHERE action_id = :action_id",
+            _row(action),
+        )
+
+    def _insert(self, action: ActionData) -> None:
+        columns = ", ".join(_COLUMNS)
+        values = ", ".join(f":{x}" for x in _COLUMNS)
+        self._conn.execute(
+            f"INSERT INTO actions ({columns}) VALUES ({values})",
+            _row(action),
+        )
+
+    async def store_action(self, action: ActionData) -> None:
+        with self._conn:
+            self._insert(action)
+
+    def _fetch_active_target(self, action: ActionData) -> ActionData | None:
+        return self._fetch(
+            "SELECT doc FROM actions WHERE chat_id = ? "
+            "AND target_message_id = ? AND action_type = ? "
+            f"AND {ACTIVE_SQL}",
+            action.chat_id,
+            action.target_message_id,
+            action.action_type.value,
+        )
+
+    async def store_or_attach(self, action: ActionData) -> ActionData:
+        with self._conn:
+            existing = self._fetch_active_target(action)
+            if existing is None:
+                try:
+                    self._insert(action)
+                    return action
+                except sqlite3.IntegrityError:
+                    # another process sharing the file stored the same
+                    # target since the lookup, the unique index caught it
+                    existing = self._fetch_active_target(action)
+                    if existing is None:
+                        raise
+            trigger = action.trigger_message_id
+            if trigger not in existing.duplicate_trigger_ids:
+                existing.duplicate_trigger_ids.append(trigger)
+                self._save(existing)
+            return existing
+
+    async def store_poll(self, action: ActionData, poll: PollData) -> None:
+        with self._conn:
+            stored = self._fetch(
+                "SELECT doc FROM actions WHERE action_id = ?", action.action_id
+            )
+            if stored is not None:
+                stored.poll = poll
+                self._save(stored)
+
+    async def change_step(self, action_id: str, step: PipelineStep) -> None:
+        with self._conn:
+            stored = self._fetch(
+                "SELECT doc FROM actions WHERE action_id = ?", action_id
+            )
+            if stored is not None:
+                stored.step = step
+                self._save(stored)
+
+    async def transition(
+        self,
+        action_id: str,
+        from_step: PipelineStep,
+        to_step: PipelineStep,
+        extra_fields: dict[str, Any] | None = None,
+    ) -> ActionData | None:
+        with self._conn:
+            stored = self._fetch(
+                "SELECT doc FROM actions WHERE action_id = ? AND step = ?",
+                action_id,
+                from_step.value,
+            )
+            if stored is None:
+                return None
+            apply_fields(stored, {**(extra_fields or {}), "step": to_step})
+            self._save(stored)
+            return stored
+
+    async def claim(
+        self, action_id: str, owner: str, lease_until: datetime
+    ) -> ActionData | None:
+        with self._conn:
+            stored = self._fetch(
+                "SELECT doc FROM actions WHERE action_id = ?", action_id
+            )
+            if stored is None or not can_claim(stored, owner, utcnow()):
+                return None
+            stored.owner, stored.lease_until = owner, as_utc(lease_until)
+            self._save(stored)
+            return stored
+
+    async def claim_ready(
+        self,
+        owner: str,
+        lease_until: datetime,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionRef]:
+        with self._conn:
+            rows = self._conn.execute(
+                CLAIM_READY,
+                {
+                    "owner": owner,
+                    "lease_until": as_utc(lease_until).timestamp(),
+                    "lease_iso": as_utc(lease_until).isoformat(),
+                    "now": utcnow().timestamp(),
+                    "limit": limit,
+                },
+            ).fetchall()
+        # RETURNING comes in no particular order
+        return [
+            ActionRef(action_id=action_id, chat_id=chat_id)
+            for _, action_id, chat_id in sorted(rows)
+        ]
+
+    def _update_leases(
+        self, sql: str, owner: str, action_ids: list[str], *params: Any
+    ) -> None:
+        if not action_ids:
+            return
+        with self._conn:
+            self._conn.execute(
+                sql.format(", ".join("?" * len(action_ids))),
+                (*params, owner, *action_ids),
+            )
+
+    async def renew_leases(
+        self, owner: str, action_ids: list[str], lease_until: datetime
+    ) -> None:
+        lease_until = as_utc(lease_until)
+        self._update_leases(
+            RENEW_LEASES,
+            owner,
+            action_ids,
+            lease_until.timestamp(),
+            lease_until.isoformat(),
+        )
+
+    async def release_leases(self, owner: str, action_ids: list[str]) -> None:
+        self._update_leases(RELEASE_LEASES, owner, action_ids)
+
+    def _update(self, action_id: str, update: Any) -> None:
+        with self._conn:
+            stored = self._fetch(
+                "SELECT doc FROM actions WHERE action_id = ?", action_id
+            )
+            if stored is not None:
+                update(stored)
+                self._save(stored)
+
+    async def add_intent(self, action_id: str, intent: IntentData) -> None:
+        self._update(action_id, lambda x: x.intents.append(intent))
+
+    async def complete_intent(
+        self, action_id: str, key: str, result: dict[str, Any]
+    ) -> None:
+        self._update(action_id, lambda x: complete_intent(x, key, result))
+
+    async def drop_intent(self, action_id: str, key: str) -> None:
+        self._update(action_id, lambda x: drop_intent(x, key))
+
+    async def fetch_open_intents(self) -> list[tuple[str, IntentData]]:
+        now = utcnow().timestamp()
+        rows = self._conn.execute(
+            f"SELECT action_id, doc FROM actions WHERE {ACTIVE_SQL} "
+            "AND (lease_until IS NULL OR lease_until <= ?) "
+            "AND json_array_length(doc, '$.intents') > 0",
+            (now,),
+        ).fetchall()
+        return [
+            (action_id, intent)
+            for action_id, doc in rows
+            for intent in open_intents(_load(doc))
+        ]
+
+    def _store_vote(self, action_id: str, vote_data: VoteData) -> None:
+        stored = self._fetch(
+            "SELECT doc FROM actions WHERE action_id = ?", action_id
+        )
+        if stored is not None and stored.poll is not None:
+            apply_vote(stored.poll, vote_data)
+            self._save(stored)
+
+    async def store_vote(self, action_id: str, vote_data: VoteData) -> None:
+        with self._conn:
+            self._store_vote(action_id, vote_data)
+
+    async def store_votes(self, votes: list[tuple[str, VoteData]]) -> None:
+        with self._conn:
+            for action_id, vote_data in votes:
+                self._store_vote(action_id, vote_data)
+
+    async def fetch_action_by_id(self, action_id: str) -> ActionData | None:
+        return self._fetch(
+            "SELECT doc FROM actions WHERE action_id = ?", action_id
+        )
+
+    async def fetch_action_by_poll_id(self, poll_id: str) -> ActionData | None:
+        return self._fetch(
+            "SELECT doc FROM actions WHERE poll_id = ?", poll_id
+        )
+
+    async def fetch_poll_ref(self, poll_id: str) -> PollRef | None:
+        row = self._conn.execute(
+            "SELECT action_id, step FROM actions WHERE poll_id = ?",
+            (poll_id,),
+        ).fetchone()
+        if row:
+            return PollRef(action_id=row[0], step=PipelineStep(row[1]))
+        return None
+
+    async def fetch_lease_ref(self, action_id: str) -> LeaseRef | None:
+        row = self._conn.execute(
+            "SELECT chat_id, step, owner, lease_until FROM actions "
+            "WHERE action_id = ?",
+            (action_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        chat_id, step, owner, lease_until = row
+        return LeaseRef(
+            action_id=action_id,
+            chat_id=chat_id,
+            step=PipelineStep(step),
+            owner=owner,
+            lease_until=(
+                datetime.fromtimestamp(lease_until, tz=UTC)
+                if lease_until is not None
+                else None
+            ),
+        )
+
+    async def iter_ready_actions(
+        self,
+        type: ActionType | None = None,
+        *,
+        batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+        limit: int | None = None,
+        with_votes: bool = True,
+    ) -> AsyncIterator[ActionData]:
+        # keyset pagination, no cursor is held open between batches
+        sql = (
+            "SELECT execute_at, action_id, doc FROM actions "
+            f"WHERE {ACTIVE_SQL} AND execute_at <= ? "
+            "AND (execute_at, action_id) > (?, ?)"
+        )
+        params: list[Any] = [utcnow().timestamp()]
+        if type is not None:
+            sql += " AND action_type = ?"
+        sql += " ORDER BY execute_at, action_id LIMIT ?"
+        last: tuple[float, str] = (float("-inf"), "")
+        remaining = limit or float("inf")
+        while remaining > 0:
+            size = int(min(batch_size, remaining))
+            rows = self._conn.execute(
+                sql,
+                [*params, *last, *([type.value] if type else []), size],
+            ).fetchall()
+            for execute_at, action_id, doc in rows:
+                action = _load(doc)
+                if not with_votes and action.poll is not None:
+                    action.poll.votes = []
+                yield action
+                last = (execute_at, action_id)
+            remaining -= len(rows)
+            if len(rows) < size:
+                break
+
+    async def fetch_ready_actions(
+        self, type: ActionType | None = None
+    ) -> list[ActionData]:
+        return [action async for action in self.iter_ready_actions(type)]
+
+    async def fetch_scheduled_actions(self) -> list[tuple[str, datetime]]:
+        rows = self._conn.execute(
+            f"SELECT action_id, execute_at FROM actions WHERE {ACTIVE_SQL}"
+        ).fetchall()
+        return [
+            (action_id, datetime.fromtimestamp(execute_at, tz=UTC))
+            for action_id, execute_at in rows
+        ]
+
+    async def count_actions(self) -> int:
+        return self._conn.execute("SELECT count(*) FROM actions").fetchone()[0]
+
+    async def archive_finished(
+        self, finished_before: datetime, limit: int = ARCHIVE_BATCH_SIZE
+    ) -> int:
+        with self._conn:
+            rows = self._conn.execute(
+                "SELECT action_id, chat_id, doc FROM actions "
+                f"WHERE finished_at <= ? AND {TERMINAL_SQL} "
+                "ORDER BY finished_at LIMIT ?",
+                (as_utc(finished_before).timestamp(), limit),
+            ).fetchall()
+            now = utcnow().timestamp()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO actions_archive "
+                "(action_id, chat_id, start_at, archived_at, doc) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        action_id,
+                        chat_id,
+                        as_utc(_load(doc).start_at).timestamp(),
+                        now,
+                        doc,
+                    )
+                    for action_id, chat_id, doc in rows
+                ],
+            )
+            self._conn.executemany(
+                "DELETE FROM actions WHERE action_id = ?",
+                [(action_id,) for action_id, _, _ in rows],
+            )
+        return len(rows)
+
+    async def purge_archive(self, archived_before: datetime) -> int:
+        with self._conn:
+            return self._conn.execute(
+                "DELETE FROM actions_archive WHERE archived_at <= ?",
+                (as_utc(archived_before).timestamp(),),
+            ).rowcount
+
+    async def fetch_archived_actions(
+        self,
+        chat_id: int,
+        since: datetime | None = None,
+        limit: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> list[ActionData]:
+        rows = self._conn.execute(
+            "SELECT doc FROM actions_archive "
+            "WHERE chat_id = ? AND start_at >= ? "
+            "ORDER BY start_at DESC LIMIT ?",
+            (
+                chat_id,
+                as_utc(since).timestamp() if since else float("-inf"),
+                limit,
+            ),
+        ).fetchall()
+        return [_load(doc) for (doc,) in rows]
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+from pinhead.data import VoteData
+from pinhead.store.base import ActionStore
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Write-behind buffer for poll answers.
+
+    Answers are coalesced per action and user, the last one wins, and
+    written in a single batch on flush. A zero window disables
+    buffering, votes are then stored one by one as they come.
+    """
+
+    def __init__(self, window: float, max_votes: int):
+        self.window = window
+        self.max_votes = max_votes
+        self._pending: dict[str, dict[int, VoteData]] = {}
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._scheduled = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, action_id: str, vote_data: VoteData) -> bool:
+        """Buffer the vote, returns True when the buffer is full."""
+        votes = self._pending.setdefault(action_id, {})
+        if vote_data.user_id not in votes:
+            self._size += 1
+        votes[vote_data.user_id] = vote_data
+        return self._size >= self.max_votes
+
+    def schedule(self) -> bool:
+        """Mark a flush as scheduled, returns False if one already is."""
+        if self._scheduled:
+            return False
+        self._scheduled = True
+        return True
+
+    async def flush(self, store: ActionStore) -> list[str]:
+        """Store buffered votes, returns ids of the actions they belong to."""
+        async with self._lock:
+            # votes coming in during the write need a flush of their own
+            self._scheduled = False
+            pending, self._pending, self._size = self._pending, {}, 0
+            if not pending:
+                return []
+            try:
+                await store.store_votes(
+                    [
+                        (action_id, vote_data)
+                        for action_id, votes in pending.items()
+                        for vote_data in votes.values()
+                    ],
+                )
+            except Exception:
+                self._restore(pending)
+                raise
+            logger.info(f"Flushed votes of {len(pending)} actions")
+            return list(pending)
+
+    def _restore(self, pending: dict[str, dict[int, VoteData]]) -> None:
+        # put back what failed to be written, votes added since win
+        for action_id, votes in pending.items():
+            current = self._pending.setdefault(action_id, {})
+            for user_id, vote_data in votes.items():
+                if user_id not in current:
+                    current[user_id] = vote_data
+                    self._size += 1
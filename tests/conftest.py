@@ -2,17 +2,55 @@ import os
 
 import pytest
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 
 from pinhead.config import create_config
+from pinhead.store import (
+    MemoryActionStore,
+    MongoActionStore,
+    SqliteActionStore,
+)
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self) -> None:
+        self.commands: list[dict] = []
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        self.commands.append(dict(event.command))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        pass
 
 
 @pytest.fixture
 async def db():
     cfg = create_config(os.environ)
-    client = AsyncIOMotorClient(cfg.mongo_uri)
+    client = AsyncIOMotorClient(cfg.mongo_uri, tz_aware=True)
     db = client[cfg.mongo_db_name]
     yield db
     await db.drop_collection("actions")
+    await db.drop_collection("actions_archive")
+
+
+@pytest.fixture
+def command_recorder() -> CommandRecorder:
+    return CommandRecorder()
+
+
+@pytest.fixture
+async def recorded_db(command_recorder: CommandRecorder):
+    cfg = create_config(os.environ)
+    client = AsyncIOMotorClient(
+        cfg.mongo_uri, tz_aware=True, event_listeners=[command_recorder]
+    )
+    db = client[cfg.mongo_db_name]
+    yield db
+    await db.drop_collection("actions")
+    await db.drop_collection("actions_archive")
 
 
 @pytest.fixture
@@ -20,3 +58,23 @@ async def setup_db(db):
     db_collections = await db.list_collection_names()
     for collection in db_collections:
         await db.drop_collection(collection)
+
+
+@pytest.fixture(params=["memory", "sqlite", "mongo"])
+async def store(request, tmp_path):
+    match request.param:
+        case "memory":
+            store = MemoryActionStore()
+        case "sqlite":
+            store = SqliteActionStore(str(tmp_path / "pinhead.sqlite3"))
+        case "mongo":
+            if "MONGO_URI" not in os.environ:
+                pytest.skip("MONGO_URI is not set")
+            cfg = create_config(os.environ)
+            client = AsyncIOMotorClient(cfg.mongo_uri, tz_aware=True)
+            store = MongoActionStore(client[cfg.mongo_db_name])
+            await store.db.drop_collection("actions")
+            await store.db.drop_collection("actions_archive")
+    await store.ensure_indexes()
+    yield store
+    await store.close()
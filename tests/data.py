@@ -14,16 +14,22 @@ from pinhead.helpers import generate_random_str
 TEST_USER_ID = 313
 
 
+def utcnow_ms() -> datetime:
+    # BSON dates keep milliseconds only
+    now = datetime.now(tz=UTC)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
 def generate_action_data(
     action_type: ActionType | None = None,
     execute_at: datetime | None = None,
     step=PipelineStep.START,
 ) -> ActionData:
-    now = datetime.now(tz=UTC)
+    now = utcnow_ms()
     return ActionData(
         action_id=generate_random_str(),
         chat_id=CHAT_ID,
-        target_message_id="321",
+        target_message_id=generate_random_str(),
         trigger_message_id="322",
         target_user_id="333",
         action_type=action_type or ActionType.PIN,
@@ -52,5 +58,5 @@ def generate_vote_data(user_id: int | None = TEST_USER_ID) -> VoteData:
         user_id=user_id,
         user_name="@AlexDarkStalker",
         answer=[0],
-        voted_at=datetime.now(tz=UTC),
+        voted_at=utcnow_ms(),
     )
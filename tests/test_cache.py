@@ -0,0 +1,31 @@
+from pinhead.cache import LRUCache
+
+
+def test_evicts_least_recently_used() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_expired_entries_are_dropped() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_pop() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
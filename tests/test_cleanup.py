@@ -0,0 +1,61 @@
+import telegram
+
+from pinhead.cleanup import CleanupQueue, flush_cleanup_queue
+from pinhead.dispatcher import TelegramDispatcher
+
+
+class DeleteBot:
+    def __init__(self) -> None:
+        self.deleted: list[tuple[int, str]] = []
+        self.bulk_deleted: list[tuple[int, list[str]]] = []
+
+    async def delete_message(self, chat_id: int, message_id: str) -> None:
+        if message_id == "gone":
+            raise telegram.error.BadRequest("Message to delete not found")
+        self.deleted.append((chat_id, message_id))
+
+    async def delete_messages(self, chat_id: int, message_ids) -> None:
+        if "gone" in message_ids:
+            raise telegram.error.BadRequest("Message to delete not found")
+        self.bulk_deleted.append((chat_id, list(message_ids)))
+
+
+def test_cleanup_queue() -> None:
+    queue = CleanupQueue()
+
+    assert queue.add(1, "10", "11")
+    assert not queue.add(2, "20")
+    assert len(queue) == 3
+    assert queue.drain() == {1: ["10", "11"], 2: ["20"]}
+    assert len(queue) == 0
+
+
+async def test_flush_in_batches() -> None:
+    bot = DeleteBot()
+    dispatcher = TelegramDispatcher()
+    queue = CleanupQueue()
+    queue.add(1, *(str(x) for x in range(150)))
+    queue.add(2, "1", "1")
+
+    await flush_cleanup_queue(bot, dispatcher, queue)  # type: ignore
+
+    assert sorted((chat, len(ids)) for chat, ids in bot.bulk_deleted) == [
+        (1, 50),
+        (1, 100),
+        (2, 1),
+    ]
+    assert bot.deleted == []
+    await dispatcher.close()
+
+
+async def test_flush_falls_back_to_single_deletes() -> None:
+    bot = DeleteBot()
+    dispatcher = TelegramDispatcher()
+    queue = CleanupQueue()
+    queue.add(1, "10", "gone", "11")
+
+    await flush_cleanup_queue(bot, dispatcher, queue)  # type: ignore
+
+    assert bot.bulk_deleted == []
+    assert bot.deleted == [(1, "10"), (1, "11")]
+    await dispatcher.close()
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import marshmallow_recipe as mr
+import pytest
+
+from pinhead.codecs import ACTION_CODEC, ACTION_JSON_CODEC, VOTE_CODEC
+from pinhead.data import (
+    ActionData,
+    ActionType,
+    PipelineStep,
+    TargetData,
+)
+from tests.data import (
+    generate_action_data,
+    generate_poll_data,
+    generate_vote_data,
+)
+
+
+def _actions() -> list[ActionData]:
+    plain = generate_action_data()
+    with_poll = generate_action_data(
+        action_type=ActionType.BAN, step=PipelineStep.CONSENSUS
+    )
+    with_poll.poll = generate_poll_data()
+    with_poll.poll.votes = [generate_vote_data(user_id=x) for x in (1, 2)]
+    with_poll.poll.counts = [2, 0]
+    with_poll.poll.win_result = True
+    with_poll.executed_at = with_poll.start_at + timedelta(seconds=1)
+    with_poll.target_user_id = None
+    naive = generate_action_data()
+    naive.start_at = datetime(2024, 1, 1, 12, 30)
+    raid = generate_action_data(action_type=ActionType.PURGE)
+    raid.targets = [
+        TargetData(user_id="333", message_id="321"),
+        TargetData(user_id="334"),
+    ]
+    return [plain, with_poll, naive, raid]
+
+
+@pytest.mark.parametrize("action", _actions())
+def test_json_codec_matches_mr(action: ActionData) -> None:
+    doc = ACTION_JSON_CODEC.dump(action)
+
+    assert doc == mr.dump(action)
+    assert ACTION_JSON_CODEC.load(doc) == mr.load(ActionData, doc)
+
+
+@pytest.mark.parametrize("action", _actions())
+def test_bson_codec_round_trip(action: ActionData) -> None:
+    doc = ACTION_CODEC.dump(action)
+
+    assert isinstance(doc["start_at"], datetime)
+    assert doc["start_at"].tzinfo is not None
+    assert ACTION_CODEC.load(doc) == mr.load(ActionData, mr.dump(action))
+
+
+def test_load_skips_unknown_fields() -> None:
+    vote = generate_vote_data()
+    doc = {**VOTE_CODEC.dump(vote), "_id": "ignored"}
+
+    assert VOTE_CODEC.load(doc) == vote
+
+
+def test_load_accepts_iso_strings() -> None:
+    action = generate_action_data()
+
+    assert ACTION_CODEC.load(mr.dump(action)) == action
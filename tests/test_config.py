@@ -0,0 +1,74 @@
+import pytest
+
+from pinhead.config import (
+    Overflow,
+    PerformanceProfile,
+    create_config,
+    create_performance_profile,
+)
+
+
+def test_defaults() -> None:
+    cfg = create_config({})
+
+    assert cfg.performance == PerformanceProfile()
+
+
+def test_env_overrides_file(tmp_path) -> None:
+    path = tmp_path / "perf.toml"
+    path.write_text(
+        "mongo_max_pool_size = 50\n"
+        "scan_batch_size = 500\n"
+        'mongo_write_concern = "majority"\n'
+    )
+
+    profile = create_performance_profile(
+        {"PERF_PROFILE": str(path), "SCAN_BATCH_SIZE": "200"}
+    )
+
+    assert profile.mongo_max_pool_size == 50
+    assert profile.scan_batch_size == 200
+    assert profile.mongo_write_concern == "majority"
+
+
+@pytest.mark.parametrize(
+    "env",
+    (
+        {"PIPELINE_CONCURRENCY": "0"},
+        {"TG_POOL_TIMEOUT": "-1"},
+        {"POLL_CACHE_SIZE": "many"},
+        {"MONGO_WRITE_CONCERN": "all"},
+        {"MONGO_MIN_POOL_SIZE": "20", "MONGO_MAX_POOL_SIZE": "10"},
+    ),
+)
+def test_invalid_values(env: dict[str, str]) -> None:
+    with pytest.raises(ValueError):
+        create_performance_profile(env)
+
+
+def test_unknown_file_setting(tmp_path) -> None:
+    path = tmp_path / "perf.toml"
+    path.write_text("wakeup_period = 60\n")
+
+    with pytest.raises(ValueError, match="wakeup_period"):
+        create_performance_profile({"PERF_PROFILE": str(path)})
+
+
+@pytest.mark.parametrize(
+    "env",
+    (
+        {"INGEST_WORKERS": "0"},
+        {"INGEST_QUEUE_SIZE": "0"},
+        {"INGEST_DEDUP_WINDOW": "-1"},
+        {"INGEST_OVERFLOW": "drop_everything"},
+    ),
+)
+def test_invalid_ingest_settings(env: dict[str, str]) -> None:
+    with pytest.raises(ValueError):
+        create_config(env)
+
+
+def test_ingest_overflow() -> None:
+    cfg = create_config({"INGEST_OVERFLOW": "drop_oldest"})
+
+    assert cfg.ingest_overflow == Overflow.DROP_OLDEST
@@ -1,4 +1,6 @@
+import asyncio
 import datetime
+from typing import Any
 
 import marshmallow_recipe as mr
 import pytest
@@ -6,22 +8,40 @@ from more_itertools import one
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo.results import InsertOneResult
 
-from pinhead.data import ActionData, PipelineStep
+from pinhead.data import PipelineStep, PollRef
 from pinhead.db import (
+    archive_finished,
+    change_step,
+    ensure_indexes,
     fetch_action_by_id,
     fetch_action_by_poll_id,
+    fetch_archived_actions,
+    fetch_poll_ref,
     fetch_ready_actions,
+    fetch_scheduled_actions,
+    iter_ready_actions,
+    load_action,
     store_action,
+    store_or_attach,
     store_poll,
     store_vote,
+    store_votes,
+    transition,
 )
+from pinhead.migrations import (
+    close_duplicate_actions,
+    migrate_datetimes,
+    migrate_finished_at,
+)
+from tests.conftest import CommandRecorder
 from tests.data import (
     generate_action_data,
     generate_poll_data,
     generate_vote_data,
+    utcnow_ms,
 )
 
-NOW = datetime.datetime.now(tz=datetime.UTC)
+NOW = utcnow_ms()
 
 
 async def test_store_action(db: AsyncIOMotorDatabase) -> None:
@@ -34,7 +54,7 @@ async def test_store_action(db: AsyncIOMotorDatabase) -> None:
         result.inserted_id
     )  # type: ignore
     assert raw_inserted
-    inserted = mr.load(ActionData, raw_inserted)
+    inserted = load_action(raw_inserted)
     assert inserted.action_id == action_data.action_id
     assert inserted.chat_id == action_data.chat_id
     assert inserted.target_message_id == action_data.target_message_id
@@ -136,6 +156,35 @@ async def test_fetch_ready_action_list(
     }
 
 
+async def test_iter_ready_actions(
+    db: AsyncIOMotorDatabase, prepared_actions
+) -> None:
+    ready = [action async for action in iter_ready_actions(db, limit=2)]
+
+    assert [x.step for x in ready] == [
+        PipelineStep.EXECUTE,
+        PipelineStep.CONSENSUS,
+    ]
+
+
+async def test_iter_ready_actions_without_votes(
+    db: AsyncIOMotorDatabase,
+) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    poll_data = generate_poll_data()
+    await store_action(db, action)
+    await store_poll(db, action_data=action, poll_data=poll_data)
+    await store_vote(db, action.action_id, generate_vote_data())
+
+    ready = [
+        action async for action in iter_ready_actions(db, with_votes=False)
+    ]
+
+    assert len(ready) == 1
+    assert ready[0].poll and ready[0].poll.id == poll_data.id
+    assert ready[0].poll.votes == []
+
+
 async def test_store_poll(db: AsyncIOMotorDatabase) -> None:
     action = generate_action_data(execute_at=NOW, step=PipelineStep.START)
     await store_action(db, action)
@@ -164,6 +213,11 @@ async def test_fetch_action_by_poll_id(db: AsyncIOMotorDatabase) -> None:
     assert result and result.poll
     assert result.poll == poll_data
 
+    poll_ref = await fetch_poll_ref(db, poll_data.id)
+    assert poll_ref == PollRef(
+        action_id=action.action_id, step=PipelineStep.START
+    )
+
 
 async def test_store_vote(db: AsyncIOMotorDatabase) -> None:
     action = generate_action_data(execute_at=NOW, step=PipelineStep.START)
@@ -184,6 +238,7 @@ async def test_store_vote(db: AsyncIOMotorDatabase) -> None:
     assert result and result.poll
     assert len(result.poll.votes) == 2
     assert result.poll.votes == [vote1, vote2]
+    assert result.poll.counts == [2, 0]
 
 
 async def test_store_vote_duplicate(db: AsyncIOMotorDatabase) -> None:
@@ -204,3 +259,200 @@ async def test_store_vote_duplicate(db: AsyncIOMotorDatabase) -> None:
     assert result and result.poll
     assert len(result.poll.votes) == 1
     assert result.poll.votes == [vote]
+    assert result.poll.counts == [1, 0]
+
+
+async def test_store_vote_changed_and_retracted(
+    db: AsyncIOMotorDatabase,
+) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    poll_data = generate_poll_data()
+    await store_action(db, action)
+    await store_poll(db, action_data=action, poll_data=poll_data)
+
+    vote = generate_vote_data()
+    await store_vote(db, action.action_id, vote)
+    vote.answer = [1]
+    await store_vote(db, action.action_id, vote)
+
+    result = await fetch_action_by_id(db, action.action_id)
+    assert result and result.poll
+    assert result.poll.votes == [vote]
+    assert result.poll.counts == [0, 1]
+
+    vote.answer = []
+    await store_vote(db, action.action_id, vote)
+
+    result = await fetch_action_by_id(db, action.action_id)
+    assert result and result.poll
+    assert result.poll.votes == []
+    assert result.poll.counts == [0, 0]
+
+
+EXPLAINABLE_COMMANDS = {"find", "update", "findAndModify", "delete", "count"}
+
+
+def _plan_stages(plan: dict) -> set[str]:
+    stages = {plan["stage"]} if "stage" in plan else set()
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages |= _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages |= _plan_stages(child)
+    return stages
+
+
+async def test_queries_use_indexes(
+    recorded_db: AsyncIOMotorDatabase, command_recorder: CommandRecorder
+) -> None:
+    db = recorded_db
+    await ensure_indexes(db)
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.START)
+    poll_data = generate_poll_data()
+    await store_action(db, action)
+    command_recorder.commands.clear()
+
+    await store_poll(db, action_data=action, poll_data=poll_data)
+    await store_vote(db, action.action_id, generate_vote_data())
+    await change_step(db, action_id=action.action_id, step=PipelineStep.POLL)
+    await transition(
+        db,
+        action_id=action.action_id,
+        from_step=PipelineStep.POLL,
+        to_step=PipelineStep.CONSENSUS,
+        extra_fields={"poll.win_result": True},
+    )
+    await fetch_action_by_id(db, action.action_id)
+    await fetch_action_by_poll_id(db, poll_data.id)
+    await fetch_poll_ref(db, poll_data.id)
+    await fetch_ready_actions(db)
+    await fetch_scheduled_actions(db)
+    await archive_finished(db, NOW)
+    await fetch_archived_actions(db, action.chat_id)
+
+    commands = [
+        {k: v for k, v in cmd.items() if not k.startswith("$")}
+        for cmd in command_recorder.commands
+        if EXPLAINABLE_COMMANDS & cmd.keys()
+    ]
+    assert len(commands) == 11
+    for command in commands:
+        command.pop("lsid", None)
+        explain: dict[str, Any] = await db.command("explain", command)
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        assert "COLLSCAN" not in stages, command
+
+
+async def test_migrate_datetimes(db: AsyncIOMotorDatabase) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    action.poll = generate_poll_data()
+    action.poll.votes = [generate_vote_data()]
+    legacy = mr.dump(action)  # ISO strings, the way it used to be stored
+    await db.actions.insert_one(legacy)
+
+    assert await migrate_datetimes(db) == 1
+    assert await migrate_datetimes(db) == 0
+
+    raw = await db.actions.find_one(
+        {"action_id": action.action_id}
+    )  # type: ignore
+    assert raw and isinstance(raw["execute_at"], datetime.datetime)
+    assert isinstance(raw["poll"]["votes"][0]["voted_at"], datetime.datetime)
+    assert load_action(raw) == action
+    assert [x.action_id for x in await fetch_ready_actions(db)] == [
+        action.action_id
+    ]
+
+
+async def test_transition(db: AsyncIOMotorDatabase) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.START)
+    poll_data = generate_poll_data()
+    await store_action(db, action)
+
+    updated = await transition(
+        db,
+        action_id=action.action_id,
+        from_step=PipelineStep.START,
+        to_step=PipelineStep.POLL,
+        extra_fields={"poll": poll_data},
+    )
+    assert updated and updated.step == PipelineStep.POLL
+    assert updated.poll == poll_data
+
+    repeated = await transition(
+        db,
+        action_id=action.action_id,
+        from_step=PipelineStep.START,
+        to_step=PipelineStep.POLL,
+        extra_fields={"poll": generate_poll_data()},
+    )
+    assert repeated is None
+
+
+async def test_store_votes(db: AsyncIOMotorDatabase) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    poll_data = generate_poll_data()
+    await store_action(db, action)
+    await store_poll(db, action_data=action, poll_data=poll_data)
+
+    votes = [generate_vote_data(user_id=x) for x in (1, 2, 3)]
+    await store_votes(db, [(action.action_id, vote) for vote in votes])
+
+    result = await fetch_action_by_id(db, action.action_id)
+    assert result and result.poll
+    assert result.poll.votes == votes
+    assert result.poll.counts == [3, 0]
+
+
+async def test_migrate_finished_at(db: AsyncIOMotorDatabase) -> None:
+    done = generate_action_data(execute_at=NOW, step=PipelineStep.DONE)
+    active = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    await store_action(db, done)
+    await store_action(db, active)
+
+    assert await migrate_finished_at(db) == 1
+    assert await migrate_finished_at(db) == 0
+
+    migrated = await fetch_action_by_id(db, done.action_id)
+    assert migrated and migrated.finished_at == NOW
+    untouched = await fetch_action_by_id(db, active.action_id)
+    assert untouched and untouched.finished_at is None
+
+
+async def test_close_duplicate_actions(db: AsyncIOMotorDatabase) -> None:
+    first = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    second = generate_action_data(execute_at=NOW, step=PipelineStep.START)
+    second.target_message_id = first.target_message_id
+    second.start_at = first.start_at + datetime.timedelta(seconds=1)
+    other = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    await store_action(db, first)
+    await store_action(db, second)
+    await store_action(db, other)
+
+    assert await close_duplicate_actions(db) == 1
+    assert await close_duplicate_actions(db) == 0
+
+    closed = await fetch_action_by_id(db, second.action_id)
+    assert closed and closed.step == PipelineStep.ERROR
+    await ensure_indexes(db)
+
+
+async def test_store_or_attach_across_nodes(db: AsyncIOMotorDatabase) -> None:
+    await ensure_indexes(db)
+    action = generate_action_data(execute_at=NOW)
+    duplicates = []
+    for trigger in ("1", "2"):
+        duplicate = generate_action_data(execute_at=NOW)
+        duplicate.target_message_id = action.target_message_id
+        duplicate.trigger_message_id = trigger
+        duplicates.append(duplicate)
+    await store_or_attach(db, action)
+
+    # the index refuses the insert, the trigger lands on the first one
+    results = await asyncio.gather(
+        *(store_or_attach(db, x) for x in duplicates)
+    )
+
+    assert {x.action_id for x in results} == {action.action_id}
+    stored = await fetch_action_by_id(db, action.action_id)
+    assert stored and sorted(stored.duplicate_trigger_ids) == ["1", "2"]
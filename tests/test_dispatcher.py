@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+import telegram
+
+from pinhead.dispatcher import Priority, TelegramDispatcher, TokenBucket
+from pinhead.metrics import TELEGRAM_QUEUE_DEPTH
+
+
+def test_token_bucket() -> None:
+    bucket = TokenBucket(rate=1, burst=2)
+    now = 100.0
+    bucket._updated = now
+
+    bucket.take(now)
+    bucket.take(now)
+
+    assert bucket.delay(now) == 1
+    assert bucket.delay(now + 1) == 0
+
+    bucket.pause(now + 1, 5)
+    assert bucket.delay(now + 1) == 5
+
+
+async def test_calls_released_by_priority() -> None:
+    dispatcher = TelegramDispatcher()
+    called: list[str] = []
+
+    async def record(chat_id: int, name: str) -> str:
+        called.append(name)
+        return name
+
+    results = await asyncio.gather(
+        dispatcher.call(Priority.CLEANUP, record, 1, "cleanup"),
+        dispatcher.call(Priority.POLL, record, 1, "poll"),
+        dispatcher.call(Priority.MODERATION, record, 2, "ban"),
+    )
+
+    assert results == ["cleanup", "poll", "ban"]
+    assert called == ["ban", "poll", "cleanup"]
+    await dispatcher.close()
+
+
+async def test_exhausted_chat_does_not_block_others() -> None:
+    dispatcher = TelegramDispatcher(chat_rate=0.01, chat_burst=1)
+    called: list[int] = []
+
+    async def record(chat_id: int) -> None:
+        called.append(chat_id)
+
+    await dispatcher.call(Priority.MODERATION, record, 1)
+    blocked = asyncio.ensure_future(
+        dispatcher.call(Priority.MODERATION, record, 1)
+    )
+    await dispatcher.call(Priority.CLEANUP, record, 2)
+
+    assert called == [1, 2]
+    assert dispatcher.queue_depth(1) == 1
+    assert dispatcher.queue_depths() == {1: 1}
+    assert TELEGRAM_QUEUE_DEPTH.value("1") == 1
+    assert TELEGRAM_QUEUE_DEPTH.value("2") == 0
+    await dispatcher.close()
+    assert TELEGRAM_QUEUE_DEPTH.value("1") == 0
+    with pytest.raises(asyncio.CancelledError):
+        await blocked
+
+
+async def test_retry_after_requeues_call() -> None:
+    dispatcher = TelegramDispatcher()
+    attempts = 0
+
+    async def flaky(chat_id: int) -> str:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise telegram.error.RetryAfter(0)
+        return "ok"
+
+    assert await dispatcher.call(Priority.DELETE, flaky, 1) == "ok"
+    assert attempts == 2
+    await dispatcher.close()
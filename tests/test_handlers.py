@@ -0,0 +1,152 @@
+from datetime import UTC, datetime
+from types import SimpleNamespace
+from typing import Any
+
+from telegram import Chat, Message, MessageEntity, User
+
+from pinhead import pipeline
+from pinhead.cache import LRUCache
+from pinhead.constants import MAX_ACTION_TARGETS
+from pinhead.data import CHAT_ID, TargetData
+from pinhead.handlers import (
+    _collect_targets,
+    _extract_mentions,
+    flush_votes,
+    remember_author,
+)
+from pinhead.pipeline import execute_single_action
+from pinhead.votes import VoteBuffer
+from tests.data import generate_vote_data
+
+CHAT = Chat(id=CHAT_ID, type=Chat.SUPERGROUP)
+DATE = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def _user(user_id: int, username: str | None = None) -> User:
+    return User(id=user_id, first_name="user", is_bot=False, username=username)
+
+
+def _message(
+    message_id: int,
+    text: str,
+    user: User | None = None,
+    entities: list[MessageEntity] | None = None,
+    reply_to_message: Message | None = None,
+) -> Message:
+    return Message(
+        message_id=message_id,
+        date=DATE,
+        chat=CHAT,
+        from_user=user or _user(1),
+        text=text,
+        entities=entities,
+        reply_to_message=reply_to_message,
+    )
+
+
+def _authors() -> LRUCache[tuple[int, str], TargetData]:
+    return LRUCache(maxsize=10, ttl=60)
+
+
+def test_extract_mentions() -> None:
+    authors = _authors()
+    authors.set((CHAT_ID, "spammer"), TargetData(user_id="7", message_id="70"))
+    text = "/ban @Spammer @unknown Nameless"
+    message = _message(
+        1,
+        text,
+        entities=[
+            MessageEntity(MessageEntity.BOT_COMMAND, 0, 4),
+            MessageEntity(MessageEntity.MENTION, 5, 8),
+            MessageEntity(MessageEntity.MENTION, 14, 8),
+            MessageEntity(MessageEntity.TEXT_MENTION, 23, 8, user=_user(9)),
+        ],
+    )
+
+    assert _extract_mentions(message, authors) == [
+        TargetData(user_id="7", message_id="70"),
+        TargetData(user_id="9"),
+    ]
+
+
+def test_collect_targets_puts_the_reply_first() -> None:
+    reply = _message(5, "spam", user=_user(7))
+    mentions = [
+        TargetData(user_id="8"),
+        TargetData(user_id="7", message_id="70"),
+        TargetData(user_id="8", message_id="80"),
+    ]
+
+    assert _collect_targets(reply, mentions) == [
+        TargetData(user_id="7", message_id="5"),
+        TargetData(user_id="8"),
+    ]
+    assert _collect_targets(reply, []) == []
+
+
+def test_collect_targets_is_bounded() -> None:
+    mentions = [TargetData(user_id=str(x)) for x in range(100)]
+
+    assert len(_collect_targets(None, mentions)) == MAX_ACTION_TARGETS
+
+
+async def test_remember_author() -> None:
+    authors = _authors()
+    context = SimpleNamespace(
+        application=SimpleNamespace(recent_authors=authors)
+    )
+    for message in (
+        _message(1, "hi", user=_user(7, "Spammer")),
+        _message(2, "hi again", user=_user(7, "Spammer")),
+        _message(3, "no username", user=_user(8)),
+    ):
+        update = SimpleNamespace(effective_message=message)
+        await remember_author(update, context)  # type: ignore
+
+    assert len(authors) == 1
+    assert authors.get((CHAT_ID, "spammer")) == TargetData(
+        user_id="7", message_id="2"
+    )
+
+
+class RecordingJobQueue:
+    def __init__(self) -> None:
+        self.jobs: list[tuple[Any, Any]] = []
+
+    def run_once(self, callback, when, data=None) -> None:
+        self.jobs.append((callback, data))
+
+
+async def test_failed_vote_flush_is_retried() -> None:
+    class FlakyStore:
+        def __init__(self) -> None:
+            self.failures = 1
+            self.votes: list = []
+
+        async def store_votes(self, votes) -> None:
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("database is down")
+            self.votes += votes
+
+    store, job_queue = FlakyStore(), RecordingJobQueue()
+    buffer = VoteBuffer(window=0.01, max_votes=100)
+    context = SimpleNamespace(
+        application=SimpleNamespace(store=store, vote_buffer=buffer),
+        job_queue=job_queue,
+    )
+    buffer.add("a", generate_vote_data(user_id=1))
+    buffer.add("a", generate_vote_data(user_id=2))
+
+    await flush_votes(context)  # type: ignore
+
+    assert store.votes == []
+    assert job_queue.jobs == [(flush_votes, None)]
+    job_queue.jobs.clear()
+    try:
+        await flush_votes(context)  # type: ignore
+
+        assert len(store.votes) == 2
+        assert job_queue.jobs == [(execute_single_action, ("a", None))]
+    finally:
+        pipeline._pending.clear()
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+from pinhead.ingest import (
+    SECRET_HEADER,
+    Overflow,
+    RecentIds,
+    UpdateQueue,
+    WebhookIngest,
+    is_sheddable,
+)
+
+COMMAND = {
+    "update_id": 1,
+    "message": {"text": "/ban", "entities": [{"type": "bot_command"}]},
+}
+MESSAGE = {"update_id": 2, "message": {"text": "hello"}}
+POLL_ANSWER = {"update_id": 3, "poll_answer": {"poll_id": "1"}}
+
+
+def test_is_sheddable() -> None:
+    assert not is_sheddable(COMMAND)
+    assert not is_sheddable(POLL_ANSWER)
+    assert is_sheddable(MESSAGE)
+
+
+def test_recent_ids_window() -> None:
+    recent = RecentIds(size=2)
+
+    assert recent.add(1)
+    assert not recent.add(1)
+    assert recent.add(2)
+    assert recent.add(3)
+    assert recent.add(1)  # out of the window
+
+
+async def test_queue_sheds_non_commands_first() -> None:
+    queue = UpdateQueue(maxsize=2, overflow=Overflow.SHED)
+    assert queue.put(MESSAGE, sheddable=True)
+    assert queue.put(COMMAND, sheddable=False)
+
+    assert not queue.put({"update_id": 4}, sheddable=True)
+    assert not queue.put(POLL_ANSWER, sheddable=False)  # replaces MESSAGE
+    assert not queue.put(POLL_ANSWER, sheddable=False)  # nothing to shed
+
+    assert [await queue.get(), await queue.get()] == [COMMAND, POLL_ANSWER]
+    assert len(queue) == 0
+
+
+async def test_queue_drop_oldest() -> None:
+    queue = UpdateQueue(maxsize=1, overflow=Overflow.DROP_OLDEST)
+    queue.put(COMMAND, sheddable=False)
+    queue.put(MESSAGE, sheddable=True)
+
+    assert await queue.get() == MESSAGE
+
+
+def _request(data: dict, token: str = "secret") -> SimpleNamespace:
+    async def json() -> dict:
+        return data
+
+    return SimpleNamespace(headers={SECRET_HEADER: token}, json=json)
+
+
+async def test_webhook_acknowledges_and_deduplicates() -> None:
+    processed: list = []
+
+    async def process_update(update) -> None:
+        processed.append(update.update_id)
+
+    application = SimpleNamespace(bot=None, process_update=process_update)
+    ingest = WebhookIngest(
+        secret_token="secret",
+        queue=UpdateQueue(maxsize=10),
+        recent_ids=RecentIds(size=10),
+        workers=1,
+    )
+
+    first, second = {"update_id": 1}, {"update_id": 2}
+    forbidden = await ingest.handle(_request(first, "x"))  # type: ignore
+    assert forbidden.status == 403
+    for data in (first, first, second):
+        response = await ingest.handle(_request(data))  # type: ignore
+        assert response.status == 200
+    assert len(ingest.queue) == 2
+
+    ingest.start(application)  # type: ignore
+    await asyncio.sleep(0)
+    await ingest.close()
+    assert processed == [1, 2]
@@ -0,0 +1,43 @@
+from pinhead.metrics import Registry, timed
+
+
+def test_counter_render() -> None:
+    registry = Registry()
+    errors = registry.counter("errors_total", "Errors.", ["method"])
+    errors.inc("send_poll")
+    errors.inc("send_poll", amount=2)
+    errors.inc('say "hi"')
+
+    assert errors.value("send_poll") == 3
+    assert registry.render().splitlines() == [
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{method="say \\"hi\\""} 1',
+        'errors_total{method="send_poll"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    registry = Registry()
+    latency = registry.histogram("latency", "Latency.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_bucket{le="0.1"} 1',
+        'latency_bucket{le="1"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        "latency_sum 6.05",
+        "latency_count 4",
+    ]
+
+
+async def test_timed_labels_by_function_name() -> None:
+    latency = Registry().histogram("op", "Op.", ["operation"])
+
+    @timed(latency)
+    async def fetch_something() -> int:
+        return 1
+
+    assert await fetch_something() == 1
+    assert latency.count("fetch_something") == 1
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+import pytest
+import telegram
+
+from pinhead.clock import utcnow
+from pinhead.data import IntentData, PipelineStep
+from pinhead.outbox import intent_key, reconcile_intents, run_once
+from pinhead.store import ActionStore
+from tests.data import generate_action_data
+
+
+class Calls:
+    def __init__(self, error: Exception | None = None) -> None:
+        self.count = 0
+        self.error = error
+
+    async def __call__(self) -> int:
+        self.count += 1
+        if self.error is not None:
+            raise self.error
+        return 42
+
+
+async def test_run_once_skips_completed_calls(store: ActionStore) -> None:
+    action = generate_action_data(step=PipelineStep.START)
+    await store.store_action(action)
+    call = Calls()
+
+    result = await run_once(
+        store, action, "send_poll", call, lambda x: {"value": x}
+    )
+    assert result == {"value": 42}
+
+    # the step runs again, say the transition was lost in a crash
+    stored = await store.fetch_action_by_id(action.action_id)
+    assert stored
+    assert await run_once(store, stored, "send_poll", call) == result
+    assert call.count == 1
+    assert await store.fetch_open_intents() == []
+
+
+async def test_run_once_drops_refused_calls(store: ActionStore) -> None:
+    action = generate_action_data(step=PipelineStep.EXECUTE)
+    await store.store_action(action)
+    call = Calls(telegram.error.BadRequest("Message not found"))
+
+    with pytest.raises(telegram.error.BadRequest):
+        await run_once(store, action, "delete_message", call)
+
+    stored = await store.fetch_action_by_id(action.action_id)
+    assert stored and stored.intents == []
+
+
+async def test_reconcile_drops_open_intents(store: ActionStore) -> None:
+    await store.ensure_indexes()
+    dead, alive = (
+        generate_action_data(step=PipelineStep.START) for _ in range(2)
+    )
+    for action in (dead, alive):
+        await store.store_action(action)
+        intent = IntentData(
+            key=intent_key(action, "send_poll"), created_at=utcnow()
+        )
+        await store.add_intent(action.action_id, intent)
+    # a live node is still in the middle of this one
+    await store.claim(alive.action_id, "b", utcnow() + timedelta(minutes=1))
+
+    assert await reconcile_intents(store) == 1
+    assert await reconcile_intents(store) == 0
+
+    stored = await store.fetch_action_by_id(dead.action_id)
+    assert stored and stored.intents == []
+    stored = await store.fetch_action_by_id(alive.action_id)
+    assert stored and len(stored.intents) == 1
@@ -0,0 +1,336 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import telegram
+
+from pinhead import pipeline
+from pinhead.cache import LRUCache
+from pinhead.cleanup import CleanupQueue
+from pinhead.clock import utcnow
+from pinhead.constants import (
+    DEFAULT_PIPELINE_CONCURRENCY,
+    DEFAULT_SCAN_BATCH_SIZE,
+    NO_IDX,
+    YES_IDX,
+)
+from pinhead.data import CHAT_ID, ActionType, PipelineStep, TargetData
+from pinhead.dispatcher import Priority, TelegramDispatcher
+from pinhead.helpers import ensured
+from pinhead.pipeline import (
+    calculate_poll_results,
+    execute_action,
+    execute_scheduled_actions,
+    execute_single_action,
+    process_pipeline_step,
+    run_pipeline_for,
+)
+from pinhead.store import MemoryActionStore
+from tests.data import (
+    generate_action_data,
+    generate_poll_data,
+    generate_vote_data,
+    utcnow_ms,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_pending_runs():
+    # pending runs are module state, don't leak them into other tests
+    yield
+    pipeline._pending.clear()
+
+
+class RecordingJobQueue:
+    def __init__(self) -> None:
+        self.runs: list[tuple] = []
+
+    def run_once(self, callback, when, data=None, **kwargs) -> None:
+        self.runs.append((callback, when, data))
+
+
+def test_run_pipeline_for_coalesces_pending_runs() -> None:
+    job_queue = RecordingJobQueue()
+    ctx = SimpleNamespace(job_queue=job_queue)
+
+    run_pipeline_for(ctx, "a", 1)  # type: ignore
+    run_pipeline_for(ctx, "a", 1)  # type: ignore
+    run_pipeline_for(ctx, "b")  # type: ignore
+
+    assert job_queue.runs == [
+        (execute_single_action, 0, ("a", 1)),
+        (execute_single_action, 0, ("b", None)),
+    ]
+
+
+def test_calculate_poll_results_from_counts() -> None:
+    action = generate_action_data()
+    action.poll = generate_poll_data()
+    action.poll.counts = [3, 1]
+
+    results = calculate_poll_results(action)
+
+    assert results[YES_IDX] == 3
+    assert results[NO_IDX] == 1
+
+
+def test_calculate_poll_results_without_counts() -> None:
+    action = generate_action_data()
+    action.poll = generate_poll_data()
+    action.poll.votes = [generate_vote_data(user_id=x) for x in (1, 2)]
+
+    results = calculate_poll_results(action)
+
+    assert results[YES_IDX] == 2
+    assert results[NO_IDX] == 0
+
+
+async def test_action_leased_by_another_node_is_retried_later() -> None:
+    store = MemoryActionStore()
+    action = generate_action_data()
+    await store.store_action(action)
+    lease_until = utcnow_ms() + timedelta(minutes=1)
+    await store.claim(action.action_id, "other", lease_until)
+    bot = SimpleNamespace()  # any bot call would fail
+    scheduler = RecordingScheduler()
+    ctx = SimpleNamespace(
+        bot=bot,
+        job=SimpleNamespace(data=(action.action_id, None)),
+        application=SimpleNamespace(
+            store=store, node_id="this", scheduler=scheduler
+        ),
+    )
+
+    await execute_single_action(ctx)  # type: ignore
+
+    stored = await store.fetch_action_by_id(action.action_id)
+    assert stored and stored.step == action.step
+    assert stored.owner == "other"
+    assert scheduler.scheduled == {action.action_id: lease_until}
+
+
+async def test_grouped_ban_skips_users_that_cannot_be_banned() -> None:
+    action = generate_action_data(action_type=ActionType.BAN)
+    action.duration = 0
+    action.targets = [
+        TargetData(user_id="1", message_id="11"),
+        TargetData(user_id="2"),
+        TargetData(user_id="3", message_id="33"),
+    ]
+    store = MemoryActionStore()
+    await store.store_action(action)
+    banned = []
+
+    async def ban_chat_member(chat_id, user_id, **kwargs) -> None:
+        if user_id == "2":
+            raise telegram.error.BadRequest("User is an administrator")
+        banned.append(user_id)
+
+    ctx = SimpleNamespace(
+        bot=SimpleNamespace(ban_chat_member=ban_chat_member),
+        job_queue=RecordingJobQueue(),
+        application=SimpleNamespace(
+            store=store,
+            dispatcher=TelegramDispatcher(),
+            cleanup_queue=CleanupQueue(),
+        ),
+    )
+
+    result = await execute_action(ctx, action)  # type: ignore
+
+    assert result.step == PipelineStep.DONE
+    assert sorted(banned) == ["1", "3"]
+    assert ctx.application.cleanup_queue.drain() == {CHAT_ID: ["11", "33"]}
+
+    # run again after a crash, the completed bans are not repeated
+    stored = ensured(await store.fetch_action_by_id(action.action_id))
+    await execute_action(ctx, stored)  # type: ignore
+    assert sorted(banned) == ["1", "3"]
+    await ctx.application.dispatcher.close()
+
+
+class RecordingScheduler:
+    def __init__(self) -> None:
+        self.scheduled: dict[str, datetime] = {}
+
+    def schedule(self, action_id: str, execute_at: datetime) -> None:
+        self.scheduled[action_id] = execute_at
+
+    def discard(self, action_id: str) -> None:
+        self.scheduled.pop(action_id, None)
+
+
+def _poll_context(store: MemoryActionStore, stopped: list[str]):
+    async def stop_poll(chat_id, message_id) -> None:
+        stopped.append(message_id)
+
+    return SimpleNamespace(
+        bot=SimpleNamespace(stop_poll=stop_poll),
+        job_queue=RecordingJobQueue(),
+        application=SimpleNamespace(
+            store=store,
+            dispatcher=TelegramDispatcher(),
+            cleanup_queue=CleanupQueue(),
+            scheduler=RecordingScheduler(),
+            poll_cache=LRUCache(maxsize=10, ttl=60),
+        ),
+    )
+
+
+async def test_idle_poll_backs_off_until_deadline() -> None:
+    store = MemoryActionStore()
+    action = generate_action_data(step=PipelineStep.POLL)
+    action.poll = generate_poll_data()
+    action.poll.close_at = utcnow() + timedelta(minutes=3)
+    await store.store_action(action)
+    ctx = _poll_context(store, [])
+
+    delays = []
+    for _ in range(4):
+        stored = ensured(await store.fetch_action_by_id(action.action_id))
+        await process_pipeline_step(ctx, stored)  # type: ignore
+        scheduled = ctx.application.scheduler.scheduled[action.action_id]
+        delays.append(round((scheduled - utcnow()).total_seconds() / 30))
+
+    assert delays == [1, 2, 4, 6]  # the last one capped by the deadline
+    stored = ensured(await store.fetch_action_by_id(action.action_id))
+    assert stored.step == PipelineStep.POLL and stored.idle_runs == 4
+    assert await store.fetch_ready_actions() == []
+    await ctx.application.dispatcher.close()
+
+
+async def test_expired_poll_is_closed_and_cleaned_up() -> None:
+    store = MemoryActionStore()
+    action = generate_action_data(step=PipelineStep.POLL)
+    action.poll = generate_poll_data()
+    action.poll.close_at = utcnow() - timedelta(seconds=1)
+    action.duplicate_trigger_ids = ["900"]
+    await store.store_action(action)
+    stopped: list[str] = []
+    ctx = _poll_context(store, stopped)
+
+    await process_pipeline_step(ctx, action)  # type: ignore
+
+    stored = ensured(await store.fetch_action_by_id(action.action_id))
+    assert stored.step == PipelineStep.DONE
+    assert stored.poll and stored.poll.win_result is False
+    assert stopped == [action.poll.message_id]
+    assert ctx.application.cleanup_queue.drain() == {
+        CHAT_ID: [action.poll.message_id, action.trigger_message_id, "900"]
+    }
+    await ctx.application.dispatcher.close()
+
+
+async def test_scan_claims_only_what_the_workers_can_take(
+    monkeypatch,
+) -> None:
+    store = MemoryActionStore()
+    for idx in range(7):
+        action = generate_action_data(execute_at=utcnow())
+        action.chat_id = idx % 3
+        await store.store_action(action)
+    claims: list[tuple[int, int]] = []
+    processed: list[str] = []
+
+    async def claim_ready(owner, lease_until, limit):
+        batch = await MemoryActionStore.claim_ready(
+            store, owner, lease_until, limit
+        )
+        claims.append((limit, len(batch)))
+        return batch
+
+    async def advance(ctx, chat_id, action_id, release=True):
+        claimed = sum(x for _, x in claims)
+        assert claimed - len(processed) <= 2
+        await asyncio.sleep(0)
+        processed.append(action_id)
+
+    monkeypatch.setattr(store, "claim_ready", claim_ready)
+    monkeypatch.setattr(pipeline, "_advance", advance)
+    pipeline.set_scan_batch_size(2)
+    try:
+        ctx = SimpleNamespace(
+            application=SimpleNamespace(store=store, node_id="this")
+        )
+        await execute_scheduled_actions(ctx)  # type: ignore
+    finally:
+        pipeline.set_scan_batch_size(DEFAULT_SCAN_BATCH_SIZE)
+
+    assert len(processed) == 7
+    assert claims[0] == (2, 2)
+    assert all(limit <= 2 for limit, _ in claims)
+    assert len(claims) > 3
+
+
+async def test_dispatcher_wait_frees_the_pipeline_slot(monkeypatch) -> None:
+    store = MemoryActionStore()
+    actions = [generate_action_data(), generate_action_data()]
+    for chat_id, action in enumerate(actions, 1):
+        action.chat_id = chat_id
+        await store.store_action(action)
+    dispatcher = TelegramDispatcher()
+    unblock = asyncio.Event()
+    processed: list[int] = []
+
+    async def throttled(chat_id: int) -> None:
+        await unblock.wait()
+
+    async def process(ctx, action) -> None:
+        if action.chat_id == 1:
+            await pipeline.dispatch(ctx, Priority.POLL, throttled, 1)
+        processed.append(action.chat_id)
+
+    monkeypatch.setattr(pipeline, "_process_action", process)
+    pipeline.set_concurrency(1)
+    ctx = SimpleNamespace(
+        application=SimpleNamespace(
+            store=store, node_id="this", dispatcher=dispatcher
+        )
+    )
+    try:
+        waiting = asyncio.create_task(
+            pipeline._advance(ctx, 1, actions[0].action_id)  # type: ignore
+        )
+        await asyncio.sleep(0)
+        await asyncio.wait_for(
+            pipeline._advance(ctx, 2, actions[1].action_id),  # type: ignore
+            timeout=1,
+        )
+        assert processed == [2]
+
+        unblock.set()
+        await waiting
+        assert processed == [2, 1]
+    finally:
+        pipeline.set_concurrency(DEFAULT_PIPELINE_CONCURRENCY)
+        await dispatcher.close()
+
+
+async def test_idle_chat_locks_are_dropped(monkeypatch) -> None:
+    store = MemoryActionStore()
+    actions = [generate_action_data(), generate_action_data()]
+    for action in actions:
+        await store.store_action(action)
+    processed: list[str] = []
+
+    async def process(ctx, action) -> None:
+        assert CHAT_ID in pipeline._chat_locks
+        await asyncio.sleep(0)
+        processed.append(action.action_id)
+
+    monkeypatch.setattr(pipeline, "_process_action", process)
+    ctx = SimpleNamespace(
+        application=SimpleNamespace(store=store, node_id="this")
+    )
+
+    await asyncio.gather(
+        *(
+            pipeline._advance(ctx, CHAT_ID, x.action_id)  # type: ignore
+            for x in actions
+        )
+    )
+
+    assert len(processed) == 2
+    assert pipeline._chat_locks == {}
+    assert not pipeline._chat_lock_users
@@ -0,0 +1,85 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from pinhead.scheduler import ActionScheduler
+
+NOW = datetime.now(tz=UTC)
+
+
+class FakeJob:
+    def __init__(self, when: float) -> None:
+        self.when = when
+        self.removed = False
+
+    def schedule_removal(self) -> None:
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self) -> None:
+        self.jobs: list[FakeJob] = []
+
+    def run_once(self, callback, when: float, name: str) -> FakeJob:
+        job = FakeJob(when)
+        self.jobs.append(job)
+        return job
+
+
+async def _noop(ctx) -> None:
+    pass
+
+
+@pytest.fixture
+def job_queue() -> FakeJobQueue:
+    return FakeJobQueue()
+
+
+@pytest.fixture
+def scheduler(job_queue: FakeJobQueue) -> ActionScheduler:
+    return ActionScheduler(job_queue, _noop)  # type: ignore
+
+
+def test_pop_due_in_execute_at_order(scheduler: ActionScheduler) -> None:
+    scheduler.load(
+        [
+            ("late", NOW + timedelta(hours=1)),
+            ("second", NOW - timedelta(seconds=1)),
+            ("first", NOW - timedelta(seconds=10)),
+        ]
+    )
+
+    assert scheduler.pop_due(NOW) == ["first", "second"]
+    assert len(scheduler) == 1
+    assert scheduler.next_due() == NOW + timedelta(hours=1)
+
+
+def test_reschedule_and_discard(scheduler: ActionScheduler) -> None:
+    scheduler.schedule("a", NOW - timedelta(seconds=5))
+    scheduler.schedule("b", NOW - timedelta(seconds=5))
+    scheduler.schedule("a", NOW + timedelta(minutes=5))
+    scheduler.discard("b")
+
+    assert scheduler.pop_due(NOW) == []
+    assert "a" in scheduler
+    assert scheduler.pop_due(NOW + timedelta(minutes=5)) == ["a"]
+
+
+def test_naive_datetimes_are_utc(scheduler: ActionScheduler) -> None:
+    naive = NOW.replace(tzinfo=None)
+    scheduler.schedule("a", naive)
+
+    assert scheduler.next_due() == NOW
+
+
+def test_rearms_only_for_earlier_actions(
+    scheduler: ActionScheduler, job_queue: FakeJobQueue
+) -> None:
+    scheduler.schedule("a", NOW + timedelta(hours=1))
+    scheduler.schedule("b", NOW + timedelta(hours=2))
+    assert len(job_queue.jobs) == 1
+
+    scheduler.schedule("c", NOW - timedelta(seconds=1))
+    assert len(job_queue.jobs) == 2
+    assert job_queue.jobs[0].removed
+    assert job_queue.jobs[1].when == 0
@@ -0,0 +1,87 @@
+import asyncio
+import signal
+from types import SimpleNamespace
+
+from pinhead.app import on_startup
+from pinhead.clock import utcnow
+from pinhead.data import IntentData
+from pinhead.metrics import STARTUP_SECONDS
+from pinhead.startup import StartupTimer
+from pinhead.store import MemoryActionStore
+from tests.data import generate_action_data
+
+
+def test_startup_phases_and_marks() -> None:
+    timer = StartupTimer()
+
+    with timer.phase("imports"):
+        pass
+    timer.mark("ready")
+    ready = timer.phases["ready"]
+    timer.mark("ready")
+
+    assert list(timer.phases) == ["imports", "ready"]
+    assert timer.phases["ready"] == ready
+    assert STARTUP_SECONDS.value("ready") == ready
+    assert "imports" in timer.report()
+
+
+def test_first_update_is_recorded_once() -> None:
+    timer = StartupTimer()
+
+    timer.update_handled()
+    first = timer.phases["first_update"]
+    timer.update_handled()
+
+    assert timer.first_update.is_set()
+    assert timer.phases["first_update"] == first
+
+
+class RecordingScheduler:
+    def __init__(self) -> None:
+        self.loaded: list = []
+
+    def load(self, entries) -> None:
+        self.loaded += entries
+
+
+def _application(store: MemoryActionStore) -> SimpleNamespace:
+    return SimpleNamespace(
+        fast_start=True,
+        store=store,
+        scheduler=RecordingScheduler(),
+        metrics_port=0,
+    )
+
+
+async def test_fast_start_reconciles_intents_first() -> None:
+    store = MemoryActionStore()
+    action = generate_action_data()
+    await store.store_action(action)
+    await store.add_intent(
+        action.action_id, IntentData(key="call", created_at=utcnow())
+    )
+    application = _application(store)
+
+    await on_startup(application)  # type: ignore
+
+    # steps start right after post_init, no open intent is left for them
+    assert await store.fetch_open_intents() == []
+    assert [x for x, _ in application.scheduler.loaded] == [action.action_id]
+    await application.startup_task
+
+
+async def test_failed_fast_start_stops_the_bot(monkeypatch) -> None:
+    class BrokenStore(MemoryActionStore):
+        async def ensure_indexes(self) -> None:
+            raise ConnectionError("database is down")
+
+    raised: list[int] = []
+    monkeypatch.setattr(signal, "raise_signal", raised.append)
+    application = _application(BrokenStore())
+
+    await on_startup(application)  # type: ignore
+    await asyncio.gather(application.startup_task, return_exceptions=True)
+    await asyncio.sleep(0)  # done callbacks run on the next loop pass
+
+    assert raised == [signal.SIGTERM]
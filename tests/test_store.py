@@ -0,0 +1,316 @@
+import datetime
+
+import pytest
+
+from pinhead.data import ActionType, LeaseRef, PipelineStep, PollRef
+from pinhead.store import ActionStore, SqliteActionStore
+from tests.data import (
+    generate_action_data,
+    generate_poll_data,
+    generate_vote_data,
+    utcnow_ms,
+)
+
+NOW = utcnow_ms()
+
+
+async def test_store_and_fetch(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW)
+    await store.store_action(action)
+
+    assert await store.fetch_action_by_id(action.action_id) == action
+    assert await store.fetch_action_by_id("missing") is None
+    assert await store.count_actions() == 1
+
+
+@pytest.fixture
+async def prepared_actions(store: ActionStore) -> None:
+    for action in [
+        generate_action_data(execute_at=NOW, step=PipelineStep.START),
+        generate_action_data(
+            execute_at=NOW + datetime.timedelta(seconds=10),
+            step=PipelineStep.POLL,
+        ),
+        generate_action_data(
+            execute_at=NOW - datetime.timedelta(seconds=10),
+            step=PipelineStep.CONSENSUS,
+        ),
+        generate_action_data(
+            execute_at=NOW - datetime.timedelta(days=300),
+            step=PipelineStep.EXECUTE,
+        ),
+        generate_action_data(execute_at=NOW, step=PipelineStep.ERROR),
+        generate_action_data(execute_at=NOW, step=PipelineStep.DONE),
+    ]:
+        await store.store_action(action)
+
+
+async def test_fetch_ready_actions(
+    store: ActionStore, prepared_actions
+) -> None:
+    ready = await store.fetch_ready_actions()
+
+    assert [x.step for x in ready] == [
+        PipelineStep.EXECUTE,
+        PipelineStep.CONSENSUS,
+        PipelineStep.START,
+    ]
+
+
+async def test_iter_ready_actions_limit(
+    store: ActionStore, prepared_actions
+) -> None:
+    ready = [
+        action
+        async for action in store.iter_ready_actions(batch_size=1, limit=2)
+    ]
+
+    assert [x.step for x in ready] == [
+        PipelineStep.EXECUTE,
+        PipelineStep.CONSENSUS,
+    ]
+
+
+async def test_fetch_scheduled_actions(
+    store: ActionStore, prepared_actions
+) -> None:
+    scheduled = await store.fetch_scheduled_actions()
+
+    assert len(scheduled) == 4
+    assert NOW + datetime.timedelta(seconds=10) in {x for _, x in scheduled}
+
+
+async def test_poll_and_votes(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.POLL)
+    poll_data = generate_poll_data()
+    await store.store_action(action)
+    await store.store_poll(action, poll_data)
+
+    assert await store.fetch_poll_ref(poll_data.id) == PollRef(
+        action_id=action.action_id, step=PipelineStep.POLL
+    )
+
+    vote = generate_vote_data()
+    await store.store_vote(action.action_id, vote)
+    await store.store_vote(action.action_id, vote)
+    await store.store_vote(action.action_id, generate_vote_data(user_id=1))
+
+    result = await store.fetch_action_by_poll_id(poll_data.id)
+    assert result and result.poll
+    assert len(result.poll.votes) == 2
+    assert result.poll.counts == [2, 0]
+
+    ready = [x async for x in store.iter_ready_actions(with_votes=False)]
+    assert ready[0].poll and ready[0].poll.votes == []
+
+    vote.answer = [1]
+    await store.store_vote(action.action_id, vote)
+    result = await store.fetch_action_by_id(action.action_id)
+    assert result and result.poll
+    assert result.poll.counts == [1, 1]
+
+    vote.answer = []
+    await store.store_votes([(action.action_id, vote)])
+    result = await store.fetch_action_by_id(action.action_id)
+    assert result and result.poll
+    assert len(result.poll.votes) == 1
+    assert result.poll.counts == [1, 0]
+
+
+async def test_transition(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW, step=PipelineStep.START)
+    poll_data = generate_poll_data()
+    await store.store_action(action)
+
+    updated = await store.transition(
+        action.action_id,
+        from_step=PipelineStep.START,
+        to_step=PipelineStep.POLL,
+        extra_fields={"poll": poll_data},
+    )
+    assert updated and updated.step == PipelineStep.POLL
+    assert updated.poll == poll_data
+
+    repeated = await store.transition(
+        action.action_id,
+        from_step=PipelineStep.START,
+        to_step=PipelineStep.POLL,
+    )
+    assert repeated is None
+
+    later = NOW + datetime.timedelta(hours=1)
+    done = await store.transition(
+        action.action_id,
+        from_step=PipelineStep.POLL,
+        to_step=PipelineStep.CONSENSUS,
+        extra_fields={"poll.win_result": True, "execute_at": later},
+    )
+    assert done and done.poll and done.poll.win_result
+    assert done.execute_at == later
+    assert await store.fetch_ready_actions() == []
+
+
+async def test_claim_lease(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW)
+    await store.store_action(action)
+    lease_until = utcnow_ms() + datetime.timedelta(minutes=1)
+
+    claimed = await store.claim(action.action_id, "a", lease_until)
+    assert claimed and claimed.owner == "a"
+    assert claimed.lease_until == lease_until
+    assert await store.claim(action.action_id, "b", lease_until) is None
+    assert await store.claim(action.action_id, "a", lease_until)
+
+    await store.release_leases("b", [action.action_id])
+    assert await store.claim(action.action_id, "b", lease_until) is None
+    await store.release_leases("a", [action.action_id])
+    assert await store.claim(action.action_id, "b", lease_until)
+
+
+async def test_fetch_lease_ref(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW)
+    await store.store_action(action)
+    lease_until = utcnow_ms() + datetime.timedelta(minutes=1)
+
+    ref = await store.fetch_lease_ref(action.action_id)
+    assert ref == LeaseRef(
+        action_id=action.action_id, chat_id=action.chat_id, step=action.step
+    )
+    await store.claim(action.action_id, "a", lease_until)
+    ref = await store.fetch_lease_ref(action.action_id)
+    assert ref and ref.owner == "a" and ref.lease_until == lease_until
+    assert await store.fetch_lease_ref("missing") is None
+
+
+async def test_claim_expired_lease(store: ActionStore) -> None:
+    action = generate_action_data(execute_at=NOW)
+    await store.store_action(action)
+    expired = utcnow_ms() - datetime.timedelta(seconds=1)
+    await store.claim(action.action_id, "dead", expired)
+
+    assert await store.claim(action.action_id, "b", expired)
+    await store.renew_leases("b", [action.action_id], NOW)
+    assert await store.claim(action.action_id, "c", expired)
+
+
+async def test_claim_ready_batches(
+    store: ActionStore, prepared_actions
+) -> None:
+    lease_until = utcnow_ms() + datetime.timedelta(minutes=1)
+
+    ready = await store.fetch_ready_actions()
+
+    first = await store.claim_ready("a", lease_until, limit=2)
+    assert [x.action_id for x in first] == [x.action_id for x in ready[:2]]
+    assert all(x.chat_id == ready[0].chat_id for x in first)
+    for ref in first:
+        stored = await store.fetch_action_by_id(ref.action_id)
+        assert stored and stored.owner == "a"
+        assert stored.lease_until == lease_until
+    second = await store.claim_ready("b", lease_until)
+    assert [x.action_id for x in second] == [ready[2].action_id]
+    assert await store.claim_ready("c", lease_until) == []
+
+    later = lease_until + datetime.timedelta(minutes=1)
+    await store.renew_leases("a", [x.action_id for x in first], later)
+    stored = await store.fetch_action_by_id(first[0].action_id)
+    assert stored and stored.lease_until == later
+
+    await store.release_leases("a", [x.action_id for x in first])
+    stored = await store.fetch_action_by_id(first[0].action_id)
+    assert stored and stored.owner is None and stored.lease_until is None
+    assert len(await store.claim_ready("c", lease_until)) == 2
+
+
+async def test_archive_finished(store: ActionStore) -> None:
+    old = NOW - datetime.timedelta(days=30)
+    finished = generate_action_data(execute_at=old, step=PipelineStep.DONE)
+    finished.finished_at = old
+    recent = generate_action_data(execute_at=NOW, step=PipelineStep.ERROR)
+    recent.finished_at = NOW
+    active = generate_action_data(execute_at=old, step=PipelineStep.POLL)
+    for action in (finished, recent, active):
+        await store.store_action(action)
+
+    cutoff = NOW - datetime.timedelta(days=1)
+    assert await store.archive_finished(cutoff) == 1
+    assert await store.archive_finished(cutoff) == 0
+
+    assert await store.fetch_action_by_id(finished.action_id) is None
+    assert await store.count_actions() == 2
+    assert await store.fetch_archived_actions(finished.chat_id) == [finished]
+    later = utcnow_ms() + datetime.timedelta(seconds=1)
+    assert not await store.fetch_archived_actions(finished.chat_id, later)
+
+    assert await store.purge_archive(cutoff) == 0
+    assert await store.purge_archive(later) == 1
+    assert await store.fetch_archived_actions(finished.chat_id) == []
+
+
+async def test_store_or_attach(store: ActionStore) -> None:
+    await store.ensure_indexes()
+    action = generate_action_data(execute_at=NOW)
+    assert await store.store_or_attach(action) == action
+
+    duplicate = generate_action_data(execute_at=NOW)
+    duplicate.target_message_id = action.target_message_id
+    duplicate.trigger_message_id = "900"
+    attached = await store.store_or_attach(duplicate)
+    assert attached.action_id == action.action_id
+    assert attached.duplicate_trigger_ids == ["900"]
+    assert await store.store_or_attach(duplicate) == attached
+    assert await store.count_actions() == 1
+
+    other_type = generate_action_data(action_type=ActionType.BAN)
+    other_type.target_message_id = action.target_message_id
+    assert await store.store_or_attach(other_type) == other_type
+
+    # once the first one is finished the same command starts anew
+    await store.transition(
+        action.action_id, PipelineStep.START, PipelineStep.DONE
+    )
+    assert await store.store_or_attach(duplicate) == duplicate
+    assert await store.count_actions() == 3
+
+
+async def test_active_target_is_unique(store: ActionStore) -> None:
+    await store.ensure_indexes()
+    action = generate_action_data(execute_at=NOW)
+    await store.store_action(action)
+    duplicate = generate_action_data(execute_at=NOW)
+    duplicate.target_message_id = action.target_message_id
+
+    with pytest.raises(Exception):
+        await store.store_action(duplicate)
+
+
+async def test_sqlite_store_or_attach_across_connections(
+    tmp_path, monkeypatch
+) -> None:
+    path = str(tmp_path / "shared.sqlite3")
+    first, second = SqliteActionStore(path), SqliteActionStore(path)
+    await first.ensure_indexes()
+    action = generate_action_data(execute_at=NOW)
+    duplicate = generate_action_data(execute_at=NOW)
+    duplicate.target_message_id = action.target_message_id
+    duplicate.trigger_message_id = "900"
+    # the second process looked before the first one inserted
+    fetch, lookups = second._fetch_active_target, []
+
+    def fetch_late(action):
+        lookups.append(action.action_id)
+        return fetch(action) if len(lookups) > 1 else None
+
+    monkeypatch.setattr(second, "_fetch_active_target", fetch_late)
+
+    await first.store_or_attach(action)
+    attached = await second.store_or_attach(duplicate)
+
+    assert attached.action_id == action.action_id
+    assert attached.duplicate_trigger_ids == ["900"]
+    stored = await first.fetch_action_by_id(action.action_id)
+    assert stored and stored.duplicate_trigger_ids == ["900"]
+    assert await first.count_actions() == 1
+    assert len(lookups) == 2
+    await first.close()
+    await second.close()
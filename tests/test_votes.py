@@ -0,0 +1,73 @@
+import pytest
+
+from pinhead.votes import VoteBuffer
+from tests.data import generate_vote_data
+
+
+class FakeStore:
+    def __init__(self) -> None:
+        self.batches: list[list] = []
+
+    async def store_votes(self, votes) -> None:
+        self.batches.append(votes)
+
+
+def test_disabled_with_zero_window() -> None:
+    assert not VoteBuffer(window=0, max_votes=10).enabled
+    assert VoteBuffer(window=0.01, max_votes=10).enabled
+
+
+def test_coalesces_votes_per_user() -> None:
+    buffer = VoteBuffer(window=0.01, max_votes=3)
+
+    assert not buffer.add("a", generate_vote_data(user_id=1))
+    assert not buffer.add("a", generate_vote_data(user_id=1))
+    assert not buffer.add("b", generate_vote_data(user_id=1))
+    assert len(buffer) == 2
+    assert buffer.add("a", generate_vote_data(user_id=2))
+
+
+async def test_flush_writes_single_bulk() -> None:
+    store = FakeStore()
+    buffer = VoteBuffer(window=0.01, max_votes=10)
+    buffer.add("a", generate_vote_data(user_id=1))
+    buffer.add("a", generate_vote_data(user_id=2))
+    buffer.add("b", generate_vote_data(user_id=1))
+
+    assert await buffer.flush(store) == ["a", "b"]  # type: ignore
+    assert await buffer.flush(store) == []  # type: ignore
+    assert len(store.batches) == 1
+    assert len(store.batches[0]) == 3
+    assert len(buffer) == 0
+
+
+async def test_failed_flush_keeps_votes() -> None:
+    class FailingStore:
+        async def store_votes(self, votes) -> None:
+            # a newer vote of the same user comes in during the write
+            buffer.add("a", newer)
+            raise ConnectionError("database is down")
+
+    buffer = VoteBuffer(window=0.01, max_votes=10)
+    older, newer = generate_vote_data(user_id=1), generate_vote_data(user_id=1)
+    newer.answer = [1]
+    buffer.add("a", older)
+    buffer.add("b", generate_vote_data(user_id=2))
+
+    with pytest.raises(ConnectionError):
+        await buffer.flush(FailingStore())  # type: ignore
+    assert len(buffer) == 2
+
+    store = FakeStore()
+    assert await buffer.flush(store) == ["a", "b"]  # type: ignore
+    assert [x for _, x in store.batches[0]][0].answer == [1]
+
+
+async def test_flush_clears_the_scheduled_mark() -> None:
+    buffer = VoteBuffer(window=0.01, max_votes=10)
+    buffer.add("a", generate_vote_data(user_id=1))
+
+    assert buffer.schedule()
+    assert not buffer.schedule()
+    await buffer.flush(FakeStore())  # type: ignore
+    assert buffer.schedule()